@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta
+from fechas import LIMA, ahora, parse_iso
+from repositorio import clave_orden
+
+# El resumen del grupo lo envía sólo la réplica dueña de este shard
+SHARD_LIDER = 0
+
+
+def rango_del_dia(dia):
+    # [00:00, 00:00 del día siguiente) en hora de Lima
+    desde = LIMA.localize(datetime.combine(dia, datetime.min.time()))
+    hasta = LIMA.localize(datetime.combine(dia + timedelta(days=1), datetime.min.time()))
+    return desde, hasta
+
+
+def proxima_ejecucion(desde, hora):
+    # Primer instante "hora" (hora de Lima) estrictamente posterior a "desde"
+    objetivo = LIMA.localize(datetime.combine(desde.astimezone(LIMA).date(), hora))
+    if objetivo <= desde:
+        objetivo = LIMA.localize(datetime.combine(objetivo.date() + timedelta(days=1), hora))
+    return objetivo
+
+
+def agrupar_por_chat(citas):
+    # telegram_id -> citas en orden de hora; los chats quedan ordenados por
+    # su primera cita del día. Los documentos sin telegram_id no tienen a
+    # quién enviarse y se omiten.
+    por_chat = {}
+    for c in sorted(citas, key=clave_orden):
+        if c.get("telegram_id") is None:
+            continue
+        por_chat.setdefault(c.get("telegram_id"), []).append(c)
+    return por_chat
+
+
+def linea_cita(c):
+    dt = parse_iso(c.get("fecha_hora", ""))
+    hora = dt.astimezone(LIMA).strftime("%H:%M") if dt else c.get("fecha_hora", "")
+    linea = f"🕒 {hora} - {c.get('cliente','')} ({c.get('proyecto','')})"
+    if c.get("modalidad"):
+        linea += f" · {c['modalidad']}"
+    return linea
+
+
+def reuniones(n):
+    return f"{n} reunión" if n == 1 else f"{n} reuniones"
+
+
+def render_agenda(dia, citas):
+    # Partes de la agenda de un chat: cabecera y una entrada por cita
+    partes = [f"📋 *Tu agenda de hoy {dia.strftime('%d/%m/%Y')}:* {reuniones(len(citas))}\n"]
+    for c in citas:
+        entrada = linea_cita(c)
+        if c.get("observaciones"):
+            entrada += f"\n   📝 {c['observaciones']}"
+        partes.append(entrada)
+    return partes
+
+
+def render_agenda_grupo(dia, por_chat):
+    # Partes de la agenda combinada: cabecera y una sección por chat
+    total = sum(len(citas) for citas in por_chat.values())
+    partes = [f"📋 *Agenda del equipo {dia.strftime('%d/%m/%Y')}:* {reuniones(total)}"]
+    for citas in por_chat.values():
+        usuario = citas[0].get("telegram_user") or "usuario"
+        partes.append(f"👤 @{usuario} ({len(citas)})\n" + "\n".join(linea_cita(c) for c in citas))
+    return partes
+
+
+class AgendaDiaria:
+    # Envía cada día, a "hora" (datetime.time en hora de Lima), la agenda
+    # del día a cada chat con recordatorios y una agenda combinada al grupo.
+    # Una sola consulta por rango de fecha_hora trae las citas del día, que
+    # se agrupan por telegram_id en memoria: el trabajo depende de las citas
+    # de ese día, no del tamaño de la colección ni del número de usuarios.
+    # Con varias réplicas sólo envía la dueña de SHARD_LIDER.
+
+    def __init__(self, repo, despachador, hora, grupo_id=None, coordinador=None):
+        self.repo = repo
+        self.despachador = despachador
+        self.hora = hora
+        self.grupo_id = grupo_id
+        self.coordinador = coordinador
+
+    def _ahora(self):
+        return ahora()
+
+    def es_lider(self):
+        return self.coordinador is None or SHARD_LIDER in self.coordinador.shards
+
+    async def enviar(self, dia):
+        desde, hasta = rango_del_dia(dia)
+        citas = await self.repo.en_rango(desde, hasta)
+        por_chat = agrupar_por_chat(citas)
+        # Sin esperar la entrega: el despachador reparte los envíos según
+        # sus límites y registra los errores
+        for telegram_id, citas_chat in por_chat.items():
+            try:
+                self.despachador.encolar_digest(telegram_id, render_agenda(dia, citas_chat), separador="\n")
+            except Exception as e:
+                # Un chat inválido no debe dejar sin agenda al resto
+                print(f"Error encolando la agenda de {telegram_id}: {e}")
+        if self.grupo_id and por_chat:
+            self.despachador.encolar_digest(self.grupo_id, render_agenda_grupo(dia, por_chat), separador="\n\n")
+        print(f"Agenda del {dia}: {len(citas)} recordatorios en {len(por_chat)} chats")
+        return len(por_chat)
+
+    async def run(self):
+        ultimo = self._ahora()
+        while True:
+            objetivo = proxima_ejecucion(ultimo, self.hora)
+            await asyncio.sleep(max((objetivo - self._ahora()).total_seconds(), 0))
+            ultimo = objetivo
+            if not self.es_lider():
+                continue
+            try:
+                await self.enviar(objetivo.date())
+            except Exception as e:
+                print(f"Error enviando la agenda del {objetivo.date()}: {e}")
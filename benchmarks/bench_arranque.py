@@ -0,0 +1,86 @@
+# Mide el arranque en frío del bot en procesos nuevos (sin red):
+# importar main, construir la Application, importar y crear los clientes
+# pesados, y el primer parseo de fecha con y sin precalentamiento.
+# Uso: python benchmarks/bench_arranque.py [--repeticiones 3]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PREPARAR = """
+import os, sys, time
+sys.path.insert(0, {raiz!r})
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:ABCDEF")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+"""
+
+ETAPAS = {
+    "import main": """
+t = time.perf_counter()
+import main
+print(time.perf_counter() - t)
+""",
+    "crear_app (Telegram)": """
+import main
+t = time.perf_counter()
+main.crear_app()
+print(time.perf_counter() - t)
+""",
+    "importar_clientes": """
+import main
+t = time.perf_counter()
+main.importar_clientes()
+print(time.perf_counter() - t)
+""",
+    "configurar (repo en memoria)": """
+import main
+from repositorio import RepositorioMemoria
+t = time.perf_counter()
+main.configurar(repo_base=RepositorioMemoria(), ruta_escrituras=":memory:")
+print(time.perf_counter() - t)
+""",
+    "primer parseo en frío": """
+import fechas
+t = time.perf_counter()
+fechas.parse_fecha_hora_gpt("el lunes a las 4 pm")
+print(time.perf_counter() - t)
+""",
+    "fechas.precalentar": """
+import fechas
+t = time.perf_counter()
+fechas.precalentar()
+print(time.perf_counter() - t)
+""",
+    "primer parseo precalentado": """
+import fechas
+fechas.precalentar()
+t = time.perf_counter()
+fechas.parse_fecha_hora_gpt("el lunes a las 4 pm")
+print(time.perf_counter() - t)
+""",
+}
+
+
+def medir(codigo):
+    salida = subprocess.run(
+        [sys.executable, "-c", PREPARAR.format(raiz=RAIZ) + codigo],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(salida.strip().splitlines()[-1])
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque en frío de Neomind")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+    print(f"{'etapa':<30} {'mediana ms':>11} {'máx ms':>9}")
+    for nombre, codigo in ETAPAS.items():
+        tiempos = [medir(codigo) for _ in range(args.repeticiones)]
+        print(f"{nombre:<30} {statistics.median(tiempos) * 1000:>11.1f} {max(tiempos) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,135 @@
+# Benchmark offline del bot: ejecuta mensaje_handler y un tick del
+# scheduler contra Firestore, OpenAI y Telegram en memoria (sin red).
+# Uso: python benchmarks/bench_bot.py [--tamanos 1000 10000 100000] [--chats 50] [--latencia-gpt 0.05]
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import main  # noqa: E402
+from cache import CacheExtracciones  # noqa: E402
+from estados import AlmacenEstados  # noqa: E402
+from fechas import ahora, hoy  # noqa: E402
+from intenciones import RouterIntenciones  # noqa: E402
+from notificaciones import Despachador  # noqa: E402
+from scheduler import SchedulerRecordatorios, TOLERANCIA_HORA  # noqa: E402
+from cache_recordatorios import RepositorioConCache  # noqa: E402
+from fakes import BotFalso, GPTFalso, crear_contexto, crear_update, sembrar  # noqa: E402
+
+GUION = [
+    "qué citas tengo hoy",
+    "mis recordatorios de mañana",
+    "¿Cuándo es mi reunión con {cliente}?",
+    "recordatorios del proyecto {proyecto}",
+    "agenda una reunión con un cliente nuevo mañana a las 5 pm en Torre Sol",
+    "sí",
+    "busca la nota donde hablamos de la firma del contrato en notaria",
+    "sí",
+    "hola, ¿qué puedes hacer?",
+]
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def preparar(total, usuarios, latencia_gpt):
+    base = sembrar(total, usuarios)
+    gpt = GPTFalso(latencia_gpt)
+    main.configurar(repo_base=base, gpt=gpt, ruta_escrituras=":memory:")
+    main.estados = AlmacenEstados()
+    main.router = RouterIntenciones(main.CAMPOS, main.CAMPO_FLEX)
+    main.cache_extracciones = CacheExtracciones(hoy)
+    bot = BotFalso()
+    main.despachador = Despachador(tasa_global=1e9, tasa_chat=1e9, tasa_grupo=1e9, rafaga_grupo=1e9)
+    main.despachador.iniciar(bot)
+    return base, gpt, bot
+
+
+async def conversar(chat_id, base, bot, latencias):
+    ejemplo = next((d for d in base.docs.values() if d["telegram_id"] == chat_id), None) or {}
+    contexto = crear_contexto(bot)
+    for plantilla in GUION:
+        texto = plantilla.format(
+            cliente=ejemplo.get("cliente", "Abelardo").split()[0],
+            proyecto=ejemplo.get("proyecto", "Mirador"),
+        )
+        inicio = time.perf_counter()
+        await main.mensaje_handler(crear_update(chat_id, texto, bot), contexto)
+        latencias.append(time.perf_counter() - inicio)
+
+
+async def bench_mensajes(total, chats, latencia_gpt):
+    base, gpt, bot = preparar(total, max(chats, total // 100), latencia_gpt)
+    latencias = []
+    inicio = time.perf_counter()
+    await asyncio.gather(*(conversar(chat_id, base, bot, latencias) for chat_id in range(1, chats + 1)))
+    duracion = time.perf_counter() - inicio
+    return {
+        "mensajes": len(latencias),
+        "msg_s": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "lecturas_op": base.lecturas / len(latencias),
+        "llamadas_gpt": gpt.llamadas,
+        "router": main.router.estadisticas()["tasa_aciertos"],
+    }
+
+
+async def bench_scheduler(total):
+    # Repartidos en +-2 días para que la ventana de una hora tenga carga real
+    base = sembrar(total, max(10, total // 100), dias=2)
+    scheduler = SchedulerRecordatorios(RepositorioConCache(base))
+    avisos = []
+
+    async def notificar(lote):
+        avisos.extend(lote)
+        return [None] * len(lote)
+
+    now = ahora()
+    inicio = time.perf_counter()
+    await scheduler.cargar_ventana(now - TOLERANCIA_HORA, now + scheduler.ventana)
+    carga = time.perf_counter() - inicio
+    lecturas = base.lecturas
+    # Un tick por cada vencimiento del heap, como haría run() sin dormir
+    ticks = []
+    while scheduler._heap:
+        inicio = time.perf_counter()
+        await scheduler._disparar(scheduler._heap[0][0], notificar)
+        ticks.append(time.perf_counter() - inicio)
+    return {
+        "carga_ms": carga * 1000,
+        "lecturas": lecturas,
+        "tick_ms": (sum(ticks) / len(ticks) * 1000) if ticks else 0.0,
+        "ticks": len(ticks),
+        "avisos": len(avisos),
+    }
+
+
+async def ejecutar(args):
+    print(f"{'reminders':>10} {'msgs':>6} {'msg/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'lect/op':>8} {'gpt':>5} {'router':>7}"
+          f" | {'carga ms':>9} {'lecturas':>8} {'ticks':>6} {'ms/tick':>8} {'avisos':>6}")
+    for total in args.tamanos:
+        # Los logs del bot (estadísticas del router, etc.) no ensucian la tabla
+        with redirect_stdout(open(os.devnull, "w")):
+            m = await bench_mensajes(total, args.chats, args.latencia_gpt)
+            s = await bench_scheduler(total)
+        print(f"{total:>10} {m['mensajes']:>6} {m['msg_s']:>8.1f} {m['p50_ms']:>8.1f} {m['p99_ms']:>8.1f}"
+              f" {m['lecturas_op']:>8.1f} {m['llamadas_gpt']:>5} {m['router']:>7.0%}"
+              f" | {s['carga_ms']:>9.1f} {s['lecturas']:>8} {s['ticks']:>6} {s['tick_ms']:>8.3f} {s['avisos']:>6}")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark offline de Neomind")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--latencia-gpt", type=float, default=0.05)
+    asyncio.run(ejecutar(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,45 @@
+# Micro-benchmark del parseo de fechas: dateparser.parse por llamada
+# (comportamiento anterior) frente a fechas.py (ISO rápido + caché).
+# Uso: python benchmarks/bench_fechas.py
+import os
+import sys
+import time
+import dateparser
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fechas import parse_fecha_hora_gpt, parser_es  # noqa: E402
+
+REPETICIONES = 2000
+ISO = ["2025-06-%02dT%02d:30:00-05:00" % (1 + i % 28, 8 + i % 10) for i in range(50)]
+FRASES = ["mañana a las 5 pm", "15 de junio a las 10", "el viernes a las 3 de la tarde", "hoy 18:00"]
+
+
+def anterior(valor):
+    dt = dateparser.parse(valor, languages=["es"])
+    if dt and dt.tzinfo is None:
+        dt = pytz.timezone("America/Lima").localize(dt)
+    return dt
+
+
+def medir(nombre, funcion, valores, repeticiones):
+    inicio = time.perf_counter()
+    for i in range(repeticiones):
+        funcion(valores[i % len(valores)])
+    total = time.perf_counter() - inicio
+    print(f"{nombre:<32} {total / repeticiones * 1e6:>10.1f} µs/llamada")
+    return total
+
+
+def main():
+    parser_es()  # carga de datos de idioma fuera de la medición
+    anterior(FRASES[0])
+    print(f"{REPETICIONES} llamadas por caso\n")
+    for etiqueta, valores in [("ISO guardado", ISO), ("frase repetida", FRASES)]:
+        a = medir(f"{etiqueta} (dateparser)", anterior, valores, REPETICIONES)
+        b = medir(f"{etiqueta} (fechas)", parse_fecha_hora_gpt, valores, REPETICIONES)
+        print(f"{'aceleración':<32} {a / b:>10.0f}x\n")
+
+
+if __name__ == "__main__":
+    main()
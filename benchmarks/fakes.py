@@ -0,0 +1,196 @@
+# Sustitutos en memoria de Firestore, OpenAI y Telegram para ejecutar el
+# bot sin red (benchmarks y pruebas locales).
+import asyncio
+import json
+import random
+from datetime import timedelta
+from types import SimpleNamespace
+
+from fechas import ahora
+from repositorio import RepositorioMemoria, campos_derivados
+
+CLIENTES = ["Abelardo", "Beatriz", "Carlos", "Daniela", "Eduardo", "Fiorella", "Gonzalo", "Hilda", "Iván", "Julia"]
+APELLIDOS = ["Pérez", "Quispe", "Rojas", "Salazar", "Torres", "Vargas", "Flores", "Mendoza"]
+PROYECTOS = ["Torre Sol", "Los Pinos", "Mirador", "Parque Central", "Villa Mar"]
+MODALIDADES = ["presencial", "virtual", "llamada"]
+PALABRAS_OBS = (
+    "precio contrato visita terreno departamento financiamiento credito banco firma entrega "
+    "planos cocina jardin piscina cochera oficina descuento inicial cuota llamada documentos notaria"
+).split()
+
+
+class RepositorioContado(RepositorioMemoria):
+    # RepositorioMemoria que cuenta los documentos leídos, como lo haría la
+    # facturación de Firestore.
+
+    def __init__(self, docs=None):
+        super().__init__(docs)
+        self.lecturas = 0
+        self.escrituras = 0
+
+    def _contar(self, docs):
+        self.lecturas += len(docs) if isinstance(docs, list) else int(docs is not None)
+        return docs
+
+    async def obtener(self, doc_id):
+        return self._contar(await super().obtener(doc_id))
+
+    async def por_usuario(self, telegram_id):
+        return self._contar(await super().por_usuario(telegram_id))
+
+    async def por_dia(self, telegram_id, dia, limite, despues=None):
+        return self._contar(await super().por_dia(telegram_id, dia, limite, despues))
+
+    async def por_campo(self, telegram_id, campo, valor, limite, despues=None):
+        return self._contar(await super().por_campo(telegram_id, campo, valor, limite, despues))
+
+    async def pendientes(self, telegram_id, desde, limite, despues=None):
+        return self._contar(await super().pendientes(telegram_id, desde, limite, despues))
+
+    async def en_rango(self, desde, hasta, shards=None):
+        return self._contar(await super().en_rango(desde, hasta, shards))
+
+    async def reclamar_aviso(self, doc_id, flag, replica, ttl, ahora):
+        # Una transacción: una lectura y, si se reclama, una escritura
+        self.lecturas += 1
+        reclamado = await super().reclamar_aviso(doc_id, flag, replica, ttl, ahora)
+        self.escrituras += int(reclamado)
+        return reclamado
+
+    async def agregar(self, datos):
+        self.escrituras += 1
+        return await super().agregar(datos)
+
+    async def actualizar(self, doc_id, cambios):
+        self.escrituras += 1
+        await super().actualizar(doc_id, cambios)
+
+    async def escribir_lote(self, operaciones):
+        self.escrituras += len(operaciones)
+        await super().escribir_lote(operaciones)
+
+    async def actualizar_lote(self, cambios):
+        self.escrituras += len(cambios)
+        for doc_id, valores in cambios:
+            await super().actualizar(doc_id, valores)
+
+
+def recordatorio_aleatorio(rnd, telegram_id, dt):
+    return {
+        "cliente": f"{rnd.choice(CLIENTES)} {rnd.choice(APELLIDOS)}",
+        "num_cliente": str(rnd.randint(900000000, 999999999)),
+        "proyecto": rnd.choice(PROYECTOS),
+        "modalidad": rnd.choice(MODALIDADES),
+        "fecha_hora": dt.isoformat(),
+        "observaciones": " ".join(rnd.sample(PALABRAS_OBS, 4)),
+        "telegram_id": telegram_id,
+        "telegram_user": f"usuario{telegram_id}",
+        "fecha_creacion": (dt - timedelta(days=7)).isoformat(),
+    }
+
+
+def sembrar(total, usuarios, semilla=1, dias=60):
+    # Recordatorios repartidos entre "usuarios" chats y +-"dias" alrededor de hoy
+    rnd = random.Random(semilla)
+    base = ahora().replace(second=0, microsecond=0)
+    docs = {}
+    for i in range(total):
+        dt = base + timedelta(minutes=rnd.randint(-dias * 1440, dias * 1440))
+        d = recordatorio_aleatorio(rnd, 1 + i % usuarios, dt)
+        docs[f"r{i}"] = dict(d, **campos_derivados(d))
+    return RepositorioContado(docs)
+
+
+class GPTFalso:
+    # Misma interfaz que gpt.ClienteGPT con latencia configurable. Responde
+    # a la extracción (salida estructurada) con un JSON plausible y al texto
+    # libre con un saludo.
+
+    def __init__(self, latencia=0.05):
+        self.latencia = latencia
+        self.llamadas = 0
+
+    def _extraccion(self, mensaje):
+        campos = {"cliente": "", "num_cliente": "", "proyecto": "", "modalidad": "", "fecha_hora": "", "observaciones": ""}
+        resultado = {"intencion": "otro", "fecha": "", "busqueda": {"campo": "", "valor": ""},
+                     "modificar": {"campo": "", "nuevo_valor": ""}, "campos": campos, "confianza": "alta"}
+        texto = mensaje.lower()
+        if "agend" in texto:
+            resultado["intencion"] = "agendar"
+            campos.update({
+                "cliente": "Cliente Nuevo", "num_cliente": "999888777", "proyecto": "Torre Sol",
+                "modalidad": "presencial", "fecha_hora": (ahora() + timedelta(days=1)).isoformat(),
+                "observaciones": mensaje,
+            })
+        elif "busca" in texto or "nota" in texto:
+            resultado["intencion"] = "consultar"
+        return json.dumps(resultado, ensure_ascii=False)
+
+    async def completar(self, messages, model="gpt-4o", temperature=0.0, timeout=None, **kwargs):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia)
+        prompt = "".join(m["content"] for m in messages)
+        if kwargs.get("response_format"):
+            contenido = self._extraccion(messages[-1]["content"])
+        else:
+            contenido = "¡Hola! Puedo agendar, consultar o modificar tus recordatorios."
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=contenido), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(contenido) // 4,
+                                  total_tokens=(len(prompt) + len(contenido)) // 4),
+        )
+
+    async def completar_stream(self, messages, model="gpt-4o", temperature=0.0, timeout=None, **kwargs):
+        # La latencia es hasta el primer fragmento; luego una palabra por milisegundo
+        respuesta = await self.completar(messages, model, temperature, timeout, **kwargs)
+        for palabra in respuesta.choices[0].message.content.split(" "):
+            yield palabra + " "
+            await asyncio.sleep(0.001)
+
+
+class MensajeEnviado:
+    def __init__(self, bot, chat_id, text, message_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.message_id = message_id
+
+    async def edit_text(self, text, **kwargs):
+        self.bot.editados += 1
+        self.text = text
+        return self
+
+
+class BotFalso:
+    username = "neomind_bot"
+
+    def __init__(self):
+        self.enviados = 0
+        self.editados = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.enviados += 1
+        return MensajeEnviado(self, chat_id, text, self.enviados)
+
+
+class MensajeFalso:
+    def __init__(self, texto, bot):
+        self.text = texto
+        self.bot = bot
+        self.respuestas = []
+
+    async def reply_text(self, text, **kwargs):
+        self.respuestas.append(text)
+        return await self.bot.send_message(None, text, **kwargs)
+
+
+def crear_update(chat_id, texto, bot):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id, type="private", title=None),
+        effective_user=SimpleNamespace(username=f"usuario{chat_id}", full_name=f"Usuario {chat_id}"),
+        message=MensajeFalso(texto, bot),
+    )
+
+
+def crear_contexto(bot):
+    return SimpleNamespace(bot=bot)
@@ -0,0 +1,106 @@
+# Simula varias réplicas del scheduler con leases sobre el repositorio en
+# memoria y un reloj acelerado: reparte shards, mata una réplica a mitad de
+# camino, añade otra, y comprueba que cada aviso se envía exactamente una vez.
+# Uso: python benchmarks/simular_replicas.py [--replicas 3] [--recordatorios 2000]
+import argparse
+import asyncio
+import os
+import random
+import sys
+from collections import Counter
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from coordinacion import CoordinadorShards  # noqa: E402
+from fechas import ahora  # noqa: E402
+from repositorio import NUM_SHARDS, campos_derivados  # noqa: E402
+from scheduler import AVISO_PREVIO, TOLERANCIA_HORA, SchedulerRecordatorios  # noqa: E402
+from fakes import RepositorioContado, recordatorio_aleatorio  # noqa: E402
+
+PASO = timedelta(seconds=5)
+LEASE_TTL = 30.0
+
+
+class Replica:
+    def __init__(self, nombre, repo, reloj, enviados):
+        self.nombre = nombre
+        self.coordinador = CoordinadorShards(repo, nombre, ttl=LEASE_TTL, reloj=lambda: reloj[0].timestamp())
+        self.scheduler = SchedulerRecordatorios(repo, coordinador=self.coordinador)
+        self.scheduler._ahora = lambda: reloj[0]
+        self.enviados = enviados
+        self.proxima_renovacion = None
+
+    async def notificar(self, avisos):
+        for datos, tipo, _ in avisos:
+            self.enviados[(datos["doc_id"], tipo)] += 1
+        return [None] * len(avisos)
+
+    async def paso(self, now):
+        if self.proxima_renovacion is None or now >= self.proxima_renovacion:
+            ganados, perdidos = await self.coordinador.renovar()
+            if ganados or perdidos:
+                await self.scheduler.reasignar(ganados, perdidos)
+            self.proxima_renovacion = now + timedelta(seconds=LEASE_TTL / 3)
+        if self.scheduler._cargado_hasta is None:
+            await self.scheduler.cargar_ventana(now - TOLERANCIA_HORA, now + self.scheduler.ventana)
+        elif now >= self.scheduler._cargado_hasta - AVISO_PREVIO:
+            await self.scheduler.cargar_ventana(self.scheduler._cargado_hasta, now + self.scheduler.ventana)
+        await self.scheduler._disparar(now, self.notificar)
+
+
+async def simular(args):
+    rnd = random.Random(1)
+    inicio = ahora().replace(second=0, microsecond=0)
+    docs = {}
+    for i in range(args.recordatorios):
+        dt = inicio + AVISO_PREVIO + timedelta(seconds=rnd.randint(0, args.minutos * 60))
+        d = recordatorio_aleatorio(rnd, rnd.randint(1, 5000), dt)
+        docs[f"r{i}"] = dict(d, **campos_derivados(d))
+    repo = RepositorioContado(docs)
+    reloj = [inicio]
+    enviados = Counter()
+    replicas = [Replica(f"replica-{i}", repo, reloj, enviados) for i in range(args.replicas)]
+    muerta = agregada = False
+
+    fin = inicio + timedelta(minutes=args.minutos) + AVISO_PREVIO + timedelta(minutes=2)
+    while reloj[0] < fin:
+        now = reloj[0]
+        transcurrido = now - inicio
+        if not muerta and transcurrido >= timedelta(minutes=args.minutos / 3):
+            caida = replicas.pop(1 % len(replicas))
+            print(f"[{transcurrido}] cae {caida.nombre} con {len(caida.coordinador.shards)} shards")
+            muerta = True
+        if not agregada and transcurrido >= timedelta(minutes=2 * args.minutos / 3):
+            replicas.append(Replica("replica-nueva", repo, reloj, enviados))
+            print(f"[{transcurrido}] arranca replica-nueva")
+            agregada = True
+        # Las réplicas avanzan "a la vez": mismo instante, orden aleatorio
+        rnd.shuffle(replicas)
+        await asyncio.gather(*(r.paso(now) for r in replicas))
+        if transcurrido.total_seconds() % 300 == 0:
+            reparto = {r.nombre: len(r.coordinador.shards) for r in sorted(replicas, key=lambda r: r.nombre)}
+            print(f"[{transcurrido}] shards: {reparto}")
+        reloj[0] = now + PASO
+
+    esperados = {(doc_id, tipo) for doc_id in docs for tipo in ("10min", "hora")}
+    duplicados = [k for k, n in enviados.items() if n > 1]
+    faltantes = esperados - set(enviados)
+    cubiertos = set().union(*(r.coordinador.shards for r in replicas))
+    print(f"\nAvisos esperados: {len(esperados)}  enviados: {sum(enviados.values())}  "
+          f"duplicados: {len(duplicados)}  faltantes: {len(faltantes)}")
+    print(f"Shards cubiertos al final: {len(cubiertos)}/{NUM_SHARDS}")
+    for doc_id, tipo in sorted(faltantes)[:10]:
+        print(f"  faltante {doc_id} {tipo} {docs[doc_id]['fecha_hora']}")
+    return 1 if duplicados or len(cubiertos) < NUM_SHARDS else 0
+
+
+def main_sim():
+    parser = argparse.ArgumentParser(description="Simulación de réplicas del scheduler")
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--recordatorios", type=int, default=2000)
+    parser.add_argument("--minutos", type=int, default=60)
+    sys.exit(asyncio.run(simular(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main_sim()
@@ -0,0 +1,106 @@
+import asyncio
+import copy
+import re
+import time
+from collections import OrderedDict
+import metricas
+
+
+def normalizar_mensaje(texto):
+    texto = re.sub(r"\s+", " ", texto.casefold()).strip()
+    return texto.strip("¿?¡!.,; ")
+
+
+class CacheExtracciones:
+    # LRU acotado con TTL para los resultados de extracción de GPT. La clave
+    # incluye el día actual (dia_actual), porque "hoy" o "mañana" cambian de
+    # significado a medianoche: al cambiar el día se vacía la caché. Las
+    # peticiones idénticas concurrentes comparten una sola llamada en vuelo.
+
+    def __init__(self, dia_actual, max_entradas=1000, ttl=600, reloj=time.monotonic):
+        self.dia_actual = dia_actual
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.reloj = reloj
+        self._entradas = OrderedDict()  # clave -> (expira, valor)
+        self._en_vuelo = {}
+        self._dia = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.coalescidas = 0
+        self.desalojos = 0
+        self.expiradas = 0
+        self.invalidaciones = 0
+        metricas.CACHE_EXTRACCIONES_ENTRADAS.leer = lambda: len(self._entradas)
+
+    def _vigente(self, clave):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        expira, valor = entrada
+        if expira <= self.reloj():
+            del self._entradas[clave]
+            self.expiradas += 1
+            metricas.CACHE_EXTRACCIONES.inc(evento="expirada")
+            return None
+        self._entradas.move_to_end(clave)
+        return valor
+
+    def _guardar(self, clave, valor):
+        self._entradas[clave] = (self.reloj() + self.ttl, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.desalojos += 1
+            metricas.CACHE_EXTRACCIONES.inc(evento="desalojo")
+
+    async def obtener(self, texto, calcular):
+        dia = self.dia_actual()
+        if dia != self._dia:
+            if self._entradas:
+                self.invalidaciones += 1
+                metricas.CACHE_EXTRACCIONES.inc(evento="invalidacion")
+            self._entradas.clear()
+            self._dia = dia
+        clave = (dia, normalizar_mensaje(texto))
+
+        valor = self._vigente(clave)
+        if valor is not None:
+            self.aciertos += 1
+            metricas.CACHE_EXTRACCIONES.inc(evento="acierto")
+            return copy.deepcopy(valor)
+
+        # El cálculo corre en su propia tarea y cada llamador la espera con
+        # shield: si se cancela un llamador (incluido el primero) sólo se
+        # cancela su espera, no la extracción que comparten los demás.
+        tarea = self._en_vuelo.get(clave)
+        if tarea is not None:
+            self.coalescidas += 1
+            metricas.CACHE_EXTRACCIONES.inc(evento="coalescida")
+        else:
+            self.fallos += 1
+            metricas.CACHE_EXTRACCIONES.inc(evento="fallo")
+            tarea = asyncio.ensure_future(self._calcular(clave, calcular))
+            self._en_vuelo[clave] = tarea
+            # Evita el aviso "exception was never retrieved" si nadie espera ya
+            tarea.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return copy.deepcopy(await asyncio.shield(tarea))
+
+    async def _calcular(self, clave, calcular):
+        try:
+            valor = await calcular()
+            self._guardar(clave, valor)
+            return valor
+        finally:
+            del self._en_vuelo[clave]
+
+    def estadisticas(self):
+        return {
+            "entradas": len(self._entradas),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "coalescidas": self.coalescidas,
+            "desalojos": self.desalojos,
+            "expiradas": self.expiradas,
+            "invalidaciones": self.invalidaciones,
+        }
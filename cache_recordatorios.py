@@ -0,0 +1,261 @@
+import asyncio
+import time
+from collections import OrderedDict
+from metricas import FIRESTORE_DOCS_LEIDOS
+from repositorio import COLECCION, campos_derivados, filtrar_dia, filtrar_campo, filtrar_pendientes
+
+
+class _EntradaChat:
+    __slots__ = ("docs", "watch", "expira")
+
+    def __init__(self, docs, watch=None, expira=None):
+        self.docs = docs  # doc_id -> datos
+        self.watch = watch
+        self.expira = expira  # sólo sin listener: cuándo releer del repositorio
+
+
+class RepositorioConCache:
+    # Caché de lectura por telegram_id delante del repositorio: la primera
+    # consulta de un chat carga todos sus recordatorios y las siguientes se
+    # resuelven en memoria. Las escrituras locales actualizan la caché
+    # (write-through) y, si hay cliente síncrono de Firestore (db_listener),
+    # un listener on_snapshot por chat la mantiene coherente con lo que
+    # escriben otras réplicas. Los chats se desalojan por LRU.
+    # Los listeners tienen su propio tope (Firestore recomienda ~100 por
+    # cliente): pasado ese tope, o si el listener no arranca, el chat se
+    # cachea igual pero sólo durante ttl_sin_listener y luego se relee.
+
+    def __init__(self, repo, db_listener=None, max_chats=500, max_docs_por_chat=2000, timeout_carga=10.0,
+                 max_listeners=100, ttl_sin_listener=60.0, reloj=time.monotonic):
+        self.repo = repo
+        self.db_listener = db_listener
+        self.max_chats = max_chats
+        self.max_listeners = max_listeners
+        self.ttl_sin_listener = ttl_sin_listener
+        self.reloj = reloj
+        self._listeners = 0  # activos o arrancando
+        self.max_docs_por_chat = max_docs_por_chat
+        self.timeout_carga = timeout_carga
+        self._chats = OrderedDict()  # telegram_id -> _EntradaChat
+        self._chat_de_doc = {}  # doc_id -> telegram_id
+        self._cargando = {}
+        # Chats con demasiados documentos para cachearlos: sus listados
+        # paginados van directo al repositorio
+        self._directos = set()
+        # Objetos notificados de cada cambio (p. ej. IndiceBusqueda)
+        self.observadores = []
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    # ---- gestión de la caché ----
+
+    def _notificar(self, evento, *args):
+        for observador in self.observadores:
+            getattr(observador, evento)(*args)
+
+    def _guardar_doc(self, telegram_id, doc_id, datos):
+        entrada = self._chats.get(telegram_id)
+        if entrada is None:
+            return
+        entrada.docs[doc_id] = dict(datos, doc_id=doc_id)
+        self._chat_de_doc[doc_id] = telegram_id
+
+    def _borrar_doc(self, telegram_id, doc_id):
+        entrada = self._chats.get(telegram_id)
+        if entrada is not None:
+            entrada.docs.pop(doc_id, None)
+        self._chat_de_doc.pop(doc_id, None)
+        self._notificar("doc_borrado", telegram_id, doc_id)
+
+    def _desalojar(self, telegram_id):
+        entrada = self._chats.pop(telegram_id, None)
+        if entrada is None:
+            return
+        for doc_id in entrada.docs:
+            self._chat_de_doc.pop(doc_id, None)
+        if entrada.watch is not None:
+            self._quitar_listener(entrada.watch)
+        self._notificar("chat_desalojado", telegram_id)
+
+    def _quitar_listener(self, watch):
+        watch.unsubscribe()
+        self._listeners -= 1
+
+    def _instalar(self, telegram_id, docs, watch, expira=None):
+        if len(docs) > self.max_docs_por_chat:
+            # Historial demasiado grande para la caché: se consulta directo
+            if watch is not None:
+                self._quitar_listener(watch)
+            self._directos.add(telegram_id)
+            return
+        self._chats[telegram_id] = _EntradaChat({}, watch, expira)
+        for d in docs:
+            self._guardar_doc(telegram_id, d["doc_id"], d)
+        while len(self._chats) > self.max_chats:
+            viejo = next(iter(self._chats))
+            self._desalojar(viejo)
+            self.desalojos += 1
+
+    def _snapshot(self, telegram_id, docs, cambios, primera):
+        # Se ejecuta en el event loop (el listener corre en otro hilo)
+        if not primera.done():
+            FIRESTORE_DOCS_LEIDOS.observar(len(docs), consulta="listener")
+            primera.set_result([dict(d.to_dict(), doc_id=d.id) for d in docs])
+            return
+        if telegram_id not in self._chats:
+            return
+        for cambio in cambios:
+            doc = cambio.document
+            if cambio.type.name == "REMOVED":
+                self._borrar_doc(telegram_id, doc.id)
+            else:
+                self._guardar_doc(telegram_id, doc.id, doc.to_dict())
+                self._notificar("doc_guardado", telegram_id, doc.id, doc.to_dict())
+
+    async def _cargar_con_listener(self, telegram_id):
+        loop = asyncio.get_running_loop()
+        primera = loop.create_future()
+
+        def callback(docs, cambios, read_time):
+            loop.call_soon_threadsafe(self._snapshot, telegram_id, docs, cambios, primera)
+
+        query = self.db_listener.collection(COLECCION).where("telegram_id", "==", telegram_id)
+        watch = query.on_snapshot(callback)
+        try:
+            docs = await asyncio.wait_for(primera, timeout=self.timeout_carga)
+        except Exception:
+            watch.unsubscribe()
+            raise
+        return docs, watch
+
+    async def _cargar(self, telegram_id):
+        if self.db_listener is None:
+            docs = await self.repo.por_usuario(telegram_id)
+            self._instalar(telegram_id, docs, None)
+            return docs
+        if self._listeners < self.max_listeners:
+            self._listeners += 1
+            try:
+                docs, watch = await self._cargar_con_listener(telegram_id)
+            except Exception as e:
+                self._listeners -= 1
+                print(f"Error iniciando listener para {telegram_id}: {e}")
+            else:
+                self._instalar(telegram_id, docs, watch)
+                return docs
+        docs = await self.repo.por_usuario(telegram_id)
+        self._instalar(telegram_id, docs, None, expira=self.reloj() + self.ttl_sin_listener)
+        return docs
+
+    async def _citas(self, telegram_id):
+        entrada = self._chats.get(telegram_id)
+        if entrada is not None and entrada.expira is not None and entrada.expira <= self.reloj():
+            # Sin listener que la mantenga al día: se relee del repositorio
+            self._desalojar(telegram_id)
+            entrada = None
+        if entrada is not None:
+            self.aciertos += 1
+            self._chats.move_to_end(telegram_id)
+            return [dict(d) for d in entrada.docs.values()]
+        self.fallos += 1
+        # Varias consultas simultáneas del mismo chat comparten la carga
+        tarea = self._cargando.get(telegram_id)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._cargar(telegram_id))
+            self._cargando[telegram_id] = tarea
+            tarea.add_done_callback(lambda _: self._cargando.pop(telegram_id, None))
+        docs = await asyncio.shield(tarea)
+        return [dict(d) for d in docs]
+
+    def estadisticas(self):
+        return {
+            "chats": len(self._chats),
+            "listeners": self._listeners,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "directos": len(self._directos),
+        }
+
+    # ---- misma interfaz que RepositorioRecordatorios ----
+
+    async def agregar(self, datos):
+        doc_id = await self.repo.agregar(datos)
+        guardado = dict(datos, **campos_derivados(datos))
+        self._guardar_doc(datos.get("telegram_id"), doc_id, guardado)
+        self._notificar("doc_guardado", datos.get("telegram_id"), doc_id, guardado)
+        return doc_id
+
+    async def agregar_lote(self, docs):
+        await self.repo.agregar_lote(docs)
+        for doc_id, datos in docs:
+            guardado = dict(datos, **campos_derivados(datos))
+            self._guardar_doc(datos.get("telegram_id"), doc_id, guardado)
+            self._notificar("doc_guardado", datos.get("telegram_id"), doc_id, guardado)
+
+    async def escribir_lote(self, operaciones):
+        await self.repo.escribir_lote(operaciones)
+        for operacion, doc_id, datos in operaciones:
+            if operacion == "set":
+                guardado = dict(datos, **campos_derivados(datos))
+                self._guardar_doc(datos.get("telegram_id"), doc_id, guardado)
+                self._notificar("doc_guardado", datos.get("telegram_id"), doc_id, guardado)
+            else:
+                self._aplicar_cambios(doc_id, datos)
+
+    async def actualizar(self, doc_id, cambios):
+        await self.repo.actualizar(doc_id, cambios)
+        self._aplicar_cambios(doc_id, cambios)
+
+    def _aplicar_cambios(self, doc_id, cambios):
+        telegram_id = self._chat_de_doc.get(doc_id)
+        if telegram_id in self._chats:
+            datos = self._chats[telegram_id].docs.get(doc_id)
+            if datos is not None:
+                datos.update(cambios, **campos_derivados(cambios))
+        self._notificar("doc_actualizado", doc_id, cambios)
+
+    async def actualizar_lote(self, cambios):
+        await self.repo.actualizar_lote(cambios)
+        for doc_id, valores in cambios:
+            self._aplicar_cambios(doc_id, valores)
+
+    async def obtener(self, doc_id):
+        telegram_id = self._chat_de_doc.get(doc_id)
+        if telegram_id in self._chats and doc_id in self._chats[telegram_id].docs:
+            return dict(self._chats[telegram_id].docs[doc_id])
+        return await self.repo.obtener(doc_id)
+
+    async def por_usuario(self, telegram_id):
+        return await self._citas(telegram_id)
+
+    async def por_dia(self, telegram_id, dia, limite, despues=None):
+        if telegram_id in self._directos:
+            return await self.repo.por_dia(telegram_id, dia, limite, despues)
+        return filtrar_dia(await self._citas(telegram_id), dia, limite, despues)
+
+    async def por_campo(self, telegram_id, campo, valor, limite, despues=None):
+        if telegram_id in self._directos:
+            return await self.repo.por_campo(telegram_id, campo, valor, limite, despues)
+        return filtrar_campo(await self._citas(telegram_id), campo, valor, limite, despues)
+
+    async def pendientes(self, telegram_id, desde, limite, despues=None):
+        if telegram_id in self._directos:
+            return await self.repo.pendientes(telegram_id, desde, limite, despues)
+        return filtrar_pendientes(await self._citas(telegram_id), desde, limite, despues)
+
+    async def en_rango(self, desde, hasta, shards=None):
+        return await self.repo.en_rango(desde, hasta, shards)
+
+    async def renovar_leases(self, replica, ttl, ahora, saliendo=False):
+        return await self.repo.renovar_leases(replica, ttl, ahora, saliendo)
+
+    async def reclamar_aviso(self, doc_id, flag, replica, ttl, ahora):
+        return await self.repo.reclamar_aviso(doc_id, flag, replica, ttl, ahora)
+
+    def recorrer(self, telegram_id=None, lote=500):
+        return self.repo.recorrer(telegram_id, lote)
+
+    async def migrar(self, lote=500):
+        return await self.repo.migrar(lote=lote)
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import sys
+import importacion
+
+
+async def backfill(repo, args):
+    migrados = await repo.migrar(lote=args.lote)
+    print(f"Backfill terminado: {migrados} recordatorios actualizados.")
+
+
+async def importar(repo, args):
+    importados, errores = await importacion.importar(
+        repo,
+        args.archivo,
+        args.campos,
+        telegram_id=args.telegram_id,
+        usuario=args.usuario,
+        lote=args.lote,
+        concurrencia=args.concurrencia,
+        checkpoint=None if args.sin_checkpoint else (args.checkpoint or args.archivo + ".checkpoint"),
+        simular=args.simular,
+    )
+    accion = "validados" if args.simular else "importados"
+    print(f"Importación terminada: {importados} recordatorios {accion}, {errores} filas con errores.")
+
+
+async def exportar(repo, args):
+    total = await importacion.exportar(repo, args.salida, telegram_id=args.telegram_id, lote=args.lote)
+    print(f"Exportados {total} recordatorios.", file=sys.stderr)
+
+
+def parser_comandos():
+    parser = argparse.ArgumentParser(prog="main.py", description="Comandos de mantenimiento de Neomind")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("backfill", help="Completa los campos derivados de los recordatorios existentes")
+    p.add_argument("--lote", type=int, default=500, help="Documentos por escritura en lote (máx. 500)")
+    p.set_defaults(funcion=backfill)
+
+    p = sub.add_parser("importar", help="Importa recordatorios desde CSV (con cabecera) o JSONL")
+    p.add_argument("archivo")
+    p.add_argument("--telegram-id", type=int, help="Chat dueño de las filas sin columna telegram_id")
+    p.add_argument("--usuario", help="telegram_user de las filas sin esa columna")
+    p.add_argument("--lote", type=int, default=500, help="Documentos por WriteBatch (máx. 500)")
+    p.add_argument("--concurrencia", type=int, default=4, help="Lotes confirmándose a la vez")
+    p.add_argument("--checkpoint", help="Archivo de progreso (por defecto <archivo>.checkpoint)")
+    p.add_argument("--sin-checkpoint", action="store_true", help="Importa desde el principio sin guardar progreso")
+    p.add_argument("--simular", action="store_true", help="Sólo valida, no escribe en Firestore")
+    p.set_defaults(funcion=importar)
+
+    p = sub.add_parser("exportar", help="Exporta recordatorios a JSONL en streaming")
+    p.add_argument("salida", help="Archivo .jsonl o - para stdout")
+    p.add_argument("--telegram-id", type=int, help="Sólo los recordatorios de este chat")
+    p.add_argument("--lote", type=int, default=500, help="Documentos por página leída")
+    p.set_defaults(funcion=exportar)
+
+    return parser
+
+
+def ejecutar(argv, repo, campos):
+    args = parser_comandos().parse_args(argv)
+    args.campos = campos
+    asyncio.run(args.funcion(repo, args))
@@ -0,0 +1,40 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+
+
+class BloqueosPorChat:
+    # Un lock por chat, creado bajo demanda y liberado cuando nadie lo usa.
+    # Con updates concurrentes, los chats distintos avanzan en paralelo y
+    # los mensajes de un mismo chat se procesan en orden de llegada
+    # (asyncio.Lock despierta a los que esperan en orden FIFO).
+
+    def __init__(self):
+        self._locks = {}  # chat_id -> [lock, usuarios]
+
+    @asynccontextmanager
+    async def chat(self, chat_id):
+        entrada = self._locks.get(chat_id)
+        if entrada is None:
+            entrada = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._locks[chat_id]
+
+    def serializar(self, handler):
+        @functools.wraps(handler)
+        async def envoltura(update, context):
+            chat = update.effective_chat
+            if chat is None:
+                return await handler(update, context)
+            async with self.chat(chat.id):
+                return await handler(update, context)
+        return envoltura
+
+    def activos(self):
+        return len(self._locks)
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import socket
+import time
+
+
+def id_replica():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class CoordinadorShards:
+    # Reparte los shards de recordatorios entre réplicas con leases en un
+    # documento de Firestore. Cada ttl/3 segundos renueva (transacción) los
+    # suyos; si una réplica deja de renovar, sus leases vencen y las demás
+    # los toman. Un shard puede estar un instante en dos réplicas durante
+    # un traspaso: lo que evita avisos duplicados es el reclamo por aviso.
+
+    def __init__(self, repo, replica=None, ttl=30.0, reloj=time.time):
+        self.repo = repo
+        self.replica = replica or id_replica()
+        self.ttl = ttl
+        self.reloj = reloj
+        self.shards = set()
+        self._renovado = None  # reloj() de la última renovación correcta
+
+    async def renovar(self):
+        # Devuelve (ganados, perdidos) respecto a la ronda anterior
+        try:
+            mios = await self.repo.renovar_leases(self.replica, self.ttl, self.reloj())
+            self._renovado = self.reloj()
+        except Exception as e:
+            print(f"Error renovando leases de {self.replica}: {e}")
+            if self._renovado is not None and self.reloj() - self._renovado < self.ttl:
+                return set(), set()
+            # Sin poder renovar, otra réplica puede haberlos tomado ya
+            mios = set()
+        ganados, perdidos = mios - self.shards, self.shards - mios
+        self.shards = mios
+        return ganados, perdidos
+
+    async def run(self, al_cambiar):
+        # al_cambiar(ganados, perdidos) se llama en cada cambio de shards. Si
+        # falla (p. ej. la carga de los shards ganados), el cambio se acumula
+        # y se repite en la siguiente ronda en vez de detener la renovación.
+        pendientes_ganados, pendientes_perdidos = set(), set()
+        while True:
+            ganados, perdidos = await self.renovar()
+            if ganados or perdidos:
+                print(f"Réplica {self.replica}: {len(self.shards)} shards (+{len(ganados)} -{len(perdidos)})")
+            ganados = (pendientes_ganados | ganados) & self.shards
+            perdidos = (pendientes_perdidos | perdidos) - self.shards
+            pendientes_ganados, pendientes_perdidos = set(), set()
+            if ganados or perdidos:
+                try:
+                    await al_cambiar(ganados, perdidos)
+                except Exception as e:
+                    print(f"Error aplicando el cambio de shards de {self.replica}: {e}; se reintenta")
+                    pendientes_ganados, pendientes_perdidos = ganados, perdidos
+            await asyncio.sleep(self.ttl / 3)
+
+    async def soltar(self):
+        # Al apagar: libera los shards para que otra réplica no espere al ttl
+        await self.repo.renovar_leases(self.replica, self.ttl, self.reloj(), saliendo=True)
+        self.shards = set()
@@ -0,0 +1,321 @@
+import asyncio
+import itertools
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metricas
+from repositorio import LOTE_MAX, campos_derivados, filtrar_campo, filtrar_dia, filtrar_pendientes, nuevo_id
+
+
+def es_permanente(error):
+    # Errores que reintentar no arregla: documento inexistente o datos inválidos
+    from google.api_core import exceptions
+    return isinstance(error, (
+        KeyError,
+        ValueError,
+        TypeError,
+        exceptions.NotFound,
+        exceptions.InvalidArgument,
+        exceptions.FailedPrecondition,
+    ))
+
+
+class _Escritura:
+    __slots__ = ("seq", "operacion", "doc_id", "telegram_id", "datos", "creado")
+
+    def __init__(self, seq, operacion, doc_id, telegram_id, datos, creado):
+        self.seq = seq
+        self.operacion = operacion  # "set" o "update"
+        self.doc_id = doc_id
+        self.telegram_id = telegram_id
+        self.datos = datos
+        self.creado = creado
+
+
+class PersistenciaEscrituras:
+    # Registro SQLite de las escrituras aún no confirmadas en Firestore. Cada
+    # una llega a disco (synchronous=FULL) antes de responder al usuario, así
+    # que sobrevive a un reinicio o a una caída del proceso. Los commits (y
+    # su fsync) corren en un único hilo escritor, fuera del event loop y en
+    # el orden en que se piden.
+
+    def __init__(self, ruta):
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._hilo = ThreadPoolExecutor(max_workers=1, thread_name_prefix="escrituras")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS escrituras (seq INTEGER PRIMARY KEY AUTOINCREMENT, operacion TEXT NOT NULL, "
+            "doc_id TEXT NOT NULL, telegram_id INTEGER, datos TEXT NOT NULL, creado REAL NOT NULL, "
+            "descartada INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.commit()
+
+    def en_hilo(self, funcion, *args):
+        # Future del event loop con el resultado de funcion(*args) en el hilo escritor
+        return asyncio.get_running_loop().run_in_executor(self._hilo, funcion, *args)
+
+    def cargar(self):
+        filas = self.conn.execute(
+            "SELECT seq, operacion, doc_id, telegram_id, datos, creado FROM escrituras WHERE descartada = 0 ORDER BY seq"
+        )
+        return [(seq, op, doc_id, telegram_id, json.loads(datos), creado) for seq, op, doc_id, telegram_id, datos, creado in filas]
+
+    def guardar(self, operacion, doc_id, telegram_id, datos, creado):
+        cursor = self.conn.execute(
+            "INSERT INTO escrituras (operacion, doc_id, telegram_id, datos, creado) VALUES (?, ?, ?, ?, ?)",
+            (operacion, doc_id, telegram_id, json.dumps(datos, ensure_ascii=False, default=str), creado),
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def confirmar(self, seqs):
+        self.conn.executemany("DELETE FROM escrituras WHERE seq = ?", [(seq,) for seq in seqs])
+        self.conn.commit()
+
+    def descartar(self, seq):
+        # Se conserva marcada para poder revisarla a mano
+        self.conn.execute("UPDATE escrituras SET descartada = 1 WHERE seq = ?", (seq,))
+        self.conn.commit()
+
+
+class EscriturasDiferidas:
+    # Write-behind delante del repositorio: agregar() y actualizar() sólo
+    # anotan la escritura en la cola local duradera y vuelven enseguida, y
+    # run() la confirma en Firestore por lotes, en orden y con reintentos.
+    # El id de cada documento nuevo se genera al encolar y hace de clave de
+    # idempotencia: repetir un lote que sí se confirmó (p. ej. si se perdió
+    # la respuesta) reescribe los mismos documentos en vez de duplicarlos.
+    # Las lecturas superponen las escrituras pendientes, así cada usuario ve
+    # enseguida lo que acaba de guardar.
+
+    def __init__(self, repo, persistencia, intervalo=0.2, lote=LOTE_MAX, espera_max=60, reloj=time.time):
+        self.repo = repo
+        self.persistencia = persistencia
+        self.intervalo = intervalo  # espera para agrupar escrituras casi simultáneas
+        self.lote = min(lote, LOTE_MAX)
+        self.espera_max = espera_max
+        self.reloj = reloj
+        self._pendientes = OrderedDict()  # seq -> _Escritura, en orden de llegada
+        self._por_doc = {}  # doc_id -> [seq, ...]
+        self._hay_pendientes = asyncio.Event()
+        self._vaciando = asyncio.Lock()
+        # Tras un lote fallido, cuántas escrituras confirmar de una en una
+        # para aislar la que Firestore rechaza
+        self._aislar = 0
+        self.confirmadas = 0
+        self.descartadas = 0
+        for fila in persistencia.cargar():
+            self._registrar(_Escritura(*fila))
+        metricas.ESCRITURAS_PENDIENTES.leer = lambda: len(self._pendientes)
+        metricas.ESCRITURAS_ANTIGUEDAD.leer = self.antiguedad
+
+    # ---- cola ----
+
+    def _registrar(self, escritura):
+        self._pendientes[escritura.seq] = escritura
+        self._por_doc.setdefault(escritura.doc_id, []).append(escritura.seq)
+        self._hay_pendientes.set()
+
+    async def _encolar(self, operacion, doc_id, telegram_id, datos):
+        creado = self.reloj()
+        datos = dict(datos)
+        guardado = self.persistencia.en_hilo(self.persistencia.guardar, operacion, doc_id, telegram_id, datos, creado)
+
+        def registrar(futuro):
+            # Una vez en disco se registra aunque el llamador se haya cancelado
+            if not futuro.cancelled() and futuro.exception() is None:
+                self._registrar(_Escritura(futuro.result(), operacion, doc_id, telegram_id, datos, creado))
+
+        guardado.add_done_callback(registrar)
+        # Se responde al usuario sólo cuando la escritura ya está en disco
+        await asyncio.shield(guardado)
+
+    def _quitar(self, escrituras):
+        for e in escrituras:
+            del self._pendientes[e.seq]
+            seqs = self._por_doc[e.doc_id]
+            seqs.remove(e.seq)
+            if not seqs:
+                del self._por_doc[e.doc_id]
+
+    def antiguedad(self):
+        if not self._pendientes:
+            return 0.0
+        return round(self.reloj() - next(iter(self._pendientes.values())).creado, 3)
+
+    def estadisticas(self):
+        return {
+            "pendientes": len(self._pendientes),
+            "antiguedad_s": self.antiguedad(),
+            "confirmadas": self.confirmadas,
+            "descartadas": self.descartadas,
+        }
+
+    async def vaciar(self):
+        # Confirma en orden todas las escrituras pendientes. Un error
+        # transitorio se propaga (run() reintenta); una escritura que
+        # Firestore rechaza sin remedio se descarta para no bloquear la cola.
+        async with self._vaciando:
+            while self._pendientes:
+                lote = list(itertools.islice(self._pendientes.values(), 1 if self._aislar else self.lote))
+                try:
+                    await self.repo.escribir_lote([(e.operacion, e.doc_id, e.datos) for e in lote])
+                except Exception as error:
+                    if len(lote) > 1:
+                        self._aislar = len(lote)
+                        continue
+                    if not es_permanente(error):
+                        raise
+                    print(f"Escritura descartada ({lote[0].operacion} {lote[0].doc_id}): {error}")
+                    await self.persistencia.en_hilo(self.persistencia.descartar, lote[0].seq)
+                    self.descartadas += 1
+                    metricas.ESCRITURAS_DESCARTADAS.inc()
+                else:
+                    await self.persistencia.en_hilo(self.persistencia.confirmar, [e.seq for e in lote])
+                    self.confirmadas += len(lote)
+                    ahora = self.reloj()
+                    for e in lote:
+                        metricas.ESCRITURAS_RETRASO.observar(ahora - e.creado)
+                self._quitar(lote)
+                self._aislar = max(self._aislar - len(lote), 0)
+            self._hay_pendientes.clear()
+
+    async def run(self):
+        fallos = 0
+        while True:
+            await self._hay_pendientes.wait()
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.vaciar()
+                fallos = 0
+            except Exception as e:
+                espera = min(self.intervalo * 2 ** fallos, self.espera_max)
+                fallos += 1
+                print(f"Error confirmando escrituras ({len(self._pendientes)} pendientes): {e}; reintento en {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+    async def _esperar(self, doc_ids):
+        # Las escrituras directas sobre documentos con escrituras en cola
+        # esperan a que éstas se confirmen, para no adelantarse a ellas
+        if any(doc_id in self._por_doc for doc_id in doc_ids):
+            await self.vaciar()
+
+    # ---- lectura de lo escrito ----
+
+    def _crea(self, doc_id):
+        return any(self._pendientes[seq].operacion == "set" for seq in self._por_doc[doc_id])
+
+    def _aplicar(self, doc_id, base):
+        # Estado del documento tras sus escrituras pendientes (None si no existe)
+        datos = dict(base) if base is not None else None
+        for seq in self._por_doc.get(doc_id, ()):
+            e = self._pendientes[seq]
+            if e.operacion == "set":
+                datos = dict(e.datos, **campos_derivados(e.datos))
+            elif datos is not None:
+                datos.update(e.datos, **campos_derivados(e.datos))
+        if datos is not None:
+            datos["doc_id"] = doc_id
+        return datos
+
+    def _docs_del_chat(self, telegram_id):
+        return [doc_id for doc_id, seqs in self._por_doc.items() if self._pendientes[seqs[0]].telegram_id == telegram_id]
+
+    async def _superponer(self, citas, telegram_id):
+        docs = self._docs_del_chat(telegram_id)
+        if not docs:
+            return citas
+        por_id = {c["doc_id"]: c for c in citas}
+        for doc_id in docs:
+            base = por_id.get(doc_id)
+            if base is None and not self._crea(doc_id):
+                base = await self.repo.obtener(doc_id)
+            datos = self._aplicar(doc_id, base)
+            if datos is not None:
+                por_id[doc_id] = datos
+        return list(por_id.values())
+
+    # ---- misma interfaz que RepositorioRecordatorios ----
+
+    async def agregar(self, datos):
+        doc_id = nuevo_id()
+        await self._encolar("set", doc_id, datos.get("telegram_id"), datos)
+        return doc_id
+
+    async def actualizar(self, doc_id, cambios):
+        actual = await self.obtener(doc_id)
+        if actual is None:
+            raise KeyError(doc_id)
+        await self._encolar("update", doc_id, actual.get("telegram_id"), cambios)
+
+    async def actualizar_lote(self, cambios):
+        await self._esperar([doc_id for doc_id, _ in cambios])
+        await self.repo.actualizar_lote(cambios)
+
+    async def agregar_lote(self, docs):
+        await self._esperar([doc_id for doc_id, _ in docs])
+        await self.repo.agregar_lote(docs)
+
+    async def obtener(self, doc_id):
+        if doc_id not in self._por_doc:
+            return await self.repo.obtener(doc_id)
+        base = None if self._crea(doc_id) else await self.repo.obtener(doc_id)
+        return self._aplicar(doc_id, base)
+
+    async def por_usuario(self, telegram_id):
+        return await self._superponer(await self.repo.por_usuario(telegram_id), telegram_id)
+
+    # Las consultas paginadas piden al repositorio una fila más por cada
+    # documento pendiente del chat, por si alguno deja de coincidir
+
+    async def por_dia(self, telegram_id, dia, limite, despues=None):
+        extra = len(self._docs_del_chat(telegram_id))
+        citas = await self.repo.por_dia(telegram_id, dia, limite + extra, despues)
+        if not extra:
+            return citas
+        return filtrar_dia(await self._superponer(citas, telegram_id), dia, limite, despues)
+
+    async def por_campo(self, telegram_id, campo, valor, limite, despues=None):
+        extra = len(self._docs_del_chat(telegram_id))
+        citas = await self.repo.por_campo(telegram_id, campo, valor, limite + extra, despues)
+        if not extra:
+            return citas
+        return filtrar_campo(await self._superponer(citas, telegram_id), campo, valor, limite, despues)
+
+    async def pendientes(self, telegram_id, desde, limite, despues=None):
+        extra = len(self._docs_del_chat(telegram_id))
+        citas = await self.repo.pendientes(telegram_id, desde, limite + extra, despues)
+        if not extra:
+            return citas
+        return filtrar_pendientes(await self._superponer(citas, telegram_id), desde, limite, despues)
+
+    async def en_rango(self, desde, hasta, shards=None):
+        citas = {c["doc_id"]: c for c in await self.repo.en_rango(desde, hasta, shards)}
+        for doc_id in list(self._por_doc):
+            if doc_id not in citas and not self._crea(doc_id):
+                continue
+            datos = self._aplicar(doc_id, citas.get(doc_id))
+            if (
+                datos and datos.get("fecha_ts") and desde <= datos["fecha_ts"] < hasta
+                and (shards is None or datos.get("shard") in shards)
+            ):
+                citas[doc_id] = datos
+            else:
+                citas.pop(doc_id, None)
+        return list(citas.values())
+
+    async def renovar_leases(self, replica, ttl, ahora, saliendo=False):
+        return await self.repo.renovar_leases(replica, ttl, ahora, saliendo)
+
+    async def reclamar_aviso(self, doc_id, flag, replica, ttl, ahora):
+        await self._esperar([doc_id])
+        return await self.repo.reclamar_aviso(doc_id, flag, replica, ttl, ahora)
+
+    def recorrer(self, telegram_id=None, lote=LOTE_MAX):
+        return self.repo.recorrer(telegram_id, lote)
+
+    async def migrar(self, lote=LOTE_MAX):
+        return await self.repo.migrar(lote=lote)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class EstadoConversacion:
+    # Estado compacto de una conversación en curso. Las coincidencias del
+    # flujo de modificación se guardan como lista de doc_id, no documentos.
+    __slots__ = (
+        "estado",
+        "datos",
+        "busqueda_campo",
+        "busqueda_valor",
+        "query_text",
+        "matches",
+        "modificar_doc_id",
+        "modificar_campo",
+        "modificar_nuevo_valor",
+        "listado",
+        "actualizado",
+    )
+
+    def __init__(self, **valores):
+        self.limpiar()
+        for campo, valor in valores.items():
+            setattr(self, campo, valor)
+
+    def limpiar(self):
+        self.estado = None
+        self.datos = None
+        self.busqueda_campo = ""
+        self.busqueda_valor = ""
+        self.query_text = ""
+        self.matches = []
+        self.modificar_doc_id = None
+        self.modificar_campo = None
+        self.modificar_nuevo_valor = None
+        # Listado paginado en pantalla: criterio de búsqueda, pila de
+        # cursores [fecha_ts, doc_id] por página y id del mensaje con botones
+        self.listado = None
+        self.actualizado = 0.0
+
+    def vacio(self):
+        return self.estado is None and not self.datos and not self.listado
+
+    def a_dict(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+
+class PersistenciaSQLite:
+    # Guarda los estados en un archivo SQLite local para que las
+    # conversaciones de confirmación/modificación sobrevivan a un reinicio.
+    # Salvo al arrancar, se usa desde un hilo (ver AlmacenEstados.volcar).
+
+    def __init__(self, ruta):
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS estados (chat_id INTEGER PRIMARY KEY, datos TEXT NOT NULL, actualizado REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def cargar(self, desde):
+        filas = self.conn.execute(
+            "SELECT chat_id, datos FROM estados WHERE actualizado >= ? ORDER BY actualizado", (desde,)
+        )
+        return [(chat_id, json.loads(datos)) for chat_id, datos in filas]
+
+    def escribir(self, cambios, purgar_antes=None):
+        # cambios: chat_id -> (datos JSON, actualizado), o None si se borró.
+        # Todo en una transacción y un solo commit.
+        with self.conn:
+            for chat_id, valor in cambios.items():
+                if valor is None:
+                    self.conn.execute("DELETE FROM estados WHERE chat_id = ?", (chat_id,))
+                else:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO estados (chat_id, datos, actualizado) VALUES (?, ?, ?)",
+                        (chat_id, *valor),
+                    )
+            if purgar_antes is not None:
+                self.conn.execute("DELETE FROM estados WHERE actualizado < ?", (purgar_antes,))
+
+
+class AlmacenEstados:
+    # Estados de conversación por chat con expiración (ttl segundos sin
+    # actividad), tope de memoria con desalojo LRU y persistencia opcional.
+    # Con persistencia, guardar() y borrar() sólo anotan el cambio (el último
+    # por chat) y volcar() los escribe juntos desde un hilo, sin bloquear el
+    # event loop en cada mensaje.
+
+    def __init__(self, ttl=3600, max_chats=10000, persistencia=None, reloj=time.time):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.persistencia = persistencia
+        self.reloj = reloj
+        self._estados = OrderedDict()  # chat_id -> EstadoConversacion
+        self._sucios = {}  # chat_id -> (datos JSON, actualizado) o None, pendientes de volcar
+        self._purgar_antes = None
+        self._volcando = asyncio.Lock()
+        if persistencia is not None:
+            limite = self.reloj() - ttl
+            persistencia.escribir({}, purgar_antes=limite)
+            for chat_id, valores in persistencia.cargar(limite):
+                self._estados[chat_id] = EstadoConversacion(**valores)
+            self._recortar()
+
+    def _recortar(self):
+        while len(self._estados) > self.max_chats:
+            chat_id, _ = self._estados.popitem(last=False)
+            if self.persistencia is not None:
+                self._sucios[chat_id] = None
+
+    def obtener(self, chat_id):
+        estado = self._estados.get(chat_id)
+        if estado is not None and self.reloj() - estado.actualizado > self.ttl:
+            self.borrar(chat_id)
+            estado = None
+        if estado is None:
+            return EstadoConversacion()
+        self._estados.move_to_end(chat_id)
+        return estado
+
+    def guardar(self, chat_id, estado):
+        if estado.vacio():
+            self.borrar(chat_id)
+            return
+        estado.actualizado = self.reloj()
+        self._estados[chat_id] = estado
+        self._estados.move_to_end(chat_id)
+        if self.persistencia is not None:
+            # Se serializa ya: el objeto sigue cambiando hasta el volcado
+            self._sucios[chat_id] = (json.dumps(estado.a_dict(), ensure_ascii=False), estado.actualizado)
+        self._recortar()
+
+    def borrar(self, chat_id):
+        if self._estados.pop(chat_id, None) is not None and self.persistencia is not None:
+            self._sucios[chat_id] = None
+
+    def purgar_expirados(self):
+        limite = self.reloj() - self.ttl
+        for chat_id in [c for c, e in self._estados.items() if e.actualizado < limite]:
+            self.borrar(chat_id)
+        if self.persistencia is not None:
+            self._purgar_antes = limite
+
+    async def volcar(self):
+        # Escribe en disco los cambios anotados desde el último volcado
+        if self.persistencia is None:
+            return
+        async with self._volcando:
+            if not self._sucios and self._purgar_antes is None:
+                return
+            cambios, self._sucios = self._sucios, {}
+            purgar_antes, self._purgar_antes = self._purgar_antes, None
+            try:
+                await asyncio.to_thread(self.persistencia.escribir, cambios, purgar_antes)
+            except Exception:
+                # Se reintenta en el siguiente volcado; lo anotado después manda
+                self._sucios = {**cambios, **self._sucios}
+                self._purgar_antes = self._purgar_antes or purgar_antes
+                raise
+
+    def __len__(self):
+        return len(self._estados)
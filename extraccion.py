@@ -0,0 +1,128 @@
+import json
+import time
+import metricas
+from fechas import parse_fecha_hora_gpt
+from intenciones import resultado_vacio
+
+INTENCIONES = ["consultar", "agendar", "modificar", "otro"]
+
+# Instrucciones fijas (mensaje de sistema): el formato lo impone el esquema
+PROMPT_EXTRACCION = """Clasificas mensajes sobre recordatorios de citas con clientes y extraes sus datos.
+- consultar: busca citas. Si es general ("¿qué citas tengo?") deja busqueda vacía; si es por un dato ("¿cuándo veo a Abelardo?") pon campo "cliente" y valor "Abelardo". La fecha consultada va en "fecha".
+- agendar: datos de la nueva cita en "campos".
+- modificar: en "busqueda" y "fecha" lo que identifica la cita; en "modificar" el campo a cambiar y su nuevo valor.
+- otro: cualquier otra cosa.
+Copia fechas y horas tal como las escribe el usuario. Deja vacío lo que no aparece en el mensaje.
+confianza: "baja" si dudas de la intención o de algún dato."""
+
+
+def esquema_extraccion(campos):
+    # JSON Schema estricto: el modelo no puede devolver otra forma
+    def objeto(propiedades):
+        return {
+            "type": "object",
+            "properties": propiedades,
+            "required": list(propiedades),
+            "additionalProperties": False,
+        }
+
+    nombre_campo = {"type": "string", "enum": [""] + list(campos)}
+    texto = {"type": "string"}
+    return {
+        "name": "extraccion_recordatorio",
+        "strict": True,
+        "schema": objeto({
+            "intencion": {"type": "string", "enum": INTENCIONES},
+            "fecha": texto,
+            "busqueda": objeto({"campo": nombre_campo, "valor": texto}),
+            "modificar": objeto({"campo": nombre_campo, "nuevo_valor": texto}),
+            "campos": objeto({c: texto for c in campos}),
+            "confianza": {"type": "string", "enum": ["alta", "media", "baja"]},
+        }),
+    }
+
+
+def motivo_escalado(resultado):
+    # Devuelve por qué el resultado del modelo pequeño no basta, o None
+    if resultado.get("confianza") == "baja":
+        return "confianza"
+    intencion = resultado.get("intencion")
+    if intencion == "agendar":
+        datos = resultado.get("campos", {})
+        if not datos.get("cliente"):
+            return "incompleto"
+        if datos.get("fecha_hora") and not parse_fecha_hora_gpt(datos["fecha_hora"]):
+            return "fecha"
+    if intencion == "modificar":
+        cambio = resultado.get("modificar", {})
+        if cambio.get("nuevo_valor") and not cambio.get("campo"):
+            return "incompleto"
+    return None
+
+
+class ExtractorEscalonado:
+    # Extracción de intención por niveles: primero un modelo pequeño y
+    # rápido; sólo si su respuesta es dudosa (confianza baja, datos que no
+    # cuadran, negativa o error) se repite con el modelo grande. La salida
+    # estructurada con esquema estricto evita tener que buscar el JSON en
+    # texto libre.
+
+    def __init__(self, cliente, campos, modelos=("gpt-4o-mini", "gpt-4o")):
+        self.cliente = cliente
+        self.campos = campos
+        self.modelos = tuple(modelos)
+        self.formato = {"type": "json_schema", "json_schema": esquema_extraccion(campos)}
+        self.llamadas = {m: 0 for m in self.modelos}
+        self.escaladas = 0
+
+    async def _consultar(self, modelo, texto):
+        inicio = time.perf_counter()
+        resultado = "ok"
+        try:
+            respuesta = await self.cliente.completar(
+                [{"role": "system", "content": PROMPT_EXTRACCION}, {"role": "user", "content": texto}],
+                model=modelo,
+                temperature=0.0,
+                response_format=self.formato,
+            )
+            uso = getattr(respuesta, "usage", None)
+            if uso is not None:
+                metricas.anotar(f"tokens_{modelo}", uso.total_tokens)
+            mensaje = respuesta.choices[0].message
+            # Negativa del modelo o respuesta cortada: no hay JSON válido
+            if getattr(mensaje, "refusal", None) or respuesta.choices[0].finish_reason == "length":
+                resultado = "sin_json"
+                return None
+            return json.loads(mensaje.content)
+        except Exception:
+            resultado = "error"
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.llamadas[modelo] += 1
+            metricas.EXTRACCION.observar(duracion, modelo=modelo, resultado=resultado)
+            metricas.anotar(f"extraccion_{modelo}_ms", round(duracion * 1000, 2))
+
+    async def extraer(self, texto):
+        for nivel, modelo in enumerate(self.modelos):
+            ultimo = nivel == len(self.modelos) - 1
+            try:
+                resultado = await self._consultar(modelo, texto)
+                motivo = "sin_json" if resultado is None else motivo_escalado(resultado)
+            except Exception as e:
+                if ultimo:
+                    raise
+                print(f"Extracción con {modelo} falló ({type(e).__name__}), escalando")
+                resultado, motivo = None, "error"
+            if motivo and not ultimo:
+                self.escaladas += 1
+                metricas.ESCALADAS.inc(modelo=modelo, motivo=motivo)
+                continue
+            metricas.anotar("modelo_extraccion", modelo)
+            if resultado is None:
+                return resultado_vacio(self.campos)
+            resultado.pop("confianza", None)
+            return resultado
+
+    def estadisticas(self):
+        return {"llamadas": dict(self.llamadas), "escaladas": self.escaladas}
@@ -0,0 +1,95 @@
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+import pytz
+
+LIMA = pytz.timezone("America/Lima")
+
+# Frases representativas para cargar los datos de idioma al arrancar
+FRASES_CALENTAMIENTO = ["mañana a las 5 pm", "15 de agosto a las 10:30", "el viernes por la tarde"]
+
+# Frases cuyo resultado depende de la hora actual y no sólo del día
+RE_RELATIVO_A_HORA = re.compile(r"\b(ahora|hace|dentro|en \d+|en una?)\b")
+
+_parser = None
+
+
+def parser_es():
+    # Un único DateDataParser preconfigurado en español para todo el proceso
+    # (dateparser se importa aquí: tarda en cargar y no hace falta para
+    # las fechas ISO, que son la mayoría)
+    global _parser
+    if _parser is None:
+        from dateparser.date import DateDataParser
+        _parser = DateDataParser(languages=["es"])
+    return _parser
+
+
+def precalentar():
+    # dateparser carga sus datos de idioma en el primer parseo; se hace aquí
+    # (desde un hilo al arrancar) para que no lo pague el primer usuario.
+    for frase in FRASES_CALENTAMIENTO:
+        _parse_natural(frase)
+
+
+def ahora():
+    return datetime.now(LIMA)
+
+
+def hoy():
+    return ahora().date()
+
+
+def localizar(dt):
+    if dt is not None and dt.tzinfo is None:
+        dt = LIMA.localize(dt)
+    return dt
+
+
+def iso_lima(dt):
+    # Forma en que se guarda fecha_hora: siempre con el desfase de Lima
+    return localizar(dt).astimezone(LIMA).isoformat()
+
+
+def parse_iso(valor):
+    # Camino rápido para los valores guardados (siempre en ISO 8601)
+    try:
+        return localizar(datetime.fromisoformat(valor))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_natural(texto):
+    return localizar(parser_es().get_date_data(texto).date_obj)
+
+
+@lru_cache(maxsize=2048)
+def _parse_natural_del_dia(texto, dia):
+    # "dia" sólo forma parte de la clave: "mañana" cambia a medianoche en Lima
+    return _parse_natural(texto)
+
+
+def parse_fecha_hora_gpt(fecha_str):
+    if not fecha_str:
+        return None
+    dt = parse_iso(fecha_str)
+    if dt:
+        return dt
+    texto = fecha_str.strip().lower()
+    if RE_RELATIVO_A_HORA.search(texto):
+        return _parse_natural(texto)
+    return _parse_natural_del_dia(texto, hoy())
+
+
+def parse_fecha_gpt(fecha_str):
+    if not fecha_str:
+        return None
+    texto = fecha_str.strip().lower()
+    if texto in ["hoy", "ahora"]:
+        return hoy()
+    if texto == "mañana":
+        return hoy() + timedelta(days=1)
+    dt = parse_fecha_hora_gpt(fecha_str)
+    if dt:
+        return dt.date()
+    return None
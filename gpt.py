@@ -0,0 +1,107 @@
+import asyncio
+import random
+import httpx
+import openai
+from openai import AsyncOpenAI
+import metricas
+
+# Errores transitorios que vale la pena reintentar
+ERRORES_REINTENTABLES = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class ClienteGPT:
+    # Cliente asíncrono compartido: un único pool HTTP para todo el proceso,
+    # un semáforo que limita las peticiones en vuelo y reintentos con backoff
+    # exponencial, para que una respuesta lenta no bloquee el event loop.
+
+    def __init__(self, api_key, max_concurrencia=8, timeout=30.0, reintentos=3, backoff=0.5):
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_concurrencia,
+                max_keepalive_connections=max_concurrencia,
+            ),
+            timeout=timeout,
+        )
+        # Los reintentos los controlamos aquí para que respeten el semáforo
+        self.client = AsyncOpenAI(api_key=api_key, http_client=self._http, max_retries=0)
+
+    async def completar(self, messages, model="gpt-4o", temperature=0.0, timeout=None, **kwargs):
+        timeout = timeout or self.timeout
+        for intento in range(self.reintentos + 1):
+            try:
+                async with self._semaforo:
+                    respuesta = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            **kwargs,
+                        ),
+                        timeout=timeout,
+                    )
+                self._contar_tokens(model, respuesta)
+                return respuesta
+            except ERRORES_REINTENTABLES as e:
+                if intento == self.reintentos:
+                    raise
+                espera = self.backoff * (2 ** intento) * (1 + random.random())
+                print(f"Error GPT ({type(e).__name__}), reintentando en {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+    async def completar_stream(self, messages, model="gpt-4o", temperature=0.0, timeout=None, **kwargs):
+        # Genera los fragmentos de texto de la respuesta a medida que llegan.
+        # Sólo se reintenta si falla antes del primer fragmento: después el
+        # usuario ya está viendo la respuesta.
+        timeout = timeout or self.timeout
+        for intento in range(self.reintentos + 1):
+            fragmentos = 0
+            try:
+                async with self._semaforo:
+                    stream = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            stream=True,
+                            **kwargs,
+                        ),
+                        timeout=timeout,
+                    )
+                    async for chunk in stream:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            fragmentos += 1
+                            yield delta
+                # El stream no trae "usage"; cada fragmento es ~1 token
+                metricas.GPT_TOKENS.inc(fragmentos, modelo=model, tipo="completion")
+                return
+            except ERRORES_REINTENTABLES as e:
+                if fragmentos or intento == self.reintentos:
+                    raise
+                espera = self.backoff * (2 ** intento) * (1 + random.random())
+                print(f"Error GPT ({type(e).__name__}), reintentando en {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+    async def calentar(self):
+        # Abre la conexión TLS del pool con una llamada que no consume tokens
+        async with self._semaforo:
+            await asyncio.wait_for(self.client.models.list(), timeout=self.timeout)
+
+    def _contar_tokens(self, model, respuesta):
+        uso = getattr(respuesta, "usage", None)
+        if uso is not None:
+            metricas.GPT_TOKENS.inc(uso.prompt_tokens or 0, modelo=model, tipo="prompt")
+            metricas.GPT_TOKENS.inc(uso.completion_tokens or 0, modelo=model, tipo="completion")
+
+    async def cerrar(self):
+        await self._http.aclose()
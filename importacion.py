@@ -0,0 +1,199 @@
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sys
+from fechas import ahora, iso_lima, parse_fecha_hora_gpt
+from repositorio import LOTE_MAX, normalizar_texto
+
+# Campos calculados al guardar: no se exportan (se regeneran al importar)
+CAMPOS_DERIVADOS_EXPORT = ("fecha_ts", "fecha_dia", "cliente_tokens", "proyecto_tokens", "shard")
+
+
+def normalizar_columna(nombre):
+    return normalizar_texto(nombre).strip().replace(" ", "_")
+
+
+class FilaIlegible:
+    # Línea que no se pudo leer: validar_fila la cuenta como error de fila
+    __slots__ = ("motivo",)
+
+    def __init__(self, motivo):
+        self.motivo = motivo
+
+
+def leer_filas(ruta):
+    # Genera (número de línea, fila) de un CSV (con cabecera) o JSONL
+    if ruta.endswith(".jsonl") or ruta.endswith(".ndjson"):
+        with open(ruta, encoding="utf-8") as f:
+            for linea, texto in enumerate(f, 1):
+                if texto.strip():
+                    try:
+                        yield linea, json.loads(texto)
+                    except json.JSONDecodeError as e:
+                        yield linea, FilaIlegible(f"JSON inválido: {e.msg}")
+        return
+    with open(ruta, encoding="utf-8-sig", newline="") as f:
+        lector = csv.reader(f)
+        columnas = [normalizar_columna(c) for c in next(lector, [])]
+        for linea, valores in enumerate(lector, 2):
+            if any(v.strip() for v in valores):
+                yield linea, dict(zip(columnas, valores))
+
+
+def id_importado(datos, campos):
+    # Id determinista por contenido: reimportar el mismo archivo (o
+    # reanudarlo) sobrescribe en vez de duplicar
+    clave = json.dumps([datos.get("telegram_id")] + [datos.get(c, "") for c in campos], ensure_ascii=False)
+    return "imp-" + hashlib.sha1(clave.encode()).hexdigest()[:20]
+
+
+def validar_fila(fila, campos, fechas, telegram_id=None, usuario=None):
+    # Devuelve (datos, None) o (None, motivo). "fechas" son las fechas del
+    # lote ya parseadas (texto -> datetime)
+    if isinstance(fila, FilaIlegible):
+        return None, fila.motivo
+    if not isinstance(fila, dict):
+        return None, f"la fila no es un objeto: {type(fila).__name__}"
+    datos = {c: str(fila.get(c) or "").strip() for c in campos}
+    if not datos.get("cliente"):
+        return None, "falta cliente"
+    dt = fechas.get(datos.get("fecha_hora", ""))
+    if not dt:
+        return None, f"fecha_hora inválida: {datos.get('fecha_hora', '')!r}"
+    datos["fecha_hora"] = iso_lima(dt)
+    try:
+        datos["telegram_id"] = int(fila.get("telegram_id") or telegram_id)
+    except (TypeError, ValueError):
+        return None, "falta telegram_id (columna o --telegram-id)"
+    datos["telegram_user"] = str(fila.get("telegram_user") or usuario or "importado").strip()
+    datos["fecha_creacion"] = ahora().isoformat()
+    return datos, None
+
+
+def parsear_fechas(filas):
+    # Parseo en bloque: cada texto distinto una sola vez por lote
+    textos = {str(f.get("fecha_hora") or "").strip() for _, f in filas if isinstance(f, dict)}
+    return {texto: parse_fecha_hora_gpt(texto) for texto in textos}
+
+
+class Checkpoint:
+    # Última línea importada sin huecos, en un archivo JSON junto al origen.
+    # Los lotes terminan en desorden: sólo se avanza por el prefijo contiguo.
+
+    def __init__(self, ruta, origen):
+        self.ruta = ruta
+        self.origen = os.path.abspath(origen)
+        self.linea = 0
+        self.importados = 0
+        self._terminados = {}  # línea inicial del lote -> (línea final, importados)
+        self._pendientes = []  # líneas iniciales de los lotes en orden
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                guardado = json.load(f)
+            if guardado.get("origen") == self.origen:
+                self.linea = guardado["linea"]
+                self.importados = guardado["importados"]
+
+    def iniciar(self, primera):
+        self._pendientes.append(primera)
+
+    def terminar(self, primera, ultima, importados):
+        self._terminados[primera] = (ultima, importados)
+        avanzo = False
+        while self._pendientes and self._pendientes[0] in self._terminados:
+            self.linea, n = self._terminados.pop(self._pendientes.pop(0))
+            self.importados += n
+            avanzo = True
+        if avanzo and self.ruta:
+            temporal = self.ruta + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump({"origen": self.origen, "linea": self.linea, "importados": self.importados}, f)
+            os.replace(temporal, self.ruta)
+
+
+async def importar(repo, ruta, campos, telegram_id=None, usuario=None, lote=LOTE_MAX,
+                   concurrencia=4, checkpoint=None, simular=False):
+    # Lee el archivo en streaming, valida y escribe lotes de hasta 500
+    # documentos con varias confirmaciones de WriteBatch en vuelo. Con
+    # simular sólo valida: no escribe ni lee ni avanza el checkpoint, y
+    # devuelve las filas válidas en lugar de las importadas.
+    lote = min(lote, LOTE_MAX)
+    progreso = Checkpoint(None if simular else checkpoint, ruta)
+    if progreso.linea:
+        print(f"Reanudando {ruta} desde la línea {progreso.linea + 1} ({progreso.importados} ya importados)")
+    semaforo = asyncio.Semaphore(concurrencia)
+    tareas = set()
+    fallo = asyncio.Event()
+    errores = 0
+    validados = 0
+
+    async def escribir(primera, ultima, docs):
+        try:
+            if docs:
+                await repo.agregar_lote(docs)
+            progreso.terminar(primera, ultima, len(docs))
+        except Exception:
+            # Deja de leer: el checkpoint queda antes de este lote
+            fallo.set()
+            raise
+        finally:
+            semaforo.release()
+
+    async def enviar(filas):
+        nonlocal errores, validados
+        fechas = parsear_fechas(filas)
+        docs = []
+        for linea, fila in filas:
+            datos, motivo = validar_fila(fila, campos, fechas, telegram_id, usuario)
+            if motivo:
+                errores += 1
+                print(f"Línea {linea}: {motivo}", file=sys.stderr)
+                continue
+            docs.append((id_importado(datos, campos), datos))
+        if simular:
+            validados += len(docs)
+            return
+        await semaforo.acquire()
+        progreso.iniciar(filas[0][0])
+        tarea = asyncio.create_task(escribir(filas[0][0], filas[-1][0], docs))
+        tareas.add(tarea)
+        tarea.add_done_callback(tareas.discard)
+
+    filas = []
+    for linea, fila in leer_filas(ruta):
+        if fallo.is_set():
+            filas = []
+            break
+        if linea <= progreso.linea:
+            continue
+        filas.append((linea, fila))
+        if len(filas) == lote:
+            await enviar(filas)
+            filas = []
+    if filas:
+        await enviar(filas)
+    # Espera a los lotes en vuelo aunque uno falle, para no perder su progreso
+    for resultado in await asyncio.gather(*tareas, return_exceptions=True):
+        if isinstance(resultado, Exception):
+            raise resultado
+    return (validados if simular else progreso.importados), errores
+
+
+def para_exportar(datos):
+    return {k: v for k, v in datos.items() if k not in CAMPOS_DERIVADOS_EXPORT and not k.endswith("_reclamo")}
+
+
+async def exportar(repo, salida, telegram_id=None, lote=LOTE_MAX):
+    # Una línea JSON por recordatorio, página a página (memoria constante)
+    total = 0
+    archivo = sys.stdout if salida == "-" else open(salida, "w", encoding="utf-8")
+    try:
+        async for datos in repo.recorrer(telegram_id, lote):
+            archivo.write(json.dumps(para_exportar(datos), ensure_ascii=False, default=str) + "\n")
+            total += 1
+    finally:
+        if archivo is not sys.stdout:
+            archivo.close()
+    return total
@@ -0,0 +1,229 @@
+import asyncio
+import re
+from collections import Counter, OrderedDict, defaultdict
+from itertools import chain
+from rapidfuzz import fuzz, process
+from repositorio import normalizar_texto
+
+CAMPOS_BUSCABLES = ["observaciones", "cliente", "proyecto"]
+LARGO_CLAVE = 4
+MAX_CANDIDATOS = 1000
+TROZO_CONSTRUCCION = 200  # documentos indexados entre cesiones del event loop
+PALABRAS_VACIAS = {
+    "que", "con", "del", "las", "los", "una", "uno", "por", "para", "sobre", "como", "mis",
+    "tengo", "esta", "este", "eso", "esa", "donde", "cuando", "quiero", "buscar", "reunion",
+}
+
+
+def normalizar_busqueda(texto):
+    return " ".join(re.sub(r"[^\w\s]", " ", normalizar_texto(texto)).split())
+
+
+def claves_texto(texto):
+    # Palabras significativas completas y sus prefijos (toleran plurales y
+    # sufijos); un documento que comparte palabra y prefijo suma dos claves
+    claves = set()
+    for p in texto.split():
+        if len(p) >= 3 and p not in PALABRAS_VACIAS:
+            claves.add(p)
+            claves.add(p[:LARGO_CLAVE] + "*")
+    return claves
+
+
+class IndiceUsuario:
+    __slots__ = ("textos", "datos", "invertido")
+
+    def __init__(self):
+        self.textos = {}  # doc_id -> texto normalizado
+        self.datos = {}  # doc_id -> datos del recordatorio
+        self.invertido = {}  # clave -> {doc_id}
+
+    def quitar(self, doc_id):
+        texto = self.textos.pop(doc_id, None)
+        self.datos.pop(doc_id, None)
+        if texto is None:
+            return
+        for clave in claves_texto(texto):
+            docs = self.invertido.get(clave)
+            if docs:
+                docs.discard(doc_id)
+                if not docs:
+                    del self.invertido[clave]
+
+    def guardar(self, doc_id, datos):
+        self.quitar(doc_id)
+        texto = normalizar_busqueda(" ".join(str(datos.get(c, "") or "") for c in CAMPOS_BUSCABLES))
+        self.textos[doc_id] = texto
+        self.datos[doc_id] = datos
+        for clave in claves_texto(texto):
+            self.invertido.setdefault(clave, set()).add(doc_id)
+
+    def _podar(self, listas):
+        # Si todos los documentos con alguna clave de la consulta caben en el
+        # presupuesto se puntúan todos. Si no, se quedan los que más claves
+        # (palabras y prefijos) comparten con la consulta; en el último nivel
+        # que entra a medias decide el doc_id, así el recorte no depende del
+        # orden de iteración de los conjuntos.
+        if sum(len(docs) for docs in listas) <= MAX_CANDIDATOS:
+            return set().union(*listas)
+        por_claves = defaultdict(list)
+        for doc_id, n in Counter(chain.from_iterable(listas)).items():
+            por_claves[n].append(doc_id)
+        candidatos = []
+        for n in sorted(por_claves, reverse=True):
+            docs = por_claves[n]
+            faltan = MAX_CANDIDATOS - len(candidatos)
+            if len(docs) >= faltan:
+                candidatos += sorted(docs)[:faltan]
+                break
+            candidatos += docs
+        return candidatos
+
+    def buscar(self, consulta, limite, umbral):
+        consulta = normalizar_busqueda(consulta)
+        listas = sorted(
+            (self.invertido[c] for c in claves_texto(consulta) if c in self.invertido),
+            key=len,
+        )
+        if not listas:
+            return []
+        candidatos = self._podar(listas)
+        resultados = process.extract(
+            consulta,
+            {doc_id: self.textos[doc_id] for doc_id in candidatos},
+            scorer=fuzz.token_set_ratio,
+            processor=None,
+            limit=limite,
+            score_cutoff=umbral,
+        )
+        return [(round(score), self.datos[doc_id]) for _, score, doc_id in resultados]
+
+
+class _Construccion:
+    # Índice de un usuario a medio construir desde la lectura inicial, más
+    # los cambios recibidos entretanto, que mandan sobre esa lectura
+    __slots__ = ("indice", "tocados", "cambios")
+
+    def __init__(self):
+        self.indice = IndiceUsuario()
+        self.tocados = set()  # doc_id guardados o borrados durante la construcción
+        self.cambios = {}  # doc_id -> cambios parciales aún sin documento indexado
+
+    def agregar(self, datos):
+        doc_id = datos["doc_id"]
+        if doc_id in self.tocados:
+            return
+        if doc_id in self.cambios:
+            datos = dict(datos, **self.cambios.pop(doc_id))
+        self.indice.guardar(doc_id, datos)
+
+    def guardar(self, doc_id, datos):
+        self.tocados.add(doc_id)
+        self.cambios.pop(doc_id, None)
+        self.indice.guardar(doc_id, datos)
+
+    def actualizar(self, doc_id, cambios):
+        if doc_id in self.indice.datos:
+            self.indice.guardar(doc_id, dict(self.indice.datos[doc_id], **cambios))
+        else:
+            self.cambios[doc_id] = dict(self.cambios.get(doc_id, {}), **cambios)
+
+    def quitar(self, doc_id):
+        self.tocados.add(doc_id)
+        self.cambios.pop(doc_id, None)
+        self.indice.quitar(doc_id)
+
+
+class IndiceBusqueda:
+    # Índice de búsqueda por usuario sobre observaciones, cliente y proyecto:
+    # textos ya normalizados, un índice invertido de palabras y prefijos para descartar
+    # candidatos y una sola llamada a process.extract para puntuar. Se
+    # construye con el primer escaneo del usuario y luego se actualiza de
+    # forma incremental como observador de RepositorioConCache.
+    # La construcción va por trozos, cediendo el event loop entre uno y otro:
+    # con decenas de miles de documentos hacerla de una vez frenaría a todos
+    # los chats. Los cambios que llegan mientras tanto se aplican al índice
+    # en construcción y prevalecen sobre la lectura inicial.
+
+    def __init__(self, repo, max_usuarios=200):
+        self.repo = repo
+        self.max_usuarios = max_usuarios
+        self._usuarios = OrderedDict()  # telegram_id -> IndiceUsuario
+        self._usuario_de_doc = {}
+        self._cargando = {}  # telegram_id -> tarea de construcción
+        self._construyendo = {}  # telegram_id -> _Construccion
+
+    async def _indice(self, telegram_id):
+        indice = self._usuarios.get(telegram_id)
+        if indice is not None:
+            self._usuarios.move_to_end(telegram_id)
+            return indice
+        # Varias búsquedas simultáneas del mismo chat comparten la construcción
+        tarea = self._cargando.get(telegram_id)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._construir(telegram_id))
+            self._cargando[telegram_id] = tarea
+            tarea.add_done_callback(lambda _: self._cargando.pop(telegram_id, None))
+        return await asyncio.shield(tarea)
+
+    async def _construir(self, telegram_id):
+        construccion = _Construccion()
+        self._construyendo[telegram_id] = construccion
+        try:
+            docs = await self.repo.por_usuario(telegram_id)
+            for i, d in enumerate(docs):
+                if i and i % TROZO_CONSTRUCCION == 0:
+                    await asyncio.sleep(0)
+                construccion.agregar(d)
+        finally:
+            vigente = self._construyendo.pop(telegram_id, None) is construccion
+        indice = construccion.indice
+        if not vigente:
+            # El chat se desalojó mientras tanto: sirve para esta búsqueda,
+            # pero ya no recibiría cambios
+            return indice
+        for doc_id in indice.textos:
+            self._usuario_de_doc[doc_id] = telegram_id
+        self._usuarios[telegram_id] = indice
+        while len(self._usuarios) > self.max_usuarios:
+            self.chat_desalojado(next(iter(self._usuarios)))
+        return indice
+
+    async def buscar(self, telegram_id, consulta, limite=5, umbral=60):
+        indice = await self._indice(telegram_id)
+        return indice.buscar(consulta, limite, umbral)
+
+    # ---- notificaciones de RepositorioConCache ----
+
+    def doc_guardado(self, telegram_id, doc_id, datos):
+        construccion = self._construyendo.get(telegram_id)
+        if construccion is not None:
+            construccion.guardar(doc_id, dict(datos, doc_id=doc_id))
+        indice = self._usuarios.get(telegram_id)
+        if indice is not None:
+            indice.guardar(doc_id, dict(datos, doc_id=doc_id))
+            self._usuario_de_doc[doc_id] = telegram_id
+
+    def doc_actualizado(self, doc_id, cambios):
+        # Sólo llega el doc_id: cualquier construcción en curso puede tenerlo
+        for construccion in self._construyendo.values():
+            construccion.actualizar(doc_id, cambios)
+        indice = self._usuarios.get(self._usuario_de_doc.get(doc_id))
+        if indice is not None and doc_id in indice.datos:
+            indice.guardar(doc_id, dict(indice.datos[doc_id], **cambios))
+
+    def doc_borrado(self, telegram_id, doc_id):
+        construccion = self._construyendo.get(telegram_id)
+        if construccion is not None:
+            construccion.quitar(doc_id)
+        indice = self._usuarios.get(telegram_id)
+        if indice is not None:
+            indice.quitar(doc_id)
+        self._usuario_de_doc.pop(doc_id, None)
+
+    def chat_desalojado(self, telegram_id):
+        self._construyendo.pop(telegram_id, None)
+        indice = self._usuarios.pop(telegram_id, None)
+        if indice is not None:
+            for doc_id in indice.textos:
+                self._usuario_de_doc.pop(doc_id, None)
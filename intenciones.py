@@ -0,0 +1,168 @@
+import re
+import unicodedata
+from rapidfuzz import fuzz, process
+import metricas
+
+AFIRMACIONES = {"si", "ok", "dale", "confirmo", "confirmado", "claro", "correcto", "perfecto", "vale", "listo", "guardalo", "guarda", "exacto", "yes"}
+
+SUSTANTIVOS = ["citas", "cita", "recordatorios", "recordatorio", "reuniones", "reunion", "pendientes", "pendiente"]
+# Crear recordatorios necesita extraer todos los campos: siempre va a GPT
+VERBOS_AGENDAR = ["agenda", "agendar", "agendame", "programa", "programar", "programame", "crea", "crear", "anota", "anotar", "nueva", "nuevo", "recuerdame", "recordar", "guarda", "guardar"]
+VERBOS_MODIFICAR = ["modificar", "modifica", "cambiar", "cambia", "editar", "edita", "reprogramar", "reprograma", "mover", "mueve"]
+RELLENO = {
+    "que", "cual", "cuales", "cuando", "tengo", "tenemos", "hay", "mis", "mi", "de", "del", "la", "las",
+    "el", "los", "para", "es", "son", "me", "a", "y", "por", "favor", "en", "un", "una", "ver", "dime",
+    "muestrame", "muestra", "lista", "listar", "todas", "todos", "quiero", "saber", "cuentame", "programadas",
+    "programada", "agendadas", "agendada", "hola", "tiene", "tienes",
+}
+MESES = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "setiembre", "octubre", "noviembre", "diciembre"]
+
+# Fechas que parse_fecha_gpt entiende tal cual
+RE_FECHA = re.compile(
+    r"\b(?:hoy|mañana|manana"
+    r"|\d{1,2}/\d{1,2}(?:/\d{2,4})?"
+    r"|\d{1,2} de (?:" + "|".join(MESES) + r")(?: de \d{4})?)\b"
+)
+CAMPOS_BUSQUEDA = ["cliente", "num_cliente", "proyecto", "modalidad", "observaciones"]
+# Palabras que cierran el valor buscado ("con Juan a las 5 pm" -> "juan")
+FIN_VALOR = {"a", "al", "para", "por", "en", "desde", "hasta", "hoy", "manana", "pasado"}
+# Lo que puede seguir al valor en una consulta sin cambiar su sentido (la hora)
+RE_HORA = re.compile(r"^\d{1,2}(?:[:h]\d{2})?(?:am|pm|hrs?)?$")
+COLA_HORA = {"a", "al", "las", "la", "de", "del", "en", "y", "media", "tarde", "manana", "noche", "am", "pm", "hrs", "hora", "horas"}
+ARTICULOS = {"el", "la", "los", "las"}
+UMBRAL_FUZZY = 85
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[¿?¡!.,;:]", " ", texto).split()
+
+
+def es_afirmacion(texto):
+    tokens = normalizar(texto)
+    return bool(tokens) and all(t in AFIRMACIONES for t in tokens)
+
+
+def resultado_vacio(campos):
+    return {
+        "intencion": "otro",
+        "fecha": "",
+        "busqueda": {"campo": "", "valor": ""},
+        "modificar": {"campo": "", "nuevo_valor": ""},
+        "campos": {k: "" for k in campos},
+    }
+
+
+class RouterIntenciones:
+    # Preclasificador determinista delante de prompt_gpt_neomind: resuelve
+    # las consultas y modificaciones más comunes con regex, sinónimos de
+    # CAMPO_FLEX y coincidencia difusa, y devuelve el mismo JSON que GPT.
+    # Si no reconoce con seguridad el mensaje devuelve None.
+
+    def __init__(self, campos, campo_flex, umbral=0.9):
+        self.campos = campos
+        self.umbral = umbral
+        self.marcadores = {}
+        for clave in CAMPOS_BUSQUEDA:
+            for variante in [clave.replace("_", " ")] + campo_flex.get(clave, []):
+                self.marcadores[tuple(normalizar(variante))] = clave
+        # Las variantes más largas primero ("numero de cliente" antes que "cliente")
+        self.marcadores = sorted(self.marcadores.items(), key=lambda x: -len(x[0]))
+        self.consultas = 0
+        self.aciertos = 0
+
+    def _es(self, token, vocabulario):
+        if token in vocabulario:
+            return True
+        if len(token) < 5:
+            return False
+        return process.extractOne(token, vocabulario, scorer=fuzz.ratio, score_cutoff=UMBRAL_FUZZY) is not None
+
+    def _marcador(self, claves, i):
+        # Devuelve (campo, longitud) si en la posición i empieza un nombre de campo
+        for variante, clave in self.marcadores:
+            if tuple(claves[i:i + len(variante)]) == variante:
+                return clave, len(variante)
+        if claves[i] == "con":
+            return "cliente", 1
+        return None
+
+    def _clasificar(self, texto):
+        texto_l = texto.lower()
+        fecha = ""
+        m = RE_FECHA.search(texto_l)
+        if m:
+            fecha = m.group(0)
+            texto_l = texto_l[:m.start()] + " " + texto_l[m.end():]
+
+        tokens = re.sub(r"[¿?¡!.,;:]", " ", texto_l).split()
+        claves = [normalizar(t)[0] if normalizar(t) else "" for t in tokens]
+        if not tokens:
+            return None, 0.0
+
+        intencion = None
+        campo = valor = ""
+        reconocidos = 0
+        i = 0
+        while i < len(claves):
+            clave = claves[i]
+            if clave in VERBOS_AGENDAR:
+                return None, 0.0
+            if self._es(clave, VERBOS_MODIFICAR):
+                intencion = "modificar"
+            elif self._es(clave, SUSTANTIVOS):
+                intencion = intencion or "consultar"
+            elif not campo and self._marcador(claves, i):
+                campo, largo = self._marcador(claves, i)
+                inicio = i + largo
+                if clave == "con":
+                    # "con el cliente Juan": el campo lo da el marcador siguiente
+                    j = inicio
+                    while j < len(claves) and claves[j] in ARTICULOS:
+                        j += 1
+                    if j < len(claves) and self._marcador(claves, j):
+                        return None, 0.0
+                fin = inicio
+                while fin < len(claves) and claves[fin] not in FIN_VALOR and not RE_HORA.match(claves[fin]):
+                    fin += 1
+                valor = " ".join(tokens[inicio:fin]).strip()
+                if not valor:
+                    return None, 0.0
+                cola = claves[fin:]
+                if cola and (intencion == "modificar" or not all(t in COLA_HORA or RE_HORA.match(t) for t in cola)):
+                    # Lo que sigue al valor (nuevo valor, más criterios) lo resuelve GPT
+                    return None, 0.0
+                reconocidos += len(tokens) - i
+                break
+            elif clave not in RELLENO and clave:
+                i += 1
+                continue
+            reconocidos += 1
+            i += 1
+
+        if not intencion:
+            return None, 0.0
+        resultado = resultado_vacio(self.campos)
+        resultado["intencion"] = intencion
+        resultado["fecha"] = fecha
+        resultado["busqueda"] = {"campo": campo, "valor": valor}
+        return resultado, reconocidos / len(tokens)
+
+    def clasificar(self, texto):
+        self.consultas += 1
+        resultado, confianza = self._clasificar(texto)
+        if resultado is None or confianza < self.umbral:
+            metricas.ROUTER.inc(resultado="gpt")
+            return None
+        self.aciertos += 1
+        metricas.ROUTER.inc(resultado="local")
+        resultado["origen"] = "local"
+        return resultado
+
+    def estadisticas(self):
+        return {
+            "consultas": self.consultas,
+            "aciertos": self.aciertos,
+            "tasa_aciertos": self.aciertos / self.consultas if self.consultas else 0.0,
+        }
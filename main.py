@@ -1,17 +1,30 @@
 import os
-import openai
-import firebase_admin
-from firebase_admin import credentials, firestore
-from telegram import Update
-from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, ContextTypes, filters
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, CallbackQueryHandler, ContextTypes, filters
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import pytz
-import dateparser
-import re
-import json
-from rapidfuzz import fuzz
+from datetime import date, datetime
 import asyncio
+import sys
+import traceback
+from scheduler import SchedulerRecordatorios
+from coordinacion import CoordinadorShards
+from agenda import AgendaDiaria
+from repositorio import RepositorioRecordatorios, cursor_de
+from cache_recordatorios import RepositorioConCache
+from escrituras import EscriturasDiferidas, PersistenciaEscrituras
+from indice_busqueda import IndiceBusqueda
+from intenciones import RouterIntenciones, es_afirmacion
+from cache import CacheExtracciones
+from extraccion import ExtractorEscalonado
+from estados import AlmacenEstados, PersistenciaSQLite
+from notificaciones import Despachador
+from concurrencia import BloqueosPorChat
+from streaming import MensajeProgresivo
+import fechas
+from fechas import LIMA, ahora, hoy, iso_lima, parse_fecha_gpt, parse_fecha_hora_gpt
+import comandos
+import metricas
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -19,15 +32,62 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_CREDS_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
 GRUPO_TELEGRAM_ID = os.getenv("GRUPO_TELEGRAM_ID")  # <-- grupo del .env
 
-openai.api_key = OPENAI_API_KEY
-
-if not firebase_admin._apps:
-    cred = credentials.Certificate(GOOGLE_CREDS_JSON)
-    firebase_admin.initialize_app(cred)
-db = firestore.client()
+OPENAI_MAX_CONCURRENCIA = int(os.getenv("OPENAI_MAX_CONCURRENCIA", "8"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_REINTENTOS = int(os.getenv("OPENAI_REINTENTOS", "3"))
+CACHE_GPT_MAX = int(os.getenv("CACHE_GPT_MAX", "1000"))
+CACHE_GPT_TTL = float(os.getenv("CACHE_GPT_TTL", "600"))
+# Extracción de intención: modelo pequeño primero, el grande sólo si hay dudas
+GPT_MODELO_EXTRACCION = os.getenv("GPT_MODELO_EXTRACCION", "gpt-4o-mini")
+GPT_MODELO_ESCALADO = os.getenv("GPT_MODELO_ESCALADO", "gpt-4o")
+# Varias réplicas: los avisos se reparten por shards con leases en Firestore
+SCHEDULER_LEASES = os.getenv("SCHEDULER_LEASES", "").lower() in ("1", "true", "si", "sí")
+REPLICA_ID = os.getenv("REPLICA_ID")  # por defecto hostname-pid
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+# Agenda diaria a cada chat (y combinada al grupo) a esta hora de Lima; vacío = desactivada
+AGENDA_HORA = os.getenv("AGENDA_HORA", "")  # p. ej. 07:00
+TAM_PAGINA = int(os.getenv("TAM_PAGINA", "10"))  # recordatorios por página en los listados
+CACHE_CHATS_MAX = int(os.getenv("CACHE_CHATS_MAX", "500"))
+CACHE_LISTENERS_MAX = int(os.getenv("CACHE_LISTENERS_MAX", "100"))  # listeners on_snapshot de la caché
+ESTADOS_TTL = float(os.getenv("ESTADOS_TTL", "3600"))
+ESTADOS_MAX = int(os.getenv("ESTADOS_MAX", "10000"))
+ESTADOS_SQLITE = os.getenv("ESTADOS_SQLITE")  # ruta opcional, p. ej. estados.db
+ESTADOS_VOLCADO = float(os.getenv("ESTADOS_VOLCADO", "1"))  # segundos entre volcados a ESTADOS_SQLITE
+# Cola local de escrituras (write-behind); vacío = escribir en Firestore antes de responder
+ESCRITURAS_SQLITE = os.getenv("ESCRITURAS_SQLITE", "escrituras.db")
+TELEGRAM_MSG_POR_SEG = float(os.getenv("TELEGRAM_MSG_POR_SEG", "25"))
+TELEGRAM_GRUPO_MSG_POR_MIN = float(os.getenv("TELEGRAM_GRUPO_MSG_POR_MIN", "20"))
+BOT_MODO = os.getenv("BOT_MODO", "polling")  # "polling" o "webhook"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL pública; sin ella el webhook sólo escucha en local
+WEBHOOK_SECRETO = os.getenv("WEBHOOK_SECRETO")
+WEBHOOK_PUERTO = int(os.getenv("WEBHOOK_PUERTO", "8080"))
+WEBHOOK_RUTA = os.getenv("WEBHOOK_RUTA", "/telegram")
+UPDATES_CONCURRENTES = int(os.getenv("UPDATES_CONCURRENTES", "64"))
+METRICAS_PUERTO = int(os.getenv("METRICAS_PUERTO", "0"))  # 0 = sin endpoint /metrics
+METRICAS_HOST = os.getenv("METRICAS_HOST", "127.0.0.1")
+LOG_MENSAJES_JSON = os.getenv("LOG_MENSAJES_JSON", "").lower() in ("1", "true", "si", "sí")
+GPT_STREAMING = os.getenv("GPT_STREAMING", "1").lower() in ("1", "true", "si", "sí")
+EDICION_INTERVALO = float(os.getenv("EDICION_INTERVALO", "1"))  # segundos entre ediciones en privado
+EDICION_INTERVALO_GRUPO = float(os.getenv("EDICION_INTERVALO_GRUPO", "3"))  # grupos: ~20 msgs/min
+
+# Servicios externos: se crean en configurar(), no al importar el módulo.
+# Los handlers esperan a servicios_listos antes de usarlos.
+cliente_gpt = None
+extractor = None
+repo = None
+escrituras = None
+indice_busqueda = None
+scheduler = None
+coordinador = None
+agenda = None
+servicios_listos = asyncio.Event()
+tarea_arranque = None
+despachador = Despachador(
+    tasa_global=TELEGRAM_MSG_POR_SEG,
+    tasa_grupo=TELEGRAM_GRUPO_MSG_POR_MIN / 60,
+)
 
 CAMPOS = ["cliente", "num_cliente", "proyecto", "modalidad", "fecha_hora", "observaciones"]
-user_states = {}
 
 CAMPO_FLEX = {
     "cliente": ["cliente"],
@@ -37,6 +97,114 @@ CAMPO_FLEX = {
     "fecha_hora": ["fecha hora", "fecha y hora", "hora", "fecha"],
     "observaciones": ["observacion", "observaciones", "observación", "observaciones", "nota", "notas"]
 }
+router = RouterIntenciones(CAMPOS, CAMPO_FLEX)
+bloqueos_chat = BloqueosPorChat()
+estados = AlmacenEstados(
+    ttl=ESTADOS_TTL,
+    max_chats=ESTADOS_MAX,
+    persistencia=PersistenciaSQLite(ESTADOS_SQLITE) if ESTADOS_SQLITE else None,
+)
+cache_extracciones = CacheExtracciones(
+    hoy,
+    max_entradas=CACHE_GPT_MAX,
+    ttl=CACHE_GPT_TTL,
+)
+
+def importar_clientes():
+    # Importaciones pesadas (firebase_admin, openai); al arrancar se hacen
+    # en un hilo para no bloquear el event loop mientras se atiende Telegram.
+    import firebase_admin  # noqa: F401
+    from firebase_admin import firestore, firestore_async  # noqa: F401
+    import gpt  # noqa: F401
+
+def configurar(repo_base=None, gpt=None, db_listener=None, ruta_escrituras=None):
+    # Crea los clientes de Firestore y OpenAI y los objetos que dependen de
+    # ellos. Los benchmarks y pruebas pasan aquí sus implementaciones en memoria.
+    # No hace llamadas de red: las conexiones se abren en calentar().
+    global cliente_gpt, extractor, repo, escrituras, indice_busqueda, scheduler, coordinador, agenda
+    if repo_base is None:
+        import firebase_admin
+        from firebase_admin import credentials, firestore, firestore_async
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(GOOGLE_CREDS_JSON)
+            firebase_admin.initialize_app(cred)
+        repo_base = RepositorioRecordatorios(firestore_async.client())
+        # El cliente síncrono sólo se usa para los listeners on_snapshot de la caché
+        db_listener = firestore.client()
+    if gpt is None:
+        from gpt import ClienteGPT
+        gpt = ClienteGPT(
+            OPENAI_API_KEY,
+            max_concurrencia=OPENAI_MAX_CONCURRENCIA,
+            timeout=OPENAI_TIMEOUT,
+            reintentos=OPENAI_REINTENTOS,
+        )
+    cliente_gpt = gpt
+    extractor = ExtractorEscalonado(gpt, CAMPOS, dict.fromkeys([GPT_MODELO_EXTRACCION, GPT_MODELO_ESCALADO]))
+    cacheado = RepositorioConCache(
+        repo_base,
+        db_listener=db_listener,
+        max_chats=CACHE_CHATS_MAX,
+        max_listeners=CACHE_LISTENERS_MAX,
+    )
+    ruta_escrituras = ESCRITURAS_SQLITE if ruta_escrituras is None else ruta_escrituras
+    if ruta_escrituras:
+        escrituras = EscriturasDiferidas(cacheado, PersistenciaEscrituras(ruta_escrituras))
+        repo = escrituras
+    else:
+        repo = cacheado
+    indice_busqueda = IndiceBusqueda(repo)
+    cacheado.observadores.append(indice_busqueda)
+    coordinador = CoordinadorShards(repo, REPLICA_ID, LEASE_TTL) if SCHEDULER_LEASES else None
+    scheduler = SchedulerRecordatorios(repo, coordinador=coordinador)
+    if AGENDA_HORA:
+        agenda = AgendaDiaria(
+            repo,
+            despachador,
+            datetime.strptime(AGENDA_HORA, "%H:%M").time(),
+            grupo_id=int(GRUPO_TELEGRAM_ID) if GRUPO_TELEGRAM_ID else None,
+            coordinador=coordinador,
+        )
+    servicios_listos.set()
+
+async def calentar():
+    # Precarga dateparser en español y abre las conexiones con Firestore y
+    # OpenAI antes del primer mensaje. Un fallo aquí sólo se registra.
+    inicio = time.perf_counter()
+    resultados = await asyncio.gather(
+        asyncio.to_thread(fechas.precalentar),
+        repo.obtener("_calentamiento"),
+        cliente_gpt.calentar(),
+        return_exceptions=True,
+    )
+    for nombre, r in zip(["dateparser", "firestore", "openai"], resultados):
+        if isinstance(r, Exception):
+            print(f"Precalentamiento de {nombre} falló: {r}")
+    print(f"Precalentamiento terminado en {time.perf_counter() - inicio:.2f}s")
+
+async def arrancar_servicios(app):
+    # Se ejecuta con el bot ya conectado a Telegram: importa los clientes en
+    # un hilo, los crea y lanza las tareas de fondo y el precalentamiento.
+    # Si la configuración falla los handlers esperarían servicios_listos
+    # para siempre: se registra el error y se detiene el bot (SystemExit sale
+    # del event loop y run_polling / webhook.servir hacen el apagado).
+    try:
+        await asyncio.to_thread(importar_clientes)
+        configurar()
+    except Exception:
+        print("No se pudieron configurar los servicios; deteniendo el bot")
+        traceback.print_exc()
+        raise SystemExit(1)
+    await asyncio.gather(calentar(), *(vigilar(nombre, t) for nombre, t in tareas_fondo(app)))
+
+async def vigilar(nombre, tarea):
+    # Una tarea de fondo que termina con error (p. ej. el puerto de métricas
+    # ocupado) no debe morir en silencio dentro del gather
+    try:
+        await tarea
+    except Exception:
+        print(f"La tarea de fondo {nombre} terminó con error")
+        traceback.print_exc()
 
 def campo_a_clave(campo_usuario):
     campo_usuario = campo_usuario.replace("_", " ").strip().lower()
@@ -53,85 +221,33 @@ def campos_legibles():
         "cliente", "num cliente", "proyecto", "modalidad", "fecha hora", "observaciones"
     ])
 
-def prompt_gpt_neomind(texto, chat_hist=None):
-    prompt = f"""
-Eres un asistente que organiza, consulta y edita recordatorios. El usuario puede preguntar por fecha, cliente, proyecto, modalidad, observaciones, etc.
-Tu objetivo es:
-- Detectar si el usuario quiere modificar algún recordatorio existente (palabras clave como modificar, cambiar, editar, reprogramar).
-- Si detectas intención de modificar, intenta extraer qué campo desea cambiar y a qué valor. Si no está claro, responde el JSON con intención "modificar" y los campos que logres extraer (incluyendo el criterio de búsqueda, como cliente o fecha, y el campo que desea cambiar).
-
-Devuelve SOLO este JSON:
-
-{{
-  "intencion": "consultar" | "agendar" | "modificar" | "otro",
-  "fecha": "",
-  "busqueda": {{
-    "campo": "",
-    "valor": ""
-  }},
-  "modificar": {{
-    "campo": "",
-    "nuevo_valor": ""
-  }},
-  "campos": {{
-    "cliente": "",
-    "num_cliente": "",
-    "proyecto": "",
-    "modalidad": "",
-    "fecha_hora": "",
-    "observaciones": ""
-  }}
-}}
-- Si la búsqueda es general (“¿qué citas tengo?”) deja campo y valor vacíos.
-- Si es por campo (“¿cuándo es mi reunión con Abelardo?”), pon "campo": "cliente" y "valor": "Abelardo".
-- Si es modificar, llena los datos posibles en "busqueda" (para identificar el recordatorio) y en "modificar" (qué campo y a qué valor).
-- Si es agendar, pon los datos en "campos".
-Mensaje: {texto}
-JSON:
-"""
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0
-    )
-    content = response.choices[0].message.content
-    match = re.search(r'\{[\s\S]+\}', content)
-    if match:
-        return json.loads(match.group(0))
-    return {
-        "intencion": "otro",
-        "fecha": "",
-        "busqueda": {"campo": "", "valor": ""},
-        "modificar": {"campo": "", "nuevo_valor": ""},
-        "campos": {k: "" for k in CAMPOS}
-    }
-
-def parse_fecha_gpt(fecha_str):
-    if not fecha_str:
-        return None
-    if fecha_str.strip().lower() in ["hoy", "ahora"]:
-        return datetime.now(pytz.timezone("America/Lima")).date()
-    if fecha_str.strip().lower() == "mañana":
-        return (datetime.now(pytz.timezone("America/Lima") ) + timedelta(days=1)).date()
-    dt = dateparser.parse(fecha_str, languages=['es'])
-    if dt:
-        return dt.date()
-    return None
-
-def parse_fecha_hora_gpt(fecha_str):
-    if not fecha_str:
-        return None
-    dt = dateparser.parse(fecha_str, languages=['es'])
-    if dt and dt.tzinfo is None:
-        dt = pytz.timezone("America/Lima").localize(dt)
-    return dt
+@metricas.cronometrar("prompt_gpt_neomind")
+async def prompt_gpt_neomind(texto, chat_hist=None):
+    return await cache_extracciones.obtener(texto, lambda: extraccion_gpt(texto))
+
+async def extraccion_gpt(texto):
+    return await extractor.extraer(texto)
+
+async def extraer_intencion(texto):
+    # Primero el router local; GPT sólo si no reconoce el mensaje con confianza
+    resultado = router.clasificar(texto)
+    stats = router.estadisticas()
+    if stats["consultas"] % 100 == 0:
+        print(f"Router local: {stats['aciertos']}/{stats['consultas']} resueltos sin GPT ({stats['tasa_aciertos']:.0%})")
+        print(f"Cache GPT: {cache_extracciones.estadisticas()}")
+        print(f"Extracción GPT: {extractor.estadisticas()}")
+    if not resultado:
+        resultado = await prompt_gpt_neomind(texto)
+    metricas.anotar("intencion", resultado.get("intencion"))
+    metricas.anotar("origen", resultado.get("origen") or "gpt")
+    return resultado
 
 def build_resumen(datos):
     fecha_legible = datos.get("fecha_hora", "")
     dt = parse_fecha_hora_gpt(fecha_legible)
     if dt:
         fecha_legible = dt.strftime("%d de %B de %Y, %I:%M %p")
-        datos["fecha_hora"] = dt.isoformat()
+        datos["fecha_hora"] = iso_lima(dt)
     return (
         f"Perfecto, esto es lo que entendí:\n"
         f"- Cliente: {datos.get('cliente','')}\n"
@@ -177,63 +293,198 @@ def build_recordatorio_resumido(datos, tipo, username):
 
 # ===============================================================================
 
-async def consulta_citas(update, context, fecha=None, campo=None, valor=None):
+@metricas.cronometrar("consulta_citas")
+async def consulta_citas(update, context, fecha=None, campo=None, valor=None, despues=None, limite=TAM_PAGINA):
+    # Una página de resultados a partir del cursor "despues" ([fecha_ts, doc_id])
     chat_id = update.effective_chat.id
     user_id = chat_id
 
-    query = db.collection("recordatorios").where("telegram_id", "==", user_id)
-
     if fecha:
-        fecha_iso = fecha.isoformat()
-        citas = query.stream()
-        citas_lista = [dict(c.to_dict(), doc_id=c.id) for c in citas if c.to_dict().get("fecha_hora", "").startswith(fecha_iso)]
+        citas_lista = await repo.por_dia(user_id, fecha, limite, despues)
         msg_head = f"Recordatorios para {fecha.strftime('%d de %B de %Y')}:"
     elif campo and valor:
-        citas = query.stream()
-        citas_lista = [dict(c.to_dict(), doc_id=c.id) for c in citas if valor.lower() in str(c.to_dict().get(campo, "")).lower()]
+        citas_lista = await repo.por_campo(user_id, campo, valor, limite, despues)
         msg_head = f"Tus recordatorios por {campo.replace('_',' ')}: {valor}"
     else:
-        hoy = datetime.now(pytz.timezone("America/Lima")).date().isoformat()
-        citas = query.where("fecha_hora", ">=", hoy).stream()
-        citas_lista = [dict(c.to_dict(), doc_id=c.id) for c in citas]
+        inicio_hoy = LIMA.localize(datetime.combine(hoy(), datetime.min.time()))
+        citas_lista = await repo.pendientes(user_id, inicio_hoy, limite, despues)
         msg_head = "Tus recordatorios pendientes:"
 
     return citas_lista, msg_head
 
+# ---------------- LISTADOS PAGINADOS ----------------
+
+def nuevo_listado(modo, fecha, campo, valor):
+    # modo: "consultar" o "modificar"
+    return {
+        "modo": modo,
+        "fecha": fecha.isoformat() if fecha else None,
+        "campo": campo or "",
+        "valor": valor or "",
+        "cursores": [None],  # cursor de inicio de cada página visitada
+        "siguiente": None,  # cursor de la página siguiente, si la hay
+        "mensaje": None,
+    }
+
+async def cargar_pagina(update, context, st):
+    # Pide una cita de más para saber si existe página siguiente
+    listado = st.listado
+    fecha = date.fromisoformat(listado["fecha"]) if listado["fecha"] else None
+    citas_lista, msg_head = await consulta_citas(
+        update, context, fecha, listado["campo"], listado["valor"],
+        despues=listado["cursores"][-1], limite=TAM_PAGINA + 1,
+    )
+    listado["siguiente"] = cursor_de(citas_lista[TAM_PAGINA - 1]) if len(citas_lista) > TAM_PAGINA else None
+    citas_lista = citas_lista[:TAM_PAGINA]
+    st.matches = [c["doc_id"] for c in citas_lista]
+    return citas_lista, msg_head
+
+def offset_pagina(st):
+    return (len(st.listado["cursores"]) - 1) * TAM_PAGINA
+
+def render_pagina(st, citas_lista, msg_head):
+    listado = st.listado
+    pagina = len(listado["cursores"]) - 1
+    inicio = offset_pagina(st)
+    if listado["modo"] == "modificar":
+        msg = "Se encontraron varios recordatorios. Responde con el número de la lista para elegir cuál modificar:\n\n"
+    else:
+        msg = msg_head + "\n\n"
+    for idx, c in enumerate(citas_lista, inicio + 1):
+        f = c.get("fecha_hora", "")[:16].replace("T", " ")
+        msg += f"{idx}. 🗓️ {f} - {c.get('cliente','')} ({c.get('proyecto','')})\nObs: {c.get('observaciones','')}\n\n"
+    filas = []
+    if listado["modo"] == "modificar":
+        numeros = [InlineKeyboardButton(str(idx), callback_data=f"sel:{idx}") for idx in range(inicio + 1, inicio + len(citas_lista) + 1)]
+        filas.extend(numeros[i:i + 5] for i in range(0, len(numeros), 5))
+    navegacion = []
+    if pagina > 0:
+        navegacion.append(InlineKeyboardButton("⬅️ Anterior", callback_data="pag:ant"))
+    if listado["siguiente"]:
+        navegacion.append(InlineKeyboardButton("Siguiente ➡️", callback_data="pag:sig"))
+    if navegacion:
+        msg += f"Página {pagina + 1}"
+        filas.append(navegacion)
+    return msg, InlineKeyboardMarkup(filas) if filas else None
+
+async def enviar_pagina(update, st, citas_lista, msg_head):
+    msg, teclado = render_pagina(st, citas_lista, msg_head)
+    enviado = await update.message.reply_text(msg, reply_markup=teclado)
+    st.listado["mensaje"] = enviado.message_id
+
+async def listar_citas(update, context, st, fecha, campo, valor, msg_vacio):
+    st.listado = nuevo_listado("consultar", fecha, campo, valor)
+    citas_lista, msg_head = await cargar_pagina(update, context, st)
+    if not citas_lista:
+        st.listado = None
+        await update.message.reply_text(msg_vacio)
+        return
+    await enviar_pagina(update, st, citas_lista, msg_head)
+
+async def listar_para_modificar(update, context, st, fecha, campo, valor):
+    # Devuelve False si no hay nada que modificar con ese criterio
+    st.listado = nuevo_listado("modificar", fecha, campo, valor)
+    citas_lista, msg_head = await cargar_pagina(update, context, st)
+    if not citas_lista:
+        st.listado = None
+        await update.message.reply_text("No encontré recordatorios para modificar según tu criterio. Intenta ser más específico.")
+        return False
+    if len(citas_lista) == 1 and not st.listado["siguiente"]:
+        st.listado = None
+        st.modificar_doc_id = citas_lista[0]["doc_id"]
+        st.estado = "modificar_que_campo"
+        await update.message.reply_text(
+            f"Este es el recordatorio encontrado:\n🗓️ {citas_lista[0].get('fecha_hora','')[:16].replace('T', ' ')} - {citas_lista[0].get('cliente','')} ({citas_lista[0].get('proyecto','')})\nObs: {citas_lista[0].get('observaciones','')}\n\n¿Qué campo deseas modificar? ({campos_legibles()})"
+        )
+        return True
+    st.estado = "modificar_elegir"
+    await enviar_pagina(update, st, citas_lista, msg_head)
+    return True
+
+def elegir_para_modificar(st, numero):
+    # "numero" es el de la lista completa, no el de la página
+    idx = numero - 1 - offset_pagina(st) if st.listado else numero - 1
+    if not 0 <= idx < len(st.matches):
+        return False
+    st.modificar_doc_id = st.matches[idx]
+    st.estado = "modificar_que_campo"
+    st.listado = None
+    st.matches = []
+    return True
+
+@bloqueos_chat.serializar
+async def paginacion_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    consulta = update.callback_query
+    chat_id = update.effective_chat.id
+    await servicios_listos.wait()
+    st = estados.obtener(chat_id)
+    listado = st.listado
+    if not listado or listado["mensaje"] != consulta.message.message_id:
+        await consulta.answer("Esta lista ya no está activa.")
+        return
+    accion, _, valor = consulta.data.partition(":")
+    try:
+        if accion == "sel":
+            if st.estado != "modificar_elegir" or not elegir_para_modificar(st, int(valor)):
+                await consulta.answer("Ese recordatorio ya no está en la lista.")
+                return
+            await consulta.answer()
+            await consulta.message.reply_text(f"¿Qué campo deseas modificar? ({campos_legibles()})")
+            return
+        if accion == "pag" and valor == "sig" and listado["siguiente"]:
+            listado["cursores"].append(listado["siguiente"])
+        elif accion == "pag" and valor == "ant" and len(listado["cursores"]) > 1:
+            listado["cursores"].pop()
+        else:
+            await consulta.answer()
+            return
+        await consulta.answer()
+        citas_lista, msg_head = await cargar_pagina(update, context, st)
+        msg, teclado = render_pagina(st, citas_lista, msg_head)
+        await consulta.edit_message_text(msg, reply_markup=teclado)
+    finally:
+        estados.guardar(chat_id, st)
+
+@metricas.cronometrar("consulta_observaciones_similar")
 async def consulta_observaciones_similar(update, context, query_text):
     chat_id = update.effective_chat.id
     user_id = chat_id
-    records = db.collection("recordatorios").where("telegram_id", "==", user_id).stream()
-    resultados = []
-    for r in records:
-        d = r.to_dict()
-        obs = d.get("observaciones", "")
-        score = fuzz.token_set_ratio(query_text.lower(), obs.lower())
-        if score > 60:
-            resultados.append((score, d))
+    resultados = await indice_busqueda.buscar(user_id, query_text, limite=5)
     if not resultados:
         await update.message.reply_text("No encontré ningún recordatorio que coincida lo suficiente en las observaciones.")
         return
-    resultados = sorted(resultados, key=lambda x: x[0], reverse=True)
     msg = "Resultados más similares en tus observaciones:\n\n"
-    for score, c in resultados[:5]:
+    for score, c in resultados:
         f = c.get("fecha_hora", "")[:16].replace("T", " ")
         msg += f"🗓️ {f} - {c.get('cliente','')} ({c.get('proyecto','')})\nObs: {c.get('observaciones','')}\nSimilitud: {score}%\n\n"
     await update.message.reply_text(msg)
 
+@metricas.cronometrar("responder_gpt")
 async def responder_gpt(update, texto):
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": texto}],
-        temperature=0.5
-    )
-    await update.message.reply_text(response.choices[0].message.content.strip())
+    inicio = time.monotonic()
+    messages = [{"role": "user", "content": texto}]
+    if not GPT_STREAMING:
+        response = await cliente_gpt.completar(messages, model="gpt-4o", temperature=0.5)
+        await update.message.reply_text(response.choices[0].message.content.strip())
+        metricas.PRIMER_BYTE.observar(time.monotonic() - inicio, modo="completo")
+        return
+    # Streaming: el usuario ve la respuesta crecer en vez de esperar a gpt-4o
+    es_grupo = update.effective_chat.type in ["group", "supergroup"]
+    progresivo = MensajeProgresivo(update.message, EDICION_INTERVALO_GRUPO if es_grupo else EDICION_INTERVALO)
+    async for fragmento in cliente_gpt.completar_stream(messages, model="gpt-4o", temperature=0.5):
+        await progresivo.agregar(fragmento)
+    await progresivo.terminar()
+    if progresivo.primer_byte is not None:
+        primer_byte = progresivo.primer_byte - inicio
+        metricas.PRIMER_BYTE.observar(primer_byte, modo="streaming")
+        metricas.anotar("primer_byte_ms", round(primer_byte * 1000, 2))
 
 async def get_chat_id_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     chat_title = update.effective_chat.title or "(Privado)"
     await update.message.reply_text(f"🆔 El chat_id de este {'grupo' if update.effective_chat.type in ['group', 'supergroup'] else 'chat'} es:\n`{chat_id}`\nNombre: {chat_title}", parse_mode="Markdown")
 
+@bloqueos_chat.serializar
 async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     texto = update.message.text.strip() if update.message.text else ""
@@ -246,20 +497,29 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         texto = texto.replace(f"@{bot_username}", "").strip()
 
-    # ---- RESET/ST0P: Limpia el estado ----
-    if texto.lower() in ["reset", "/reset", "stop", "/stop", "cancelar", "/cancelar"]:
-        user_states[chat_id] = {}
-        await update.message.reply_text("🔄 Conversación reseteada. Puedes comenzar de nuevo.")
-        return
+    await servicios_listos.wait()
+    with metricas.mensaje(chat_id, log_json=LOG_MENSAJES_JSON) as registro:
+        # ---- RESET/ST0P: Limpia el estado ----
+        if texto.lower() in ["reset", "/reset", "stop", "/stop", "cancelar", "/cancelar"]:
+            estados.borrar(chat_id)
+            registro["estado"] = "reset"
+            await update.message.reply_text("🔄 Conversación reseteada. Puedes comenzar de nuevo.")
+            return
 
-    if chat_id not in user_states:
-        user_states[chat_id] = {}
+        st = estados.obtener(chat_id)
+        registro["estado"] = st.estado
+        try:
+            await flujo_conversacion(update, context, texto, st)
+        finally:
+            estados.guardar(chat_id, st)
 
-    estado = user_states[chat_id].get("estado", None)
+async def flujo_conversacion(update, context, texto, st):
+    chat_id = update.effective_chat.id
+    estado = st.estado
 
     # --- FLUJO MODIFICACIÓN (nuevo robusto) ---
     if estado == "modificar_pendiente":
-        gpt_result = prompt_gpt_neomind(texto)
+        gpt_result = await extraer_intencion(texto)
         campo = gpt_result.get("busqueda", {}).get("campo", "")
         valor = gpt_result.get("busqueda", {}).get("valor", "")
         fecha = parse_fecha_gpt(gpt_result.get("fecha", ""))
@@ -277,39 +537,18 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "Por favor indícame el cliente o la fecha del recordatorio que deseas modificar."
             )
             return
-        citas_lista, msg_head = await consulta_citas(update, context, fecha, campo, valor)
-        if not citas_lista:
-            await update.message.reply_text("No encontré recordatorios para modificar según tu criterio. Intenta ser más específico.")
-            user_states[chat_id] = {}
-            return
-        if len(citas_lista) == 1:
-            user_states[chat_id]["modificar_doc_id"] = citas_lista[0]["doc_id"]
-            user_states[chat_id]["estado"] = "modificar_que_campo"
-            await update.message.reply_text(
-                f"Este es el recordatorio encontrado:\n🗓️ {citas_lista[0].get('fecha_hora','')[:16].replace('T', ' ')} - {citas_lista[0].get('cliente','')} ({citas_lista[0].get('proyecto','')})\nObs: {citas_lista[0].get('observaciones','')}\n\n¿Qué campo deseas modificar? ({campos_legibles()})"
-            )
-        else:
-            msg = "Se encontraron varios recordatorios. Responde con el número de la lista para elegir cuál modificar:\n\n"
-            for idx, c in enumerate(citas_lista, 1):
-                f = c.get("fecha_hora", "")[:16].replace("T", " ")
-                msg += f"{idx}. 🗓️ {f} - {c.get('cliente','')} ({c.get('proyecto','')})\nObs: {c.get('observaciones','')}\n\n"
-            user_states[chat_id]["matches"] = citas_lista
-            user_states[chat_id]["estado"] = "modificar_elegir"
-            await update.message.reply_text(msg)
+        if not await listar_para_modificar(update, context, st, fecha, campo, valor):
+            st.limpiar()
         return
 
     # --- MODIFICACIÓN MULTIPASO ORIGINAL ---
     if estado == "modificar_elegir":
-        idx = None
+        numero = None
         try:
-            idx = int(texto.strip()) - 1
+            numero = int(texto.strip())
         except:
             pass
-        matches = user_states[chat_id].get("matches", [])
-        if idx is not None and 0 <= idx < len(matches):
-            recordatorio = matches[idx]
-            user_states[chat_id]["modificar_doc_id"] = recordatorio["doc_id"]
-            user_states[chat_id]["estado"] = "modificar_que_campo"
+        if numero is not None and elegir_para_modificar(st, numero):
             await update.message.reply_text(
                 f"¿Qué campo deseas modificar? ({campos_legibles()})"
             )
@@ -326,8 +565,8 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"⚠️ Ese campo no es válido. Debe ser uno de: {campos_legibles()}."
             )
             return
-        user_states[chat_id]["modificar_campo"] = campo_clave
-        user_states[chat_id]["estado"] = "modificar_nuevo_valor"
+        st.modificar_campo = campo_clave
+        st.estado = "modificar_nuevo_valor"
         await update.message.reply_text(
             f"¿Cuál es el nuevo valor para '{campo_clave.replace('_',' ')}'?"
         )
@@ -335,110 +574,104 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if estado == "modificar_nuevo_valor":
         nuevo_valor = texto.strip()
-        campo = user_states[chat_id]["modificar_campo"]
-        doc_id = user_states[chat_id]["modificar_doc_id"]
-        user_states[chat_id]["modificar_nuevo_valor"] = nuevo_valor
+        campo = st.modificar_campo
+        doc_id = st.modificar_doc_id
+        st.modificar_nuevo_valor = nuevo_valor
 
         if campo == "fecha_hora":
             dt = parse_fecha_hora_gpt(nuevo_valor)
             if not dt:
                 await update.message.reply_text("No pude entender la nueva fecha/hora. Por favor, prueba con otro formato.")
                 return
-            nuevo_valor = dt.isoformat()
-            user_states[chat_id]["modificar_nuevo_valor"] = nuevo_valor
+            nuevo_valor = iso_lima(dt)
+            st.modificar_nuevo_valor = nuevo_valor
             display_val = dt.strftime("%d de %B de %Y, %I:%M %p")
         else:
             display_val = nuevo_valor
 
-        user_states[chat_id]["estado"] = "modificar_confirmar"
+        st.estado = "modificar_confirmar"
         await update.message.reply_text(
             f"¿Confirma que deseas modificar el campo '{campo.replace('_',' ')}' a:\n{display_val}\n\nResponde sí para confirmar."
         )
         return
 
     if estado == "modificar_confirmar":
-        if texto.lower() in ["sí", "si", "ok", "dale", "confirmo"]:
-            doc_id = user_states[chat_id]["modificar_doc_id"]
-            campo = user_states[chat_id]["modificar_campo"]
-            nuevo_valor = user_states[chat_id]["modificar_nuevo_valor"]
-            db.collection("recordatorios").document(doc_id).update({campo: nuevo_valor})
+        if es_afirmacion(texto):
+            doc_id = st.modificar_doc_id
+            campo = st.modificar_campo
+            nuevo_valor = st.modificar_nuevo_valor
+            await repo.actualizar(doc_id, {campo: nuevo_valor})
+            await scheduler.actualizar(doc_id, {campo: nuevo_valor})
             await update.message.reply_text("✅ ¡Recordatorio modificado correctamente!")
-            user_states[chat_id] = {}
+            st.limpiar()
         else:
             await update.message.reply_text("Modificación cancelada.")
-            user_states[chat_id] = {}
+            st.limpiar()
         return
 
     # --- FLUJO ANTERIOR (crear, consultar, buscar difuso) ---
 
     # Confirmación para guardar recordatorio
     if estado == "confirmar":
-        if texto.lower() in ["sí", "si", "ok", "dale", "confirmo"]:
-            datos = user_states[chat_id]["datos"]
-            now = datetime.now(pytz.timezone("America/Lima"))
+        if es_afirmacion(texto):
+            datos = st.datos
+            now = ahora()
             datos["fecha_creacion"] = now.isoformat()
             datos["telegram_id"] = chat_id
             username = update.effective_user.username or update.effective_user.full_name or "usuario"
             datos["telegram_user"] = username
-            db.collection("recordatorios").add(datos)
-            user_states[chat_id] = {}
+            # Con la cola de escrituras esto sólo la anota en disco: Firestore se confirma en segundo plano
+            doc_id = await repo.agregar(datos)
+            scheduler.programar(doc_id, datos)
+            st.limpiar()
 
             # ENVÍA MENSAJE PRIVADO
             await update.message.reply_text("✅ ¡Reunión guardada! Te avisaré a la hora indicada y 10 minutos antes.")
 
-            # ENVÍA AL GRUPO
+            # ENVÍA AL GRUPO (sin esperar la entrega; el despachador registra los errores)
             if GRUPO_TELEGRAM_ID:
                 try:
                     resumen = build_group_message(datos, username)
-                    await context.bot.send_message(chat_id=int(GRUPO_TELEGRAM_ID), text=resumen, parse_mode="Markdown")
+                    despachador.encolar(int(GRUPO_TELEGRAM_ID), resumen)
                 except Exception as e:
                     print("Error enviando al grupo:", e)
             return
         elif texto.lower() in ["no", "cambiar", "editar", "modificar"]:
             await update.message.reply_text("OK, vuelve a escribir la información de tu recordatorio, todos los campos o sólo los que quieras cambiar.")
-            user_states[chat_id]["estado"] = "pendiente"
+            st.estado = "pendiente"
             return
         else:
-            gpt_result = prompt_gpt_neomind(texto)
+            gpt_result = await prompt_gpt_neomind(texto)
             datos = gpt_result.get("campos", {})
             resumen = build_resumen(datos)
-            user_states[chat_id]["datos"] = datos
+            st.datos = datos
             await update.message.reply_text(resumen)
             return
 
     if estado == "confirmar_busqueda":
-        if texto.lower() in ["sí", "si", "ok", "dale", "confirmo"]:
-            campo = user_states[chat_id]["busqueda"]["campo"]
-            valor = user_states[chat_id]["busqueda"]["valor"]
-            citas_lista, msg_head = await consulta_citas(update, context, None, campo, valor)
-            if not citas_lista:
-                await update.message.reply_text("No encontré recordatorios para esa búsqueda.")
-                user_states[chat_id] = {}
-            else:
-                msg = msg_head + "\n\n"
-                for idx, c in enumerate(citas_lista, 1):
-                    f = c.get("fecha_hora", "")[:16].replace("T", " ")
-                    msg += f"{idx}. 🗓️ {f} - {c.get('cliente','')} ({c.get('proyecto','')})\nObs: {c.get('observaciones','')}\n\n"
-                await update.message.reply_text(msg)
-            user_states[chat_id] = {}
+        if es_afirmacion(texto):
+            campo = st.busqueda_campo
+            valor = st.busqueda_valor
+            st.limpiar()
+            await listar_citas(update, context, st, None, campo, valor, "No encontré recordatorios para esa búsqueda.")
             return
         else:
             await update.message.reply_text("OK, búsqueda cancelada.")
-            user_states[chat_id] = {}
+            st.limpiar()
             return
 
     if estado == "confirmar_observacion_similar":
-        if texto.lower() in ["sí", "si", "ok", "dale", "confirmo"]:
-            query_text = user_states[chat_id]["query_text"]
+        if es_afirmacion(texto):
+            query_text = st.query_text
             await consulta_observaciones_similar(update, context, query_text)
-            user_states[chat_id] = {}
+            st.limpiar()
             return
         else:
             await update.message.reply_text("OK, búsqueda cancelada.")
-            user_states[chat_id] = {}
+            st.limpiar()
             return
 
-    gpt_result = prompt_gpt_neomind(texto)
+    gpt_result = await extraer_intencion(texto)
 
     # FLUJO DE MODIFICAR, ahora robusto:
     if gpt_result["intencion"] == "modificar":
@@ -455,39 +688,23 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 valor = ""
 
         if not campo and not valor and not fecha:
-            user_states[chat_id]["estado"] = "modificar_pendiente"
+            st.estado = "modificar_pendiente"
             await update.message.reply_text(
                 "¿De qué cliente o de qué fecha es el recordatorio que deseas modificar?"
             )
             return
-        citas_lista, msg_head = await consulta_citas(update, context, fecha, campo, valor)
-        if not citas_lista:
-            await update.message.reply_text("No encontré recordatorios para modificar según tu criterio. Intenta ser más específico.")
-            return
-        if len(citas_lista) == 1:
-            user_states[chat_id]["modificar_doc_id"] = citas_lista[0]["doc_id"]
-            user_states[chat_id]["estado"] = "modificar_que_campo"
-            await update.message.reply_text(
-                f"Este es el recordatorio encontrado:\n🗓️ {citas_lista[0].get('fecha_hora','')[:16].replace('T', ' ')} - {citas_lista[0].get('cliente','')} ({citas_lista[0].get('proyecto','')})\nObs: {citas_lista[0].get('observaciones','')}\n\n¿Qué campo deseas modificar? ({campos_legibles()})"
-            )
-        else:
-            msg = "Se encontraron varios recordatorios. Responde con el número de la lista para elegir cuál modificar:\n\n"
-            for idx, c in enumerate(citas_lista, 1):
-                f = c.get("fecha_hora", "")[:16].replace("T", " ")
-                msg += f"{idx}. 🗓️ {f} - {c.get('cliente','')} ({c.get('proyecto','')})\nObs: {c.get('observaciones','')}\n\n"
-            user_states[chat_id]["matches"] = citas_lista
-            user_states[chat_id]["estado"] = "modificar_elegir"
-            await update.message.reply_text(msg)
+        await listar_para_modificar(update, context, st, fecha, campo, valor)
         return
 
     if (
         gpt_result["intencion"] == "consultar"
+        and gpt_result.get("origen") != "local"
         and not gpt_result.get("busqueda", {}).get("campo", "")
         and not gpt_result.get("fecha", "")
         and len(texto.split()) > 5
     ):
-        user_states[chat_id]["estado"] = "confirmar_observacion_similar"
-        user_states[chat_id]["query_text"] = texto
+        st.estado = "confirmar_observacion_similar"
+        st.query_text = texto
         await update.message.reply_text(
             f"¿Quieres buscar entre las observaciones de tus recordatorios por: '{texto}'? (Responde sí para confirmar)"
         )
@@ -497,23 +714,15 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         campo = gpt_result.get("busqueda", {}).get("campo", "")
         valor = gpt_result.get("busqueda", {}).get("valor", "")
         fecha = parse_fecha_gpt(gpt_result.get("fecha", ""))
-        citas_lista, msg_head = await consulta_citas(update, context, fecha, campo, valor)
-        if not citas_lista:
-            await update.message.reply_text("No tienes recordatorios para esa búsqueda.")
-        else:
-            msg = msg_head + "\n\n"
-            for idx, c in enumerate(citas_lista, 1):
-                f = c.get("fecha_hora", "")[:16].replace("T", " ")
-                msg += f"{idx}. 🗓️ {f} - {c.get('cliente','')} ({c.get('proyecto','')})\nObs: {c.get('observaciones','')}\n\n"
-            await update.message.reply_text(msg)
+        await listar_citas(update, context, st, fecha, campo, valor, "No tienes recordatorios para esa búsqueda.")
         return
 
     if gpt_result["intencion"] == "agendar":
         datos = gpt_result["campos"]
         if all(datos.get(k, "") for k in CAMPOS):
             resumen = build_resumen(datos)
-            user_states[chat_id]["datos"] = datos
-            user_states[chat_id]["estado"] = "confirmar"
+            st.datos = datos
+            st.estado = "confirmar"
             await update.message.reply_text(resumen)
             return
         else:
@@ -522,65 +731,134 @@ async def mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 msg = "Por favor, indícame los siguientes datos:\n" + "\n".join([f"- {campo.replace('_', ' ').capitalize()}" for campo in faltantes])
             else:
                 msg = "Por favor, indícame:\n" + "\n".join([f"- {campo.replace('_', ' ').capitalize()}" for campo in faltantes])
-            user_states[chat_id]["datos"] = datos
-            user_states[chat_id]["estado"] = "pendiente"
+            st.datos = datos
+            st.estado = "pendiente"
             await update.message.reply_text(msg)
             return
 
     await responder_gpt(update, texto)
 
 # --------- SCHEDULER DE RECORDATORIOS MEJORADO ---------
-async def scheduler_loop(app):
-    while True:
-        now = datetime.now(pytz.timezone("America/Lima"))
-        hoy_str = now.strftime("%Y-%m-%d")
-        docs = db.collection("recordatorios").stream()
-        for doc in docs:
-            d = doc.to_dict()
-            chat_id = d.get("telegram_id")
-            fecha_hora = d.get("fecha_hora")
-            if not fecha_hora or not chat_id:
-                continue
-            dt = dateparser.parse(fecha_hora)
-            if not dt:
-                continue
-            if dt.tzinfo is None:
-                dt = pytz.timezone("America/Lima").localize(dt)
-            if dt.strftime("%Y-%m-%d") != hoy_str:
-                continue
-
-            username = d.get("telegram_user", "") or "usuario"
-            # 10 minutos antes
-            if not d.get("avisado_10min") and 0 <= (dt - now).total_seconds() <= 600:
-                try:
-                    msg = build_recordatorio_resumido(d, "10min", username)
-                    await app.bot.send_message(chat_id=chat_id, text=msg, parse_mode="Markdown")
-                    # ENVÍA TAMBIÉN AL GRUPO
-                    if GRUPO_TELEGRAM_ID:
-                        await app.bot.send_message(chat_id=int(GRUPO_TELEGRAM_ID), text=msg, parse_mode="Markdown")
-                    db.collection("recordatorios").document(doc.id).update({"avisado_10min": True})
-                except Exception as e:
-                    print(f"Error avisando 10min antes: {e}")
+async def notificar_recordatorios(avisos):
+    # Privados: uno por aviso, en paralelo entre chats. Grupo: un único
+    # digest con los avisos de este tick que aún no se le enviaron (los
+    # reintentos de un privado fallido no se repiten en el grupo).
+    mensajes = []
+    envios = []
+    for d, tipo, grupo in avisos:
+        username = d.get("telegram_user", "") or "usuario"
+        msg = build_recordatorio_resumido(d, tipo, username)
+        if grupo:
+            mensajes.append(msg)
+        envios.append(despachador.enviar(d.get("telegram_id"), msg))
+    # ENVÍA TAMBIÉN AL GRUPO (sin esperar: el límite del grupo es más lento)
+    if GRUPO_TELEGRAM_ID and mensajes:
+        despachador.encolar_digest(int(GRUPO_TELEGRAM_ID), mensajes)
+    resultados = await asyncio.gather(*envios, return_exceptions=True)
+    return [r if isinstance(r, Exception) else None for r in resultados]
 
-            # Exacto en la hora
-            if not d.get("avisado_hora") and -60 <= (dt - now).total_seconds() <= 60:
-                try:
-                    msg = build_recordatorio_resumido(d, "hora", username)
-                    await app.bot.send_message(chat_id=chat_id, text=msg, parse_mode="Markdown")
-                    if GRUPO_TELEGRAM_ID:
-                        await app.bot.send_message(chat_id=int(GRUPO_TELEGRAM_ID), text=msg, parse_mode="Markdown")
-                    db.collection("recordatorios").document(doc.id).update({"avisado_hora": True})
-                except Exception as e:
-                    print(f"Error avisando en la hora: {e}")
-        await asyncio.sleep(60)
-
-def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+async def scheduler_loop(app):
+    if coordinador is None:
+        await scheduler.run(notificar_recordatorios)
+        return
+    tareas = [
+        asyncio.ensure_future(coordinador.run(scheduler.reasignar)),
+        asyncio.ensure_future(scheduler.run(notificar_recordatorios)),
+    ]
+    try:
+        await asyncio.gather(*tareas)
+    finally:
+        # Si una de las dos termina, la otra no sigue con shards que ya no
+        # son suyos. Al apagar se liberan para que otra réplica los tome ya
+        for tarea in tareas:
+            tarea.cancel()
+        try:
+            await coordinador.soltar()
+        except Exception as e:
+            print(f"Error liberando shards: {e}")
+
+async def estados_loop():
+    # Vuelca a disco los estados cambiados y purga cada 10 minutos las
+    # conversaciones abandonadas
+    purga = time.monotonic()
+    try:
+        while True:
+            await asyncio.sleep(ESTADOS_VOLCADO)
+            if time.monotonic() - purga >= 600:
+                estados.purgar_expirados()
+                purga = time.monotonic()
+            try:
+                await estados.volcar()
+            except Exception as e:
+                print(f"Error guardando estados de conversación: {e}")
+    finally:
+        # Al apagar (tarea cancelada) se vuelca lo que quedó pendiente
+        try:
+            await estados.volcar()
+        except Exception as e:
+            print(f"Error guardando estados de conversación: {e}")
+
+def tareas_fondo(app):
+    # (nombre, corrutina) de cada tarea de fondo
+    tareas = [("scheduler", scheduler_loop(app)), ("estados", estados_loop())]
+    if escrituras is not None:
+        tareas.append(("escrituras", escrituras.run()))
+    if agenda is not None:
+        tareas.append(("agenda", agenda.run()))
+    if METRICAS_PUERTO:
+        tareas.append(("metricas", metricas.servir(METRICAS_HOST, METRICAS_PUERTO)))
+    return tareas
+
+async def post_init(app):
+    # run_polling llama a esto tras conectar con Telegram (get_me). Se guarda
+    # la referencia: el event loop sólo mantiene referencias débiles a las tareas
+    global tarea_arranque
+    tarea_arranque = asyncio.create_task(arrancar_servicios(app))
+
+async def post_shutdown(app):
+    # run_polling cierra el event loop sin cancelar las tareas pendientes:
+    # se cancelan aquí y se espera a que terminen, para que scheduler_loop
+    # libere sus shards y estados_loop vuelque los estados pendientes
+    if tarea_arranque is not None:
+        tarea_arranque.cancel()
+        await asyncio.gather(tarea_arranque, return_exceptions=True)
+
+def crear_app():
+    # Updates concurrentes entre chats; dentro de un chat, en orden (bloqueos_chat)
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(UPDATES_CONCURRENTES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    despachador.iniciar(app.bot)
     app.add_handler(CommandHandler("getid", get_chat_id_handler))  # Para obtener el ID
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, mensaje_handler))
+    app.add_handler(CallbackQueryHandler(paginacion_handler, pattern=r"^(pag|sel):"))
+    return app
+
+def main():
+    if len(sys.argv) > 1:
+        # Comandos de mantenimiento: python main.py <comando> ...
+        # Escriben directo en Firestore: la cola local es del bot en marcha
+        configurar(ruta_escrituras="")
+        return comandos.ejecutar(sys.argv[1:], repo, CAMPOS)
+    # Primero Telegram; Firestore, OpenAI y dateparser se preparan en segundo plano
+    app = crear_app()
     print("Bot Neomind iniciado...")
-    loop = asyncio.get_event_loop()
-    loop.create_task(scheduler_loop(app))
+    if BOT_MODO == "webhook":
+        import webhook
+        asyncio.run(webhook.servir(
+            app,
+            WEBHOOK_SECRETO,
+            puerto=WEBHOOK_PUERTO,
+            ruta=WEBHOOK_RUTA,
+            url_publica=WEBHOOK_URL,
+            tareas=[arrancar_servicios(app)],
+        ))
+        return
     app.run_polling()
 
 if __name__ == "__main__":
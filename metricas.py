@@ -0,0 +1,204 @@
+import contextvars
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_DOCS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+_registro = []
+# Registro del mensaje en curso (lo comparten las subtareas del handler)
+_mensaje = contextvars.ContextVar("mensaje", default=None)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatear_etiquetas(nombres, valores, extra=()):
+    pares = list(zip(nombres, valores)) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in pares) + "}"
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.valores = {}  # tupla de valores de etiquetas -> total
+        _registro.append(self)
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+        self.valores[clave] = self.valores.get(clave, 0) + valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for clave, valor in sorted(self.valores.items()):
+            lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {valor}")
+        return lineas
+
+
+class Medidor:
+    # Valor instantáneo que se lee al exponer (p. ej. el tamaño de una cola)
+
+    def __init__(self, nombre, ayuda, leer=lambda: 0):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.leer = leer
+        _registro.append(self)
+
+    def exponer(self):
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge", f"{self.nombre} {self.leer()}"]
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self.series = {}  # tupla de valores de etiquetas -> [conteos por bucket, suma, total]
+        _registro.append(self)
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+        serie = self.series.get(clave)
+        if serie is None:
+            serie = self.series[clave] = [[0] * len(self.buckets), 0.0, 0]
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[0][i] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for clave, (conteos, suma, total) in sorted(self.series.items()):
+            for limite, conteo in zip(self.buckets, conteos):
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, [("le", limite)])
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {conteo}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave, [("le", "+Inf")])
+            lineas.append(f"{self.nombre}_bucket{etiquetas} {total}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {suma}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+ETAPAS = Histograma("neomind_etapa_segundos", "Duración de las etapas del manejo de mensajes", ["etapa"])
+MENSAJES = Histograma("neomind_mensaje_segundos", "Duración total de mensaje_handler", ["resultado"])
+FIRESTORE_ESCRITURAS = Histograma(
+    "neomind_firestore_escritura_segundos", "Duración de las escrituras en Firestore", ["operacion"]
+)
+FIRESTORE_DOCS_LEIDOS = Histograma(
+    "neomind_firestore_docs_leidos", "Documentos leídos de Firestore por consulta", ["consulta"], BUCKETS_DOCS
+)
+PRIMER_BYTE = Histograma(
+    "neomind_gpt_primer_byte_segundos", "Tiempo hasta que el usuario ve el primer texto de responder_gpt", ["modo"]
+)
+SCHEDULER_TICKS = Histograma("neomind_scheduler_tick_segundos", "Duración de cada tick del scheduler (sin esperas)")
+GPT_TOKENS = Contador("neomind_gpt_tokens_total", "Tokens consumidos en OpenAI", ["modelo", "tipo"])
+EXTRACCION = Histograma(
+    "neomind_extraccion_segundos", "Duración de cada llamada de extracción de intención", ["modelo", "resultado"]
+)
+ESCALADAS = Contador("neomind_extraccion_escaladas_total", "Extracciones repetidas con el modelo grande", ["modelo", "motivo"])
+ESCRITURAS_PENDIENTES = Medidor("neomind_escrituras_pendientes", "Escrituras en la cola local aún sin confirmar en Firestore")
+ESCRITURAS_ANTIGUEDAD = Medidor(
+    "neomind_escrituras_antiguedad_segundos", "Antigüedad de la escritura pendiente más vieja de la cola local"
+)
+ESCRITURAS_RETRASO = Histograma(
+    "neomind_escrituras_retraso_segundos", "Tiempo desde que se encola una escritura hasta que Firestore la confirma"
+)
+ESCRITURAS_DESCARTADAS = Contador(
+    "neomind_escrituras_descartadas_total", "Escrituras de la cola local rechazadas por Firestore sin remedio"
+)
+ROUTER = Contador("neomind_router_total", "Mensajes clasificados por el router local (local) o enviados a GPT (gpt)", ["resultado"])
+CACHE_EXTRACCIONES = Contador(
+    "neomind_cache_extracciones_total",
+    "Eventos de la caché de extracciones (acierto, fallo, coalescida, desalojo, expirada, invalidacion)",
+    ["evento"],
+)
+CACHE_EXTRACCIONES_ENTRADAS = Medidor("neomind_cache_extracciones_entradas", "Entradas en la caché de extracciones")
+NOTIFICACIONES = Contador("neomind_notificaciones_total", "Mensajes salientes a Telegram", ["resultado"])
+
+
+def exponer():
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+@contextmanager
+def medir(histograma=ETAPAS, **etiquetas):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        histograma.observar(duracion, **etiquetas)
+        registro = _mensaje.get()
+        if registro is not None and "etapa" in etiquetas:
+            etapas = registro["etapas"]
+            etapas[etiquetas["etapa"]] = round(etapas.get(etiquetas["etapa"], 0) + duracion * 1000, 2)
+
+
+def cronometrar(etapa):
+    # Decorador para corrutinas: registra su duración como etapa
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        async def envoltura(*args, **kwargs):
+            with medir(ETAPAS, etapa=etapa):
+                return await funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def anotar(clave, valor):
+    # Añade un dato a la línea de log del mensaje en curso, si la hay
+    registro = _mensaje.get()
+    if registro is not None:
+        registro[clave] = valor
+
+
+@contextmanager
+def mensaje(chat_id, log_json=False):
+    # Mide un mensaje completo y, si log_json, imprime una línea JSON con
+    # sus etapas y anotaciones al terminar.
+    registro = {"chat_id": chat_id, "etapas": {}}
+    token = _mensaje.set(registro)
+    inicio = time.perf_counter()
+    resultado = "ok"
+    try:
+        yield registro
+    except Exception:
+        resultado = "error"
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        _mensaje.reset(token)
+        MENSAJES.observar(duracion, resultado=resultado)
+        if log_json:
+            registro.update(resultado=resultado, duracion_ms=round(duracion * 1000, 2))
+            print(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+async def servir(host="127.0.0.1", puerto=9464):
+    # Endpoint /metrics en formato de texto de Prometheus
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(body=exponer().encode(), headers={"Content-Type": TIPO_CONTENIDO})
+
+    servidor = web.Application()
+    servidor.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(servidor)
+    await runner.setup()
+    await web.TCPSite(runner, host, puerto).start()
+    print(f"Métricas en http://{host}:{puerto}/metrics")
+    return runner
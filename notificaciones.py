@@ -0,0 +1,167 @@
+import asyncio
+import time
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from metricas import NOTIFICACIONES
+
+LIMITE_MENSAJE = 4096
+SEPARADOR_DIGEST = "\n\n— — —\n\n"
+
+
+class TokenBucket:
+    def __init__(self, tasa, capacidad, reloj=time.monotonic):
+        self.tasa = tasa  # tokens por segundo
+        self.capacidad = capacidad
+        self.reloj = reloj
+        self.tokens = capacidad
+        self.ultimo = reloj()
+        self._lock = asyncio.Lock()
+
+    def _recargar(self):
+        ahora = self.reloj()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+
+    def lleno(self):
+        self._recargar()
+        return self.tokens >= self.capacidad
+
+    def hasta_lleno(self):
+        # Segundos hasta que el bucket vuelva a estar lleno
+        self._recargar()
+        return max(self.capacidad - self.tokens, 0) / self.tasa
+
+    async def adquirir(self):
+        async with self._lock:
+            while True:
+                self._recargar()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.tasa)
+
+
+class _Canal:
+    __slots__ = ("cola", "bucket", "tarea")
+
+    def __init__(self, bucket):
+        self.cola = asyncio.Queue()
+        self.bucket = bucket
+        self.tarea = None
+
+
+def trocear(texto, limite=LIMITE_MENSAJE):
+    # Corta un texto demasiado largo para Telegram, por saltos de línea si se puede
+    trozos = []
+    while len(texto) > limite:
+        corte = texto.rfind("\n", 0, limite + 1)
+        if corte <= 0:
+            corte = limite
+        trozos.append(texto[:corte])
+        texto = texto[corte:].lstrip("\n")
+    return trozos + [texto] if texto else trozos
+
+
+def componer_digest(mensajes, separador=SEPARADOR_DIGEST):
+    # Une varios avisos en el menor número de mensajes que caben en Telegram
+    partes, actual = [], ""
+    for msg in (t for m in mensajes for t in trocear(m)):
+        candidato = msg if not actual else actual + separador + msg
+        if actual and len(candidato) > LIMITE_MENSAJE:
+            partes.append(actual)
+            actual = msg
+        else:
+            actual = candidato
+    if actual:
+        partes.append(actual)
+    return partes
+
+
+class Despachador:
+    # Cola de envío saliente hacia Telegram: un token bucket global y otro
+    # por chat (más estricto en grupos), una cola ordenada por chat y
+    # entrega concurrente entre chats. Los RetryAfter de Telegram se
+    # respetan y los errores transitorios se reintentan sin frenar al resto.
+
+    def __init__(self, tasa_global=25, tasa_chat=1, tasa_grupo=20 / 60, rafaga_grupo=3, reintentos=3):
+        self.bot = None
+        self.tasa_chat = tasa_chat
+        self.tasa_grupo = tasa_grupo
+        self.rafaga_grupo = rafaga_grupo
+        self.reintentos = reintentos
+        self.bucket_global = TokenBucket(tasa_global, tasa_global)
+        self._canales = {}
+        self.enviados = 0
+        self.fallidos = 0
+
+    def iniciar(self, bot):
+        self.bot = bot
+
+    def _canal(self, chat_id):
+        canal = self._canales.get(chat_id)
+        if canal is None:
+            # Los ids de grupos y supergrupos de Telegram son negativos
+            if int(chat_id) < 0:
+                bucket = TokenBucket(self.tasa_grupo, self.rafaga_grupo)
+            else:
+                bucket = TokenBucket(self.tasa_chat, 1)
+            canal = self._canales[chat_id] = _Canal(bucket)
+        return canal
+
+    def encolar(self, chat_id, texto, parse_mode="Markdown"):
+        futuro = asyncio.get_running_loop().create_future()
+        canal = self._canal(chat_id)
+        canal.cola.put_nowait((texto, parse_mode, futuro))
+        if canal.tarea is None or canal.tarea.done():
+            canal.tarea = asyncio.create_task(self._trabajar(chat_id, canal))
+        return futuro
+
+    async def enviar(self, chat_id, texto, parse_mode="Markdown"):
+        return await self.encolar(chat_id, texto, parse_mode)
+
+    async def _trabajar(self, chat_id, canal):
+        while True:
+            while not canal.cola.empty():
+                texto, parse_mode, futuro = canal.cola.get_nowait()
+                try:
+                    resultado = await self._entregar(chat_id, canal, texto, parse_mode)
+                except Exception as e:
+                    self.fallidos += 1
+                    NOTIFICACIONES.inc(resultado="fallida")
+                    print(f"Error enviando mensaje a {chat_id}: {e}")
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                        futuro.exception()
+                else:
+                    self.enviados += 1
+                    NOTIFICACIONES.inc(resultado="enviada")
+                    if not futuro.done():
+                        futuro.set_result(resultado)
+            # Justo tras un envío el bucket nunca está lleno: se espera a que
+            # se recargue y, si no llegó nada nuevo, se olvida el canal.
+            # Olvidarlo antes permitiría saltarse el límite del chat.
+            await asyncio.sleep(canal.bucket.hasta_lleno())
+            if canal.cola.empty():
+                del self._canales[chat_id]
+                return
+
+    async def _entregar(self, chat_id, canal, texto, parse_mode):
+        for intento in range(self.reintentos + 1):
+            await canal.bucket.adquirir()
+            await self.bucket_global.adquirir()
+            try:
+                return await self.bot.send_message(chat_id=chat_id, text=texto, parse_mode=parse_mode)
+            except RetryAfter as e:
+                if intento == self.reintentos:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except BadRequest:
+                # En PTB 20 BadRequest hereda de NetworkError, pero reintentar
+                # el mismo mensaje no lo arregla
+                raise
+            except NetworkError:
+                if intento == self.reintentos:
+                    raise
+                await asyncio.sleep(2 ** intento)
+
+    def encolar_digest(self, chat_id, mensajes, parse_mode="Markdown", separador=SEPARADOR_DIGEST):
+        return [self.encolar(chat_id, p, parse_mode) for p in componer_digest(mensajes, separador)]
@@ -0,0 +1,453 @@
+import itertools
+import secrets
+import string
+import unicodedata
+import zlib
+from fechas import LIMA, iso_lima, parse_iso
+from metricas import FIRESTORE_DOCS_LEIDOS, FIRESTORE_ESCRITURAS, medir
+
+COLECCION = "recordatorios"
+
+# Campos de texto con tokens de prefijo indexados (<campo>_tokens)
+CAMPOS_INDEXADOS = ["cliente", "proyecto"]
+PREFIJO_MIN = 2
+PREFIJO_MAX = 15
+LOTE_MAX = 500
+
+# Particiones fijas del scheduler: cada recordatorio guarda su "shard" y las
+# réplicas se reparten los shards con leases (ver coordinacion.py)
+NUM_SHARDS = 64
+COLECCION_COORDINACION = "coordinacion"
+DOC_LEASES = "scheduler"
+MAX_IN = 30  # valores por filtro "in" de Firestore
+
+
+def nuevo_id():
+    # Id aleatorio de 20 caracteres, como los que genera add() de Firestore
+    alfabeto = string.ascii_letters + string.digits
+    return "".join(secrets.choice(alfabeto) for _ in range(20))
+
+
+def normalizar_texto(valor):
+    valor = unicodedata.normalize("NFKD", str(valor or "").lower())
+    return "".join(c for c in valor if not unicodedata.combining(c))
+
+
+def tokens_prefijo(valor):
+    tokens = set()
+    for palabra in normalizar_texto(valor).split():
+        palabra = palabra[:PREFIJO_MAX]
+        tokens.add(palabra)
+        for i in range(PREFIJO_MIN, len(palabra)):
+            tokens.add(palabra[:i])
+    return sorted(tokens)
+
+
+def token_busqueda(valor):
+    # La palabra más larga del valor buscado es la más selectiva
+    palabras = normalizar_texto(valor).split()
+    if not palabras:
+        return None
+    return max(palabras, key=len)[:PREFIJO_MAX]
+
+
+def shard_de(telegram_id):
+    # Hash estable entre procesos (hash() de Python cambia con cada arranque)
+    return zlib.crc32(str(telegram_id).encode()) % NUM_SHARDS
+
+
+def campos_derivados(datos):
+    # Campos consultables que se guardan junto a los del usuario:
+    # fecha_ts (timestamp nativo), fecha_dia (YYYY-MM-DD en hora de Lima),
+    # tokens de prefijo normalizados de cliente y proyecto y el shard.
+    # fecha_hora se reescribe en hora de Lima, venga con el desfase que venga.
+    derivados = {}
+    if "fecha_hora" in datos:
+        dt = parse_iso(datos["fecha_hora"])
+        if dt:
+            derivados["fecha_hora"] = iso_lima(dt)
+        derivados["fecha_ts"] = dt
+        derivados["fecha_dia"] = dt.astimezone(LIMA).date().isoformat() if dt else None
+    for campo in CAMPOS_INDEXADOS:
+        if campo in datos:
+            derivados[f"{campo}_tokens"] = tokens_prefijo(datos[campo])
+    if "telegram_id" in datos:
+        derivados["shard"] = shard_de(datos["telegram_id"])
+    return derivados
+
+
+def coincide(d, campo, valor):
+    # Regla de búsqueda por campo, la misma en Firestore y en memoria: cada
+    # palabra buscada es el comienzo de alguna palabra del campo, sin
+    # distinguir mayúsculas ni tildes ("abe pé" encuentra "Abelardo Pérez",
+    # "elardo" no). Es lo que el índice <campo>_tokens puede preseleccionar.
+    palabras = normalizar_texto(d.get(campo, "")).split()
+    return all(any(p.startswith(b) for p in palabras) for b in normalizar_texto(valor).split())
+
+
+def clave_orden(c):
+    # Mismo orden que order_by("fecha_ts").order_by("__name__") en Firestore
+    # (los documentos sin fecha_ts van primero, como null)
+    ts = c.get("fecha_ts")
+    return (ts is not None, ts.timestamp() if ts is not None else 0.0, c.get("doc_id", ""))
+
+
+def cursor_de(c):
+    # Cursor de paginación compacto y serializable: [fecha_ts ISO, doc_id]
+    ts = c.get("fecha_ts")
+    return [ts.isoformat() if ts is not None else None, c["doc_id"]]
+
+
+def _paginar(citas, limite, despues):
+    citas = sorted(citas, key=clave_orden)
+    if despues is not None:
+        corte = clave_orden({"fecha_ts": parse_iso(despues[0]), "doc_id": despues[1]})
+        citas = [c for c in citas if clave_orden(c) > corte]
+    return citas[:limite]
+
+
+def filtrar_dia(citas, dia, limite, despues=None):
+    citas = [c for c in citas if c.get("fecha_dia") == dia.isoformat()]
+    return _paginar(citas, limite, despues)
+
+
+def filtrar_campo(citas, campo, valor, limite, despues=None):
+    return _paginar([c for c in citas if coincide(c, campo, valor)], limite, despues)
+
+
+def filtrar_pendientes(citas, desde, limite, despues=None):
+    citas = [c for c in citas if c.get("fecha_ts") and c["fecha_ts"] >= desde]
+    return _paginar(citas, limite, despues)
+
+
+def falta_migrar(d):
+    return (
+        "fecha_dia" not in d
+        or "shard" not in d
+        or any(f"{campo}_tokens" not in d for campo in CAMPOS_INDEXADOS)
+    )
+
+
+def campos_a_migrar(d):
+    return campos_derivados({k: d.get(k, "") for k in ["fecha_hora", "telegram_id"] + CAMPOS_INDEXADOS})
+
+
+def repartir_shards(estado, replica, ttl, ahora, saliendo=False):
+    # Una ronda de leases de "replica" sobre el documento de coordinación:
+    # renueva su latido, suelta los shards que le sobran y toma libres o
+    # vencidos hasta su cuota (reparto equilibrado entre réplicas vivas).
+    # Devuelve (nuevo estado, shards propios).
+    replicas = {r: exp for r, exp in estado.get("replicas", {}).items() if exp > ahora and r != replica}
+    shards = {s: l for s, l in estado.get("shards", {}).items() if l["expira"] > ahora}
+    mios = sorted(int(s) for s, l in shards.items() if l["replica"] == replica)
+    if saliendo:
+        for s in mios:
+            del shards[str(s)]
+        return {"replicas": replicas, "shards": shards}, set()
+    replicas[replica] = ahora + ttl
+    vivos = sorted(replicas)
+    cuota = NUM_SHARDS // len(vivos) + (1 if vivos.index(replica) < NUM_SHARDS % len(vivos) else 0)
+    for s in mios[cuota:]:
+        del shards[str(s)]
+    mios = mios[:cuota]
+    for s in range(NUM_SHARDS):
+        if len(mios) >= cuota:
+            break
+        if str(s) not in shards:
+            mios.append(s)
+    for s in mios:
+        shards[str(s)] = {"replica": replica, "expira": ahora + ttl}
+    return {"replicas": replicas, "shards": shards}, set(mios)
+
+
+def puede_reclamar(datos, flag, replica, ahora):
+    # Compare-and-set de un aviso: libre si no se envió y nadie más lo tiene
+    # reclamado (la misma réplica puede volver a reclamarlo para reintentar)
+    if datos is None or datos.get(flag):
+        return False
+    reclamo = datos.get(f"{flag}_reclamo")
+    return not reclamo or reclamo["replica"] == replica or reclamo["expira"] <= ahora
+
+
+class RepositorioRecordatorios:
+    # Acceso a la colección de recordatorios con el cliente asíncrono de
+    # Firestore, para que ninguna lectura o escritura bloquee el event loop.
+    # Todos los documentos se devuelven como dict con su "doc_id".
+
+    def __init__(self, db):
+        self.db = db
+
+    def _coleccion(self):
+        return self.db.collection(COLECCION)
+
+    def _del_usuario(self, telegram_id):
+        return self._coleccion().where("telegram_id", "==", telegram_id)
+
+    def _leases(self):
+        return self.db.collection(COLECCION_COORDINACION).document(DOC_LEASES)
+
+    def _pagina(self, query, limite, despues):
+        # Una sola página ordenada por (fecha_ts, id), empezando tras el cursor
+        query = query.order_by("fecha_ts").order_by("__name__")
+        if despues is not None:
+            query = query.start_after({"fecha_ts": parse_iso(despues[0]), "__name__": despues[1]})
+        return query.limit(limite)
+
+    async def _listar(self, query, consulta):
+        docs = [dict(doc.to_dict(), doc_id=doc.id) async for doc in query.stream()]
+        FIRESTORE_DOCS_LEIDOS.observar(len(docs), consulta=consulta)
+        return docs
+
+    async def agregar(self, datos):
+        with medir(FIRESTORE_ESCRITURAS, operacion="agregar"):
+            _, doc_ref = await self._coleccion().add(dict(datos, **campos_derivados(datos)))
+        return doc_ref.id
+
+    async def actualizar(self, doc_id, cambios):
+        with medir(FIRESTORE_ESCRITURAS, operacion="actualizar"):
+            await self._coleccion().document(doc_id).update(dict(cambios, **campos_derivados(cambios)))
+
+    async def actualizar_lote(self, cambios):
+        # cambios: lista de (doc_id, dict) confirmada con WriteBatch de hasta 500
+        for i in range(0, len(cambios), LOTE_MAX):
+            batch = self.db.batch()
+            for doc_id, valores in cambios[i:i + LOTE_MAX]:
+                batch.update(self._coleccion().document(doc_id), dict(valores, **campos_derivados(valores)))
+            with medir(FIRESTORE_ESCRITURAS, operacion="lote"):
+                await batch.commit()
+
+    async def agregar_lote(self, docs):
+        # docs: lista de (doc_id, datos). Con set() e ids deterministas,
+        # repetir un lote (p. ej. al reanudar una importación) no duplica.
+        for i in range(0, len(docs), LOTE_MAX):
+            batch = self.db.batch()
+            for doc_id, datos in docs[i:i + LOTE_MAX]:
+                batch.set(self._coleccion().document(doc_id), dict(datos, **campos_derivados(datos)))
+            with medir(FIRESTORE_ESCRITURAS, operacion="lote"):
+                await batch.commit()
+
+    async def escribir_lote(self, operaciones):
+        # operaciones: lista de (operacion, doc_id, datos) con operacion
+        # "set" o "update", aplicadas en orden en un único WriteBatch
+        batch = self.db.batch()
+        for operacion, doc_id, datos in operaciones:
+            ref = self._coleccion().document(doc_id)
+            if operacion == "set":
+                batch.set(ref, dict(datos, **campos_derivados(datos)))
+            else:
+                batch.update(ref, dict(datos, **campos_derivados(datos)))
+        with medir(FIRESTORE_ESCRITURAS, operacion="diferida"):
+            await batch.commit()
+
+    async def obtener(self, doc_id):
+        doc = await self._coleccion().document(doc_id).get()
+        FIRESTORE_DOCS_LEIDOS.observar(1 if doc.exists else 0, consulta="obtener")
+        if not doc.exists:
+            return None
+        return dict(doc.to_dict(), doc_id=doc.id)
+
+    async def por_usuario(self, telegram_id):
+        return await self._listar(self._del_usuario(telegram_id), "por_usuario")
+
+    async def por_dia(self, telegram_id, dia, limite, despues=None):
+        query = self._del_usuario(telegram_id).where("fecha_dia", "==", dia.isoformat())
+        return await self._listar(self._pagina(query, limite, despues), "por_dia")
+
+    async def por_campo(self, telegram_id, campo, valor, limite, despues=None):
+        token = token_busqueda(valor)
+        if campo not in CAMPOS_INDEXADOS or not token or len(token) < PREFIJO_MIN:
+            # Sin índice para este campo (o palabras de una letra, que no se
+            # indexan como prefijo): se filtra en memoria
+            return filtrar_campo(await self.por_usuario(telegram_id), campo, valor, limite, despues)
+        query = self._del_usuario(telegram_id).where(f"{campo}_tokens", "array_contains", token)
+        # El token sólo preselecciona: las que no coinciden con el texto
+        # completo se descartan y se sigue leyendo tras el último documento
+        # leído hasta llenar la página, para que una página corta no se tome
+        # por la última
+        citas = []
+        while len(citas) < limite:
+            leidas = await self._listar(self._pagina(query, limite, despues), "por_campo")
+            citas += [c for c in leidas if coincide(c, campo, valor)]
+            if len(leidas) < limite:
+                break
+            despues = cursor_de(leidas[-1])
+        return citas[:limite]
+
+    async def pendientes(self, telegram_id, desde, limite, despues=None):
+        query = self._del_usuario(telegram_id).where("fecha_ts", ">=", desde)
+        return await self._listar(self._pagina(query, limite, despues), "pendientes")
+
+    async def en_rango(self, desde, hasta, shards=None):
+        # desde/hasta: datetimes con zona. Sobre el timestamp nativo, no sobre
+        # el texto de fecha_hora, que no se ordena bien entre desfases.
+        query = (
+            self._coleccion()
+            .where("fecha_ts", ">=", desde)
+            .where("fecha_ts", "<", hasta)
+        )
+        if shards is None:
+            return await self._listar(query, "en_rango")
+        shards = sorted(shards)
+        citas = []
+        for i in range(0, len(shards), MAX_IN):
+            citas.extend(await self._listar(query.where("shard", "in", shards[i:i + MAX_IN]), "en_rango"))
+        return citas
+
+    async def renovar_leases(self, replica, ttl, ahora, saliendo=False):
+        from firebase_admin import firestore_async
+        ref = self._leases()
+
+        @firestore_async.async_transactional
+        async def renovar(transaccion):
+            doc = await ref.get(transaction=transaccion)
+            estado, mios = repartir_shards(doc.to_dict() or {}, replica, ttl, ahora, saliendo)
+            transaccion.set(ref, estado)
+            return mios
+
+        return await renovar(self.db.transaction())
+
+    async def reclamar_aviso(self, doc_id, flag, replica, ttl, ahora):
+        from firebase_admin import firestore_async
+        ref = self._coleccion().document(doc_id)
+
+        @firestore_async.async_transactional
+        async def reclamar(transaccion):
+            doc = await ref.get(transaction=transaccion)
+            if not doc.exists or not puede_reclamar(doc.to_dict(), flag, replica, ahora):
+                return False
+            transaccion.update(ref, {f"{flag}_reclamo": {"replica": replica, "expira": ahora + ttl}})
+            return True
+
+        return await reclamar(self.db.transaction())
+
+    async def recorrer(self, telegram_id=None, lote=LOTE_MAX):
+        # Genera todos los recordatorios (o los de un usuario) página a
+        # página, sin tener la colección entera en memoria
+        query = self._coleccion() if telegram_id is None else self._del_usuario(telegram_id)
+        ultimo = None
+        while True:
+            pagina = query.order_by("__name__").limit(lote)
+            if ultimo is not None:
+                pagina = pagina.start_after({"__name__": ultimo})
+            docs = await self._listar(pagina, "recorrer")
+            for d in docs:
+                yield d
+            if len(docs) < lote:
+                return
+            ultimo = docs[-1]["doc_id"]
+
+    async def migrar(self, lote=LOTE_MAX):
+        # Recorre la colección por páginas y completa los campos derivados de
+        # los documentos antiguos con escrituras en lote.
+        lote = min(lote, LOTE_MAX)
+        migrados = 0
+        ultimo = None
+        while True:
+            query = self._coleccion().order_by("__name__").limit(lote)
+            if ultimo is not None:
+                query = query.start_after(ultimo)
+            docs = [doc async for doc in query.stream()]
+            FIRESTORE_DOCS_LEIDOS.observar(len(docs), consulta="migrar")
+            if not docs:
+                return migrados
+            batch = self.db.batch()
+            pendientes = 0
+            for doc in docs:
+                d = doc.to_dict()
+                if falta_migrar(d):
+                    batch.update(doc.reference, campos_a_migrar(d))
+                    pendientes += 1
+            if pendientes:
+                with medir(FIRESTORE_ESCRITURAS, operacion="lote"):
+                    await batch.commit()
+                migrados += pendientes
+                print(f"Migrados {migrados} recordatorios...")
+            ultimo = docs[-1]
+
+
+class RepositorioMemoria:
+    # Implementación en memoria con la misma interfaz, para pruebas locales.
+
+    def __init__(self, docs=None):
+        self.docs = dict(docs or {})
+        self._ids = itertools.count(len(self.docs) + 1)
+        self.leases = {}
+
+    def _copia(self, doc_id):
+        return dict(self.docs[doc_id], doc_id=doc_id)
+
+    def _del_usuario(self, telegram_id):
+        return [self._copia(doc_id) for doc_id, d in self.docs.items() if d.get("telegram_id") == telegram_id]
+
+    async def agregar(self, datos):
+        doc_id = str(next(self._ids))
+        self.docs[doc_id] = dict(datos, **campos_derivados(datos))
+        return doc_id
+
+    async def actualizar(self, doc_id, cambios):
+        if doc_id not in self.docs:
+            raise KeyError(doc_id)
+        self.docs[doc_id].update(cambios, **campos_derivados(cambios))
+
+    async def actualizar_lote(self, cambios):
+        for doc_id, valores in cambios:
+            await self.actualizar(doc_id, valores)
+
+    async def agregar_lote(self, docs):
+        for doc_id, datos in docs:
+            self.docs[doc_id] = dict(datos, **campos_derivados(datos))
+
+    async def escribir_lote(self, operaciones):
+        for operacion, doc_id, datos in operaciones:
+            if operacion == "set":
+                self.docs[doc_id] = dict(datos, **campos_derivados(datos))
+            elif doc_id not in self.docs:
+                raise KeyError(doc_id)
+            else:
+                self.docs[doc_id].update(datos, **campos_derivados(datos))
+
+    async def obtener(self, doc_id):
+        if doc_id not in self.docs:
+            return None
+        return self._copia(doc_id)
+
+    async def por_usuario(self, telegram_id):
+        return self._del_usuario(telegram_id)
+
+    async def por_dia(self, telegram_id, dia, limite, despues=None):
+        return filtrar_dia(self._del_usuario(telegram_id), dia, limite, despues)
+
+    async def por_campo(self, telegram_id, campo, valor, limite, despues=None):
+        return filtrar_campo(self._del_usuario(telegram_id), campo, valor, limite, despues)
+
+    async def pendientes(self, telegram_id, desde, limite, despues=None):
+        return filtrar_pendientes(self._del_usuario(telegram_id), desde, limite, despues)
+
+    async def en_rango(self, desde, hasta, shards=None):
+        return [
+            self._copia(doc_id) for doc_id, d in self.docs.items()
+            if d.get("fecha_ts") and desde <= d["fecha_ts"] < hasta and (shards is None or d.get("shard") in shards)
+        ]
+
+    async def renovar_leases(self, replica, ttl, ahora, saliendo=False):
+        self.leases, mios = repartir_shards(self.leases, replica, ttl, ahora, saliendo)
+        return mios
+
+    async def reclamar_aviso(self, doc_id, flag, replica, ttl, ahora):
+        if not puede_reclamar(self.docs.get(doc_id), flag, replica, ahora):
+            return False
+        self.docs[doc_id][f"{flag}_reclamo"] = {"replica": replica, "expira": ahora + ttl}
+        return True
+
+    async def recorrer(self, telegram_id=None, lote=LOTE_MAX):
+        for doc_id in sorted(self.docs):
+            if telegram_id is None or self.docs[doc_id].get("telegram_id") == telegram_id:
+                yield self._copia(doc_id)
+
+    async def migrar(self, lote=LOTE_MAX):
+        migrados = 0
+        for d in self.docs.values():
+            if falta_migrar(d):
+                d.update(campos_a_migrar(d))
+                migrados += 1
+        return migrados
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import itertools
+from datetime import timedelta
+from fechas import ahora, parse_fecha_hora_gpt
+from metricas import SCHEDULER_TICKS, medir
+from repositorio import shard_de
+AVISO_PREVIO = timedelta(minutes=10)
+TOLERANCIA_HORA = timedelta(seconds=60)
+REINTENTO = timedelta(seconds=60)
+# Vigencia del reclamo de un aviso (varias réplicas) y cada cuánto se relee
+# la ventana actual: recoge lo creado fuera de este proceso (otras réplicas,
+# importaciones masivas)
+RECLAMO_TTL = timedelta(minutes=5)
+RESINCRONIZAR = timedelta(minutes=5)
+
+# Tipos de aviso y el flag de Firestore que marca cada uno como enviado
+AVISOS = {
+    "10min": "avisado_10min",
+    "hora": "avisado_hora",
+}
+
+
+class SchedulerRecordatorios:
+    # Mantiene en memoria sólo los recordatorios dentro de la ventana de
+    # anticipación, ordenados en un heap por hora de disparo (aviso de 10
+    # minutos y aviso en la hora). En vez de un tick fijo, duerme hasta el
+    # siguiente vencimiento o hasta que se programe algo más temprano.
+    # Con un coordinador (varias réplicas) sólo carga los shards propios y
+    # reclama cada aviso en Firestore antes de enviarlo.
+
+    def __init__(self, repo, ventana=timedelta(hours=1), coordinador=None):
+        self.repo = repo
+        self.ventana = ventana
+        self.coordinador = coordinador
+        self._resincronizar = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._recordatorios = {}  # doc_id -> (version, datos)
+        self._versiones = itertools.count()
+        self._cargado_hasta = None
+        self._despertar = asyncio.Event()
+        self._acks = []  # flags avisado_* pendientes de escribir
+
+    def _ahora(self):
+        return ahora()
+
+    async def cargar_ventana(self, desde, hasta):
+        # Si la lectura falla la ventana no cuenta como cargada y se repite
+        anterior = self._cargado_hasta
+        self._cargado_hasta = hasta
+        try:
+            await self._cargar(desde, hasta)
+        except Exception:
+            self._cargado_hasta = anterior
+            raise
+
+    async def _cargar(self, desde, hasta, shards=None):
+        if self.coordinador is not None:
+            shards = self.coordinador.shards if shards is None else shards
+            if not shards:
+                return
+        for d in await self.repo.en_rango(desde, hasta, shards):
+            self.programar(d["doc_id"], d)
+
+    async def reasignar(self, ganados, perdidos):
+        # Llamado por el coordinador: olvida los shards cedidos y carga la
+        # ventana actual de los recibidos (p. ej. de una réplica caída)
+        for doc_id, (_, datos) in list(self._recordatorios.items()):
+            if shard_de(datos.get("telegram_id")) in perdidos:
+                del self._recordatorios[doc_id]
+        if ganados and self._cargado_hasta is not None:
+            await self._cargar(self._ahora() - TOLERANCIA_HORA, self._cargado_hasta, ganados)
+
+    def programar(self, doc_id, datos):
+        # Inserta (o reprograma) un recordatorio. Las entradas antiguas del
+        # heap quedan invalidadas por la versión y se descartan al salir.
+        anterior = self._recordatorios.pop(doc_id, None)
+        if anterior is not None:
+            # Una relectura no debe deshacer avisos ya enviados desde aquí
+            # cuyo flag aún no llegó a Firestore
+            enviados = {flag: True for flag in AVISOS.values() if anterior[1].get(flag)}
+            datos = dict(datos, **enviados)
+        if not datos.get("telegram_id"):
+            return
+        dt = parse_fecha_hora_gpt(datos.get("fecha_hora"))
+        if not dt:
+            return
+        if self._cargado_hasta is None or dt >= self._cargado_hasta:
+            # Fuera de la ventana: lo recogerá la siguiente carga por rango
+            return
+        version = next(self._versiones)
+        self._recordatorios[doc_id] = (version, datos)
+        primero = self._heap[0][0] if self._heap else None
+        for tipo, flag in AVISOS.items():
+            if datos.get(flag):
+                continue
+            cuando = dt - AVISO_PREVIO if tipo == "10min" else dt
+            heapq.heappush(self._heap, (cuando, next(self._seq), doc_id, version, tipo, dt, True))
+            if primero is None or cuando < primero:
+                self._despertar.set()
+
+    async def actualizar(self, doc_id, cambios):
+        if doc_id in self._recordatorios:
+            _, datos = self._recordatorios[doc_id]
+            self.programar(doc_id, dict(datos, **cambios))
+        elif "fecha_hora" in cambios:
+            dt = parse_fecha_hora_gpt(cambios["fecha_hora"])
+            if dt and self._cargado_hasta is not None and dt < self._cargado_hasta:
+                datos = await self.repo.obtener(doc_id)
+                if datos:
+                    self.programar(doc_id, datos)
+
+    def _vigente(self, doc_id, version):
+        actual = self._recordatorios.get(doc_id)
+        return actual is not None and actual[0] == version
+
+    def _limpiar(self, doc_id):
+        _, datos = self._recordatorios[doc_id]
+        if all(datos.get(flag) for flag in AVISOS.values()):
+            del self._recordatorios[doc_id]
+
+    async def _disparar(self, now, notificar):
+        # Junta todo lo que vence en este tick y lo entrega de una vez:
+        # notificar recibe la lista de (datos, tipo, grupo) y devuelve, por
+        # aviso, None si se entregó en privado o la excepción si falló.
+        # "grupo" indica si el aviso aún debe ir al grupo: al reintentar un
+        # envío privado fallido ya se encoló antes y no se repite.
+        avisos = []
+        while self._heap and self._heap[0][0] <= now:
+            cuando, _, doc_id, version, tipo, dt, grupo = heapq.heappop(self._heap)
+            if not self._vigente(doc_id, version):
+                continue
+            _, datos = self._recordatorios[doc_id]
+            flag = AVISOS[tipo]
+            # Mismas ventanas de validez que el sondeo anterior
+            if tipo == "10min" and now > dt:
+                datos[flag] = True
+                self._limpiar(doc_id)
+                continue
+            if tipo == "hora" and now - dt > TOLERANCIA_HORA:
+                datos[flag] = True
+                self._limpiar(doc_id)
+                continue
+            avisos.append((doc_id, version, tipo, dt, datos, grupo))
+
+        if avisos and self.coordinador is not None:
+            avisos = await self._reclamar(avisos, now)
+        if avisos:
+            resultados = await notificar([(datos, tipo, grupo) for _, _, tipo, _, datos, grupo in avisos])
+            for (doc_id, version, tipo, dt, datos, _), error in zip(avisos, resultados):
+                if error is not None:
+                    print(f"Error avisando ({tipo}) {doc_id}: {error}")
+                    heapq.heappush(self._heap, (now + REINTENTO, next(self._seq), doc_id, version, tipo, dt, False))
+                    continue
+                datos[AVISOS[tipo]] = True
+                self._acks.append((doc_id, {AVISOS[tipo]: True}))
+                if self._vigente(doc_id, version):
+                    self._limpiar(doc_id)
+        await self._confirmar_avisos()
+
+    async def _reclamar(self, avisos, now):
+        # Compare-and-set transaccional por aviso: sólo se envían los que
+        # esta réplica consigue reclamar; el resto ya se envió o lo tiene otra
+        reloj = self.coordinador.reloj()
+        resultados = await asyncio.gather(*(
+            self.repo.reclamar_aviso(doc_id, AVISOS[tipo], self.coordinador.replica,
+                                     RECLAMO_TTL.total_seconds(), reloj)
+            for doc_id, _, tipo, _, _, _ in avisos
+        ), return_exceptions=True)
+        reclamados = []
+        for aviso, resultado in zip(avisos, resultados):
+            doc_id, version, tipo, dt, datos, grupo = aviso
+            if isinstance(resultado, Exception):
+                print(f"Error reclamando aviso ({tipo}) {doc_id}: {resultado}")
+                heapq.heappush(self._heap, (now + REINTENTO, next(self._seq), doc_id, version, tipo, dt, grupo))
+            elif resultado:
+                reclamados.append(aviso)
+            else:
+                datos[AVISOS[tipo]] = True
+                if self._vigente(doc_id, version):
+                    self._limpiar(doc_id)
+        return reclamados
+
+    async def _confirmar_avisos(self):
+        # Los flags "avisado" se escriben en lote; si falla se reintenta en
+        # el siguiente tick sin volver a enviar el mensaje.
+        if not self._acks:
+            return
+        acks, self._acks = self._acks, []
+        try:
+            await self.repo.actualizar_lote(acks)
+        except Exception as e:
+            print(f"Error guardando avisos enviados: {e}")
+            self._acks = acks + self._acks
+
+    async def _recargar(self, now):
+        if self._cargado_hasta is None:
+            await self.cargar_ventana(now - TOLERANCIA_HORA, now + self.ventana)
+        # Recarga la siguiente franja antes de que haga falta su aviso previo
+        elif now >= self._cargado_hasta - AVISO_PREVIO:
+            await self.cargar_ventana(self._cargado_hasta, now + self.ventana)
+        if self._resincronizar is None or now >= self._resincronizar:
+            if self._resincronizar is not None:
+                await self._cargar(now - TOLERANCIA_HORA, self._cargado_hasta)
+            self._resincronizar = now + RESINCRONIZAR
+
+    async def run(self, notificar):
+        while True:
+            now = self._ahora()
+            fallo_carga = False
+            with medir(SCHEDULER_TICKS):
+                # Un error de Firestore al cargar no detiene el scheduler: se
+                # siguen disparando los avisos ya en el heap y se reintenta
+                try:
+                    await self._recargar(now)
+                except Exception as e:
+                    print(f"Error cargando recordatorios: {e}; reintento en {REINTENTO.total_seconds():.0f}s")
+                    fallo_carga = True
+                await self._disparar(now, notificar)
+
+            if fallo_carga:
+                siguiente = now + REINTENTO
+            else:
+                siguiente = min(self._cargado_hasta - AVISO_PREVIO, self._resincronizar)
+            if self._acks:
+                siguiente = min(siguiente, now + REINTENTO)
+            if self._heap and self._heap[0][0] < siguiente:
+                siguiente = self._heap[0][0]
+            espera = max((siguiente - self._ahora()).total_seconds(), 0)
+            self._despertar.clear()
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from telegram.error import BadRequest, RetryAfter
+from notificaciones import LIMITE_MENSAJE
+
+CURSOR = " ▌"
+
+
+def punto_de_corte(texto, limite=LIMITE_MENSAJE):
+    # Índice donde partir un texto largo: el último salto de línea o
+    # espacio antes del límite, salvo que quede demasiado atrás.
+    if len(texto) <= limite:
+        return len(texto)
+    for separador in ("\n", " "):
+        i = texto.rfind(separador, 0, limite)
+        if i > limite // 2:
+            return i + 1
+    return limite
+
+
+class MensajeProgresivo:
+    # Muestra una respuesta a medida que llega: el primer fragmento se envía
+    # como respuesta nueva y los siguientes editan ese mensaje, como mucho
+    # una vez cada "intervalo" segundos (Telegram limita las ediciones por
+    # chat). Si el texto supera 4096 caracteres se cierra el mensaje actual
+    # y se continúa en uno nuevo.
+
+    def __init__(self, message, intervalo=1.0, reloj=time.monotonic):
+        self.message = message  # mensaje del usuario al que se responde
+        self.intervalo = intervalo
+        self.reloj = reloj
+        self.texto = ""  # texto del mensaje que se está editando
+        self.actual = None  # ese mensaje, una vez enviado
+        self.mostrado = ""
+        self.proxima_edicion = 0.0
+        self.primer_byte = None  # reloj() cuando el usuario ve el primer texto
+        self.mensajes = 0
+        self.ediciones = 0
+
+    async def agregar(self, fragmento):
+        if not self.texto:
+            fragmento = fragmento.lstrip()
+        self.texto += fragmento
+        while len(self.texto) > LIMITE_MENSAJE:
+            corte = punto_de_corte(self.texto)
+            cerrado, self.texto = self.texto[:corte].rstrip(), self.texto[corte:].lstrip()
+            await self._mostrar(cerrado, final=True)
+            self.actual = None
+            self.mostrado = ""
+            self.proxima_edicion = 0.0
+        if self.reloj() >= self.proxima_edicion:
+            await self._mostrar(self.texto)
+
+    async def terminar(self):
+        self.texto = self.texto.rstrip()
+        await self._mostrar(self.texto, final=True)
+
+    async def _mostrar(self, texto, final=False):
+        if not texto.strip():
+            return
+        visible = texto
+        if not final and len(texto) + len(CURSOR) <= LIMITE_MENSAJE:
+            visible += CURSOR
+        if visible == self.mostrado:
+            return
+        try:
+            if self.actual is None:
+                self.actual = await self.message.reply_text(visible)
+                self.mensajes += 1
+                if self.primer_byte is None:
+                    self.primer_byte = self.reloj()
+            else:
+                await self.actual.edit_text(visible)
+                self.ediciones += 1
+        except RetryAfter as e:
+            if not final:
+                # Se salta esta edición; la siguiente llevará todo el texto
+                self.proxima_edicion = self.reloj() + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            return await self._mostrar(texto, final)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.mostrado = visible
+        self.proxima_edicion = self.reloj() + self.intervalo
@@ -0,0 +1,116 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+
+import pytz
+
+from agenda import AgendaDiaria, agrupar_por_chat, proxima_ejecucion, rango_del_dia, render_agenda
+from fechas import LIMA
+from repositorio import RepositorioMemoria, campos_derivados
+
+SIETE = time(7, 0)
+
+
+def lima(texto):
+    return LIMA.localize(datetime.fromisoformat(texto))
+
+
+def test_proxima_ejecucion_el_mismo_dia_o_el_siguiente():
+    assert proxima_ejecucion(lima("2026-11-02T06:59:59"), SIETE) == lima("2026-11-02T07:00:00")
+    # Estrictamente posterior: justo a la hora pasa al día siguiente
+    assert proxima_ejecucion(lima("2026-11-02T07:00:00"), SIETE) == lima("2026-11-03T07:00:00")
+    assert proxima_ejecucion(lima("2026-11-02T23:30:00"), SIETE) == lima("2026-11-03T07:00:00")
+
+
+def test_proxima_ejecucion_cruza_mes_y_año():
+    assert proxima_ejecucion(lima("2026-11-30T08:00:00"), SIETE) == lima("2026-12-01T07:00:00")
+    assert proxima_ejecucion(lima("2026-12-31T20:00:00"), SIETE) == lima("2027-01-01T07:00:00")
+
+
+def test_proxima_ejecucion_usa_la_hora_de_lima_aunque_llegue_otra_zona():
+    # 11:30 UTC son las 06:30 en Lima: todavía toca hoy
+    assert proxima_ejecucion(datetime(2026, 11, 2, 11, 30, tzinfo=pytz.utc), SIETE) == lima("2026-11-02T07:00:00")
+    # 03:00 UTC del día 3 siguen siendo las 22:00 del día 2 en Lima
+    assert proxima_ejecucion(datetime(2026, 11, 3, 3, 0, tzinfo=pytz.utc), SIETE) == lima("2026-11-03T07:00:00")
+    # Un reloj en una zona con cambio de horario (Nueva York, fin del DST)
+    nueva_york = pytz.timezone("America/New_York")
+    desde = nueva_york.localize(datetime(2026, 11, 1, 1, 30), is_dst=False)
+    assert proxima_ejecucion(desde, SIETE) == lima("2026-11-01T07:00:00")
+
+
+def test_proxima_ejecucion_con_el_horario_de_verano_historico_de_lima():
+    # Lima usó UTC-4 de enero a marzo de 1994: cada ejecución lleva su desfase
+    primera = proxima_ejecucion(lima("1993-12-31T23:30:00"), SIETE)
+    assert primera.utcoffset() == timedelta(hours=-4)
+    assert primera.astimezone(LIMA).time() == SIETE
+    siguiente = proxima_ejecucion(lima("1994-03-31T23:00:00"), SIETE)
+    assert siguiente.utcoffset() == timedelta(hours=-5)
+    assert siguiente.astimezone(LIMA).time() == SIETE
+
+
+def test_rango_del_dia_en_hora_de_lima():
+    desde, hasta = rango_del_dia(date(2026, 11, 2))
+    assert desde == lima("2026-11-02T00:00:00")
+    assert hasta - desde == timedelta(days=1)
+    assert desde.utcoffset() == timedelta(hours=-5)
+
+
+def cita(telegram_id, hora, cliente="Ana", **extra):
+    d = dict({"cliente": cliente, "proyecto": "Los Pinos", "fecha_hora": hora, "telegram_id": telegram_id}, **extra)
+    return dict(d, **campos_derivados(d))
+
+
+def test_agrupar_por_chat_ordena_y_omite_sin_chat():
+    citas = [
+        dict(cita(2, "2026-11-02T15:00:00-05:00", "Luis"), doc_id="a"),
+        dict(cita(1, "2026-11-02T11:00:00-05:00", "Ana"), doc_id="b"),
+        dict(cita(2, "2026-11-02T09:00:00-05:00", "Rosa"), doc_id="c"),
+        dict(cita(None, "2026-11-02T08:00:00-05:00", "Sin chat"), doc_id="d"),
+    ]
+    por_chat = agrupar_por_chat(citas)
+    assert list(por_chat) == [2, 1]
+    assert [c["cliente"] for c in por_chat[2]] == ["Rosa", "Luis"]
+    assert None not in por_chat
+
+
+def test_render_agenda_muestra_la_hora_de_lima():
+    partes = render_agenda(date(2026, 11, 2), [cita(1, "2026-11-02T14:00:00+00:00", observaciones="llevar planos")])
+    assert partes[0].startswith("📋 *Tu agenda de hoy 02/11/2026:* 1 reunión")
+    assert partes[1].startswith("🕒 09:00 - Ana (Los Pinos)")
+    assert "📝 llevar planos" in partes[1]
+
+
+class DespachadorFalso:
+    def __init__(self):
+        self.digests = []
+
+    def encolar_digest(self, chat_id, partes, **kwargs):
+        self.digests.append((chat_id, partes))
+        return []
+
+
+def test_enviar_una_agenda_por_chat_y_una_al_grupo():
+    repo = RepositorioMemoria({
+        "a": cita(1, "2026-11-02T00:00:00-05:00"),
+        "b": cita(1, "2026-11-02T23:59:00-05:00", "Luis"),
+        "c": cita(2, "2026-11-03T03:00:00+00:00", "Rosa"),  # 22:00 del día 2 en Lima
+        "d": cita(3, "2026-11-03T00:00:00-05:00", "Mañana"),
+        "e": cita(None, "2026-11-02T10:00:00-05:00", "Sin chat"),
+    })
+    despachador = DespachadorFalso()
+    agenda = AgendaDiaria(repo, despachador, SIETE, grupo_id=-100)
+
+    async def probar():
+        assert await agenda.enviar(date(2026, 11, 2)) == 2
+    asyncio.run(probar())
+    chats = [chat_id for chat_id, _ in despachador.digests]
+    assert chats == [1, 2, -100]
+    assert len(despachador.digests[0][1]) == 3
+
+
+def test_solo_la_replica_del_shard_lider_envia():
+    class Coordinador:
+        shards = {1, 2}
+    assert AgendaDiaria(RepositorioMemoria(), DespachadorFalso(), SIETE).es_lider()
+    assert not AgendaDiaria(RepositorioMemoria(), DespachadorFalso(), SIETE, coordinador=Coordinador()).es_lider()
+    Coordinador.shards = {0}
+    assert AgendaDiaria(RepositorioMemoria(), DespachadorFalso(), SIETE, coordinador=Coordinador()).es_lider()
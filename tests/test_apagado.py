@@ -0,0 +1,55 @@
+import asyncio
+
+import main
+
+
+class Bloqueado:
+    # run() no termina nunca, como el scheduler y el coordinador reales
+    async def run(self, *args):
+        await asyncio.Event().wait()
+
+    async def reasignar(self, shards):
+        pass
+
+
+class CoordinadorFalso(Bloqueado):
+    def __init__(self):
+        self.soltado = False
+
+    async def soltar(self):
+        self.soltado = True
+
+
+class EstadosFalsos:
+    def __init__(self):
+        self.volcados = 0
+
+    async def volcar(self):
+        self.volcados += 1
+
+
+def test_post_shutdown_libera_los_shards_y_vuelca_los_estados(monkeypatch):
+    coordinador, estados = CoordinadorFalso(), EstadosFalsos()
+    monkeypatch.setattr(main, "coordinador", coordinador)
+    monkeypatch.setattr(main, "scheduler", Bloqueado())
+    monkeypatch.setattr(main, "estados", estados)
+
+    async def probar():
+        tareas = [main.vigilar("scheduler", main.scheduler_loop(None)), main.vigilar("estados", main.estados_loop())]
+        monkeypatch.setattr(main, "tarea_arranque", asyncio.ensure_future(asyncio.gather(*tareas)))
+        await asyncio.sleep(0)
+        await main.post_shutdown(None)
+        assert main.tarea_arranque.done()
+    asyncio.run(probar())
+    assert coordinador.soltado
+    assert estados.volcados == 1
+
+
+def test_post_shutdown_tras_un_arranque_fallido(monkeypatch):
+    # arrancar_servicios termina con SystemExit si la configuración falla
+    async def probar():
+        tarea = asyncio.get_running_loop().create_future()
+        tarea.set_exception(SystemExit(1))
+        monkeypatch.setattr(main, "tarea_arranque", tarea)
+        await main.post_shutdown(None)
+    asyncio.run(probar())
@@ -0,0 +1,134 @@
+import asyncio
+from datetime import date
+
+import metricas
+from cache import CacheExtracciones
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def contar(evento):
+    return metricas.CACHE_EXTRACCIONES.valores.get((evento,), 0)
+
+
+class Extraccion:
+    # calcular() lento y contado: deja tiempo a que se junten los llamadores
+    def __init__(self):
+        self.llamadas = 0
+        self.liberar = asyncio.Event()
+
+    async def __call__(self):
+        self.llamadas += 1
+        await self.liberar.wait()
+        return {"intencion": "consultar", "llamada": self.llamadas}
+
+
+def test_llamadores_concurrentes_comparten_una_extraccion():
+    async def probar():
+        cache = CacheExtracciones(lambda: date(2026, 11, 2))
+        extraccion = Extraccion()
+        llamadas = [asyncio.create_task(cache.obtener(texto, extraccion)) for texto in ["¿Qué citas tengo?", "qué  citas tengo", "QUÉ CITAS TENGO"]]
+        await asyncio.sleep(0)
+        extraccion.liberar.set()
+        resultados = await asyncio.gather(*llamadas)
+        assert extraccion.llamadas == 1
+        assert all(r == {"intencion": "consultar", "llamada": 1} for r in resultados)
+        # Cada llamador recibe su propia copia
+        resultados[0]["intencion"] = "otro"
+        assert (await cache.obtener("qué citas tengo", extraccion))["intencion"] == "consultar"
+        assert cache.estadisticas()["coalescidas"] == 2
+        assert cache.estadisticas()["aciertos"] == 1
+    asyncio.run(probar())
+
+
+def test_cancelar_al_primer_llamador_no_cancela_a_los_demas():
+    async def probar():
+        cache = CacheExtracciones(lambda: date(2026, 11, 2))
+        extraccion = Extraccion()
+        primero = asyncio.create_task(cache.obtener("citas de hoy", extraccion))
+        await asyncio.sleep(0)
+        segundo = asyncio.create_task(cache.obtener("citas de hoy", extraccion))
+        await asyncio.sleep(0)
+        primero.cancel()
+        await asyncio.sleep(0)
+        extraccion.liberar.set()
+        assert (await segundo)["llamada"] == 1
+        assert primero.cancelled()
+        # El resultado quedó en caché aunque el primero se cancelara
+        assert (await cache.obtener("citas de hoy", extraccion))["llamada"] == 1
+        assert extraccion.llamadas == 1
+    asyncio.run(probar())
+
+
+def test_un_error_no_queda_en_cache():
+    async def probar():
+        cache = CacheExtracciones(lambda: date(2026, 11, 2))
+        intentos = []
+
+        async def fallar():
+            intentos.append(1)
+            raise RuntimeError("OpenAI caído")
+
+        for _ in range(2):
+            try:
+                await cache.obtener("citas", fallar)
+            except RuntimeError:
+                pass
+        assert len(intentos) == 2
+    asyncio.run(probar())
+
+
+def test_cambio_de_dia_invalida_la_cache():
+    async def probar():
+        dia = [date(2026, 11, 2)]
+        cache = CacheExtracciones(lambda: dia[0])
+        extraccion = Extraccion()
+        extraccion.liberar.set()
+        await cache.obtener("citas de mañana", extraccion)
+        await cache.obtener("citas de mañana", extraccion)
+        assert extraccion.llamadas == 1
+        dia[0] = date(2026, 11, 3)
+        assert (await cache.obtener("citas de mañana", extraccion))["llamada"] == 2
+        assert cache.estadisticas()["invalidaciones"] == 1
+    asyncio.run(probar())
+
+
+def test_ttl_y_desalojo_lru():
+    async def probar():
+        reloj = Reloj()
+        cache = CacheExtracciones(lambda: date(2026, 11, 2), max_entradas=2, ttl=60, reloj=reloj)
+        extraccion = Extraccion()
+        extraccion.liberar.set()
+        for texto in ["a", "b", "a", "c"]:
+            await cache.obtener(texto, extraccion)
+        # "b" era la menos usada
+        assert cache.estadisticas()["desalojos"] == 1
+        await cache.obtener("a", extraccion)
+        assert extraccion.llamadas == 3
+        reloj.t = 61
+        await cache.obtener("a", extraccion)
+        assert extraccion.llamadas == 4
+        assert cache.estadisticas()["expiradas"] == 1
+    asyncio.run(probar())
+
+
+def test_exporta_sus_contadores_como_metricas():
+    async def probar():
+        antes = {e: contar(e) for e in ("acierto", "fallo", "coalescida")}
+        cache = CacheExtracciones(lambda: date(2026, 11, 2))
+        extraccion = Extraccion()
+        extraccion.liberar.set()
+        await cache.obtener("citas", extraccion)
+        await cache.obtener("citas", extraccion)
+        assert contar("fallo") == antes["fallo"] + 1
+        assert contar("acierto") == antes["acierto"] + 1
+        texto = metricas.exponer()
+        assert 'neomind_cache_extracciones_total{evento="acierto"}' in texto
+        assert "neomind_cache_extracciones_entradas 1" in texto
+    asyncio.run(probar())
@@ -0,0 +1,80 @@
+import asyncio
+
+from coordinacion import CoordinadorShards
+from repositorio import NUM_SHARDS, RepositorioMemoria, repartir_shards
+
+TTL = 30.0
+
+
+def ronda(estado, replicas, ahora):
+    mios = {}
+    for replica in replicas:
+        estado, mios[replica] = repartir_shards(estado, replica, TTL, ahora)
+    return estado, mios
+
+
+def test_una_replica_toma_todos_los_shards():
+    _, mios = repartir_shards({}, "a", TTL, 0.0)
+    assert mios == set(range(NUM_SHARDS))
+
+
+def test_dos_replicas_se_reparten_sin_solaparse():
+    estado, _ = ronda({}, ["a"], 0.0)
+    # La recién llegada no encuentra shards libres hasta que "a" suelta su exceso
+    estado, mios = ronda(estado, ["b", "a", "b"], 1.0)
+    assert len(mios["a"]) == len(mios["b"]) == NUM_SHARDS // 2
+    assert not mios["a"] & mios["b"]
+    assert mios["a"] | mios["b"] == set(range(NUM_SHARDS))
+
+
+def test_shards_de_una_replica_caida_pasan_a_las_vivas():
+    estado, _ = ronda({}, ["a", "b", "a", "b"], 0.0)
+    # "b" deja de renovar: tras el ttl sus leases vencen y "a" los toma
+    estado, mios = ronda(estado, ["a"], TTL + 1)
+    assert mios["a"] == set(range(NUM_SHARDS))
+
+
+def test_saliendo_libera_los_shards_al_momento():
+    estado, _ = ronda({}, ["a", "b", "a", "b"], 0.0)
+    estado, mios = repartir_shards(estado, "b", TTL, 1.0, saliendo=True)
+    assert mios == set()
+    estado, mios = repartir_shards(estado, "a", TTL, 2.0)
+    assert mios == set(range(NUM_SHARDS))
+
+
+def test_reclamar_aviso_es_compare_and_set():
+    async def probar():
+        repo = RepositorioMemoria({"r1": {"telegram_id": 1}})
+        assert await repo.reclamar_aviso("r1", "avisado_hora", "a", TTL, 0.0)
+        assert not await repo.reclamar_aviso("r1", "avisado_hora", "b", TTL, 1.0)
+        # La misma réplica puede volver a reclamarlo para reintentar
+        assert await repo.reclamar_aviso("r1", "avisado_hora", "a", TTL, 2.0)
+        # Reclamo vencido: otra réplica lo toma
+        assert await repo.reclamar_aviso("r1", "avisado_hora", "b", TTL, 2.0 + TTL)
+        # Otro tipo de aviso se reclama por separado
+        assert await repo.reclamar_aviso("r1", "avisado_10min", "a", TTL, 3.0)
+        # Ya enviado o inexistente: nadie lo reclama
+        repo.docs["r1"]["avisado_hora"] = True
+        assert not await repo.reclamar_aviso("r1", "avisado_hora", "b", TTL, 100.0)
+        assert not await repo.reclamar_aviso("r2", "avisado_hora", "a", TTL, 0.0)
+    asyncio.run(probar())
+
+
+def test_coordinador_reintenta_un_cambio_de_shards_fallido():
+    async def probar():
+        reloj = [0.0]
+        coordinador = CoordinadorShards(RepositorioMemoria(), "a", ttl=0.03, reloj=lambda: reloj[0])
+        cambios = []
+
+        async def al_cambiar(ganados, perdidos):
+            cambios.append((set(ganados), set(perdidos)))
+            if len(cambios) == 1:
+                raise RuntimeError("no se pudo cargar la ventana")
+
+        tarea = asyncio.create_task(coordinador.run(al_cambiar))
+        await asyncio.sleep(0.05)
+        assert not tarea.done()
+        tarea.cancel()
+        # Los shards ganados en la primera ronda se vuelven a pasar en la segunda
+        assert cambios[:2] == [(set(range(NUM_SHARDS)), set())] * 2
+    asyncio.run(probar())
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from escrituras import EscriturasDiferidas, PersistenciaEscrituras
+from fechas import LIMA
+from repositorio import RepositorioMemoria
+
+INICIO = LIMA.localize(datetime(2026, 11, 2, 9, 0))
+
+
+def cita(cliente, minutos=0, telegram_id=1):
+    return {"cliente": cliente, "fecha_hora": (INICIO + timedelta(minutes=minutos)).isoformat(), "telegram_id": telegram_id}
+
+
+class RepoQueRechaza(RepositorioMemoria):
+    # Rechaza sin remedio las escrituras de "Rechazado" y, mientras caido
+    # sea cierto, falla cualquier lote como un error transitorio de red
+    caido = False
+
+    async def escribir_lote(self, operaciones):
+        if self.caido:
+            raise ConnectionError("sin red")
+        if any(datos.get("cliente") == "Rechazado" for _, _, datos in operaciones):
+            raise ValueError("documento inválido")
+        await super().escribir_lote(operaciones)
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "escrituras.db")
+
+
+def test_lee_lo_escrito_antes_de_confirmarlo(ruta):
+    async def probar():
+        base = RepositorioMemoria()
+        escrituras = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        doc_id = await escrituras.agregar(cita("Ana"))
+        await escrituras.actualizar(doc_id, {"fecha_hora": (INICIO + timedelta(minutes=30)).isoformat()})
+        assert base.docs == {}
+        assert (await escrituras.obtener(doc_id))["cliente"] == "Ana"
+        assert [c["doc_id"] for c in await escrituras.por_usuario(1)] == [doc_id]
+        en_ventana = await escrituras.en_rango(INICIO + timedelta(minutes=20), INICIO + timedelta(minutes=40))
+        assert [c["doc_id"] for c in en_ventana] == [doc_id]
+        await escrituras.vaciar()
+        assert base.docs[doc_id]["fecha_ts"] == INICIO + timedelta(minutes=30)
+        assert escrituras.estadisticas()["pendientes"] == 0
+    asyncio.run(probar())
+
+
+def test_reinicio_reaplica_las_escrituras_en_orden(ruta):
+    async def probar():
+        base = RepositorioMemoria()
+        antes = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        doc_id = await antes.agregar(cita("Ana"))
+        await antes.actualizar(doc_id, {"cliente": "Ana María"})
+        # El proceso cae sin confirmar nada: otra instancia lee la cola de disco
+        despues = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        assert despues.estadisticas()["pendientes"] == 2
+        await despues.vaciar()
+        assert base.docs[doc_id]["cliente"] == "Ana María"
+        assert PersistenciaEscrituras(ruta).cargar() == []
+    asyncio.run(probar())
+
+
+def test_repetir_un_lote_confirmado_no_duplica(ruta):
+    async def probar():
+        base = RepositorioMemoria()
+        escrituras = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        await escrituras.agregar(cita("Ana"))
+        pendientes = PersistenciaEscrituras(ruta).cargar()
+        await escrituras.vaciar()
+        # Como si la respuesta del commit se hubiera perdido y se repitiera
+        await base.escribir_lote([(op, doc_id, datos) for _, op, doc_id, _, datos, _ in pendientes])
+        assert len(base.docs) == 1
+    asyncio.run(probar())
+
+
+def test_error_permanente_se_descarta_sin_bloquear_la_cola(ruta):
+    async def probar():
+        base = RepoQueRechaza()
+        escrituras = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        primero = await escrituras.agregar(cita("Ana"))
+        rechazado = await escrituras.agregar(cita("Rechazado"))
+        ultimo = await escrituras.agregar(cita("Luis"))
+        await escrituras.vaciar()
+        assert set(base.docs) == {primero, ultimo}
+        assert rechazado not in base.docs
+        assert escrituras.estadisticas()["descartadas"] == 1
+        # Descartada queda en disco para revisarla, pero no se vuelve a cargar
+        assert PersistenciaEscrituras(ruta).cargar() == []
+        filas = PersistenciaEscrituras(ruta).conn.execute("SELECT doc_id FROM escrituras WHERE descartada = 1")
+        assert [doc_id for doc_id, in filas] == [rechazado]
+    asyncio.run(probar())
+
+
+def test_error_transitorio_conserva_la_cola(ruta):
+    async def probar():
+        base = RepoQueRechaza()
+        base.caido = True
+        escrituras = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        doc_id = await escrituras.agregar(cita("Ana"))
+        with pytest.raises(ConnectionError):
+            await escrituras.vaciar()
+        assert escrituras.estadisticas()["pendientes"] == 1
+        base.caido = False
+        await escrituras.vaciar()
+        assert doc_id in base.docs
+    asyncio.run(probar())
+
+
+def test_el_disco_no_bloquea_el_event_loop(ruta):
+    class PersistenciaLenta(PersistenciaEscrituras):
+        def guardar(self, *args):
+            time.sleep(0.1)
+            return super().guardar(*args)
+
+    async def probar():
+        escrituras = EscriturasDiferidas(RepositorioMemoria(), PersistenciaLenta(ruta))
+        latidos = 0
+
+        async def latir():
+            nonlocal latidos
+            while True:
+                await asyncio.sleep(0.01)
+                latidos += 1
+
+        latido = asyncio.create_task(latir())
+        doc_id = await escrituras.agregar(cita("Ana"))
+        latido.cancel()
+        assert latidos >= 5
+        # Al volver, la escritura ya está en disco y visible
+        assert [fila[2] for fila in PersistenciaEscrituras(ruta).cargar()] == [doc_id]
+        assert (await escrituras.obtener(doc_id))["cliente"] == "Ana"
+    asyncio.run(probar())
+
+
+def test_escrituras_concurrentes_se_confirman_en_orden(ruta):
+    async def probar():
+        base = RepositorioMemoria()
+        escrituras = EscriturasDiferidas(base, PersistenciaEscrituras(ruta))
+        doc_id = await escrituras.agregar(cita("Ana"))
+        await asyncio.gather(*(escrituras.actualizar(doc_id, {"observaciones": str(i)}) for i in range(20)))
+        await escrituras.vaciar()
+        assert base.docs[doc_id]["observaciones"] == "19"
+    asyncio.run(probar())
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from estados import AlmacenEstados, EstadoConversacion, PersistenciaSQLite
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "estados.db")
+
+
+def test_guardar_solo_anota_y_volcar_escribe(ruta):
+    async def probar():
+        estados = AlmacenEstados(persistencia=PersistenciaSQLite(ruta))
+        estados.guardar(1, EstadoConversacion(estado="confirmar", datos={"cliente": "Ana"}))
+        assert PersistenciaSQLite(ruta).cargar(0) == []
+        await estados.volcar()
+        [(chat_id, valores)] = PersistenciaSQLite(ruta).cargar(0)
+        assert chat_id == 1 and valores["datos"] == {"cliente": "Ana"}
+    asyncio.run(probar())
+
+
+def test_el_volcado_guarda_el_ultimo_cambio_de_cada_chat(ruta):
+    async def probar():
+        estados = AlmacenEstados(persistencia=PersistenciaSQLite(ruta))
+        st = EstadoConversacion(estado="confirmar", datos={"cliente": "Ana"})
+        estados.guardar(1, st)
+        st.estado = "modificar_que_campo"
+        estados.guardar(1, st)
+        estados.guardar(2, EstadoConversacion(estado="confirmar", datos={"cliente": "Luis"}))
+        estados.borrar(2)
+        await estados.volcar()
+        recargados = AlmacenEstados(persistencia=PersistenciaSQLite(ruta))
+        assert len(recargados) == 1
+        assert recargados.obtener(1).estado == "modificar_que_campo"
+    asyncio.run(probar())
+
+
+def test_purga_de_expirados_llega_a_disco(ruta):
+    async def probar():
+        reloj = Reloj()
+        estados = AlmacenEstados(ttl=60, persistencia=PersistenciaSQLite(ruta), reloj=reloj)
+        estados.guardar(1, EstadoConversacion(estado="confirmar", datos={"cliente": "Ana"}))
+        await estados.volcar()
+        reloj.t += 61
+        estados.purgar_expirados()
+        assert len(estados) == 0
+        await estados.volcar()
+        assert PersistenciaSQLite(ruta).cargar(0) == []
+    asyncio.run(probar())
+
+
+def test_un_volcado_fallido_se_reintenta(ruta):
+    class PersistenciaFallida(PersistenciaSQLite):
+        fallar = False
+
+        def escribir(self, cambios, purgar_antes=None):
+            if self.fallar:
+                self.fallar = False
+                raise OSError("disco lleno")
+            super().escribir(cambios, purgar_antes)
+
+    async def probar():
+        persistencia = PersistenciaFallida(ruta)
+        estados = AlmacenEstados(persistencia=persistencia)
+        persistencia.fallar = True
+        estados.guardar(1, EstadoConversacion(estado="confirmar", datos={"cliente": "Ana"}))
+        with pytest.raises(OSError):
+            await estados.volcar()
+        await estados.volcar()
+        assert [chat_id for chat_id, _ in PersistenciaSQLite(ruta).cargar(0)] == [1]
+    asyncio.run(probar())
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from importacion import Checkpoint, exportar, importar, leer_filas, validar_fila
+from main import CAMPOS
+from repositorio import RepositorioMemoria
+
+
+def fila(i, **extra):
+    return dict({"cliente": f"Cliente {i}", "fecha_hora": f"2026-11-{1 + i % 28:02d}T10:00:00-05:00", "telegram_id": 7}, **extra)
+
+
+def escribir_jsonl(ruta, lineas):
+    with open(ruta, "w", encoding="utf-8") as f:
+        for linea in lineas:
+            f.write((linea if isinstance(linea, str) else json.dumps(linea)) + "\n")
+    return str(ruta)
+
+
+class RepoQueFalla(RepositorioMemoria):
+    # Falla el lote número "fallar" (desde 1) y después funciona
+    def __init__(self, fallar=None):
+        super().__init__()
+        self.fallar = fallar
+        self.lotes = 0
+
+    async def agregar_lote(self, docs):
+        self.lotes += 1
+        if self.lotes == self.fallar:
+            raise ConnectionError("Firestore no disponible")
+        await super().agregar_lote(docs)
+
+
+def test_lineas_ilegibles_y_filas_que_no_son_objeto_cuentan_como_error(tmp_path, capsys):
+    ruta = escribir_jsonl(tmp_path / "citas.jsonl", [fila(0), "{no es json", "[1, 2]", "3", fila(1), fila(2, cliente="")])
+
+    async def probar():
+        repo = RepositorioMemoria()
+        importados, errores = await importar(repo, ruta, CAMPOS)
+        assert (importados, errores) == (2, 4)
+        assert len(repo.docs) == 2
+    asyncio.run(probar())
+    salida = capsys.readouterr().err
+    assert "Línea 2: JSON inválido" in salida
+    assert "Línea 3: la fila no es un objeto: list" in salida
+    assert "Línea 6: falta cliente" in salida
+
+
+def test_validar_fila_normaliza_fecha_a_lima():
+    datos, motivo = validar_fila({"cliente": "Ana", "fecha_hora": "x", "telegram_id": "7"}, CAMPOS, {"x": None})
+    assert datos is None and motivo.startswith("fecha_hora inválida")
+    dt = datetime.fromisoformat("2026-11-02T15:00:00+00:00")
+    datos, motivo = validar_fila({"cliente": "Ana", "fecha_hora": "x", "telegram_id": "7"}, CAMPOS, {"x": dt})
+    assert motivo is None
+    assert datos["fecha_hora"] == "2026-11-02T10:00:00-05:00"
+    assert datos["telegram_id"] == 7
+
+
+def test_csv_con_cabeceras_normalizadas(tmp_path):
+    ruta = tmp_path / "citas.csv"
+    ruta.write_text("Cliente,Fecha Hora,Telegram ID\nAna,2026-11-02T10:00:00-05:00,7\n,,\n", encoding="utf-8")
+    assert list(leer_filas(str(ruta))) == [
+        (2, {"cliente": "Ana", "fecha_hora": "2026-11-02T10:00:00-05:00", "telegram_id": "7"})
+    ]
+
+
+def test_checkpoint_solo_avanza_por_el_prefijo_contiguo(tmp_path):
+    ruta = str(tmp_path / "progreso.json")
+    progreso = Checkpoint(ruta, "citas.jsonl")
+    for primera in (1, 11, 21):
+        progreso.iniciar(primera)
+    # Terminan en desorden: el segundo y el tercero esperan al primero
+    progreso.terminar(11, 20, 10)
+    progreso.terminar(21, 30, 9)
+    assert (progreso.linea, progreso.importados) == (0, 0)
+    progreso.terminar(1, 10, 10)
+    assert (progreso.linea, progreso.importados) == (30, 29)
+    guardado = Checkpoint(ruta, "citas.jsonl")
+    assert (guardado.linea, guardado.importados) == (30, 29)
+    # De otro archivo de origen no se reanuda
+    assert Checkpoint(ruta, "otro.jsonl").linea == 0
+
+
+def test_reanudar_tras_un_lote_fallido_no_duplica_ni_salta(tmp_path):
+    ruta = escribir_jsonl(tmp_path / "citas.jsonl", [fila(i) for i in range(25)])
+    checkpoint = str(tmp_path / "progreso.json")
+
+    async def probar():
+        repo = RepoQueFalla(fallar=2)
+        with pytest.raises(ConnectionError):
+            await importar(repo, ruta, CAMPOS, lote=10, concurrencia=1, checkpoint=checkpoint)
+        assert Checkpoint(checkpoint, ruta).linea == 10
+        repo.fallar = None
+        importados, errores = await importar(repo, ruta, CAMPOS, lote=10, checkpoint=checkpoint)
+        assert (importados, errores) == (25, 0)
+        assert len(repo.docs) == 25
+        # Reimportar el archivo entero sin checkpoint sobrescribe (ids por contenido)
+        await importar(repo, ruta, CAMPOS, lote=10)
+        assert len(repo.docs) == 25
+    asyncio.run(probar())
+
+
+def test_simular_no_escribe_ni_avanza_el_checkpoint(tmp_path):
+    ruta = escribir_jsonl(tmp_path / "citas.jsonl", [fila(0), "{roto", fila(1)])
+    checkpoint = str(tmp_path / "progreso.json")
+
+    async def probar():
+        repo = RepositorioMemoria()
+        assert await importar(repo, ruta, CAMPOS, checkpoint=checkpoint, simular=True) == (2, 1)
+        assert repo.docs == {}
+        assert Checkpoint(checkpoint, ruta).linea == 0
+    asyncio.run(probar())
+
+
+def test_exportar_omite_campos_derivados(tmp_path):
+    ruta = escribir_jsonl(tmp_path / "citas.jsonl", [fila(0)])
+    salida = tmp_path / "salida.jsonl"
+
+    async def probar():
+        repo = RepositorioMemoria()
+        await importar(repo, ruta, CAMPOS)
+        assert await exportar(repo, str(salida)) == 1
+    asyncio.run(probar())
+    [exportado] = [json.loads(linea) for linea in salida.read_text(encoding="utf-8").splitlines()]
+    assert exportado["cliente"] == "Cliente 0"
+    assert not {"fecha_ts", "fecha_dia", "shard", "cliente_tokens"} & set(exportado)
@@ -0,0 +1,85 @@
+import asyncio
+
+import indice_busqueda
+from indice_busqueda import IndiceBusqueda
+from repositorio import RepositorioMemoria
+
+
+def repo_con(observaciones, telegram_id=1):
+    return RepositorioMemoria({
+        f"r{i:03d}": {"cliente": "Cliente", "observaciones": obs, "telegram_id": telegram_id}
+        for i, obs in enumerate(observaciones)
+    })
+
+
+def test_busca_por_palabra_y_prefijo():
+    async def probar():
+        indice = IndiceBusqueda(repo_con(["revisar planos de la casa", "firma de contrato", "pago inicial"]))
+        [(_, datos)] = await indice.buscar(1, "firmas del contrato")
+        assert datos["doc_id"] == "r001"
+    asyncio.run(probar())
+
+
+def test_la_poda_conserva_los_que_mas_claves_comparten(monkeypatch):
+    # Con la clave común en más documentos que el presupuesto, el que
+    # comparte todas las palabras de la consulta debe llegar a puntuarse
+    monkeypatch.setattr(indice_busqueda, "MAX_CANDIDATOS", 10)
+    observaciones = [f"visita numero {i}" for i in range(60)]
+    observaciones[37] = "visita banco hipotecario"
+
+    async def probar():
+        indice = IndiceBusqueda(repo_con(observaciones))
+        resultados = await indice.buscar(1, "visita banco hipotecario", limite=1)
+        assert resultados[0][1]["doc_id"] == "r037"
+    asyncio.run(probar())
+
+
+def test_la_poda_es_determinista(monkeypatch):
+    monkeypatch.setattr(indice_busqueda, "MAX_CANDIDATOS", 10)
+
+    async def probar():
+        indice = IndiceBusqueda(repo_con([f"visita numero {i}" for i in range(60)]))
+        usuario = await indice._indice(1)
+        listas = [usuario.invertido["visita"], usuario.invertido["visi*"]]
+        assert usuario._podar(listas) == usuario._podar(listas[::-1]) == [f"r{i:03d}" for i in range(10)]
+    asyncio.run(probar())
+
+
+def test_construccion_cede_el_event_loop_y_aplica_cambios(monkeypatch):
+    monkeypatch.setattr(indice_busqueda, "TROZO_CONSTRUCCION", 5)
+    repo = repo_con([f"nota {i}" for i in range(40)])
+
+    async def probar():
+        indice = IndiceBusqueda(repo)
+        construccion = asyncio.create_task(indice._indice(1))
+        for _ in range(3):
+            await asyncio.sleep(0)
+        # Llegan cambios mientras se construye: mandan sobre la lectura inicial
+        indice.doc_actualizado("r039", {"observaciones": "llamar al notario"})
+        indice.doc_borrado(1, "r000")
+        indice.doc_guardado(1, "nuevo", {"cliente": "Cliente", "observaciones": "reunion en obra", "telegram_id": 1})
+        assert not construccion.done()
+        usuario = await construccion
+        assert "r000" not in usuario.datos
+        assert usuario.datos["r039"]["observaciones"] == "llamar al notario"
+        assert (await indice.buscar(1, "notario"))[0][1]["doc_id"] == "r039"
+        assert (await indice.buscar(1, "obra"))[0][1]["doc_id"] == "nuevo"
+    asyncio.run(probar())
+
+
+def test_busquedas_simultaneas_comparten_la_construccion():
+    class RepoContado(RepositorioMemoria):
+        lecturas = 0
+
+        async def por_usuario(self, telegram_id):
+            self.lecturas += 1
+            await asyncio.sleep(0)
+            return await super().por_usuario(telegram_id)
+
+    async def probar():
+        repo = RepoContado(repo_con(["firma de contrato"]).docs)
+        indice = IndiceBusqueda(repo)
+        resultados = await asyncio.gather(*(indice.buscar(1, "contrato") for _ in range(5)))
+        assert repo.lecturas == 1
+        assert all(len(r) == 1 for r in resultados)
+    asyncio.run(probar())
@@ -0,0 +1,74 @@
+import pytest
+
+import metricas
+from intenciones import RouterIntenciones, es_afirmacion
+from main import CAMPO_FLEX, CAMPOS
+
+
+@pytest.fixture
+def router():
+    return RouterIntenciones(CAMPOS, CAMPO_FLEX)
+
+
+@pytest.mark.parametrize("texto, intencion, fecha, busqueda", [
+    ("¿Qué citas tengo?", "consultar", "", ("", "")),
+    ("pendientes", "consultar", "", ("", "")),
+    ("citas de hoy", "consultar", "hoy", ("", "")),
+    ("recordatorios de mañana", "consultar", "mañana", ("", "")),
+    ("mis citas del 5 de noviembre", "consultar", "5 de noviembre", ("", "")),
+    ("reuniones del 12/11", "consultar", "12/11", ("", "")),
+    ("citas con Ana", "consultar", "", ("cliente", "ana")),
+    ("citas con Ana mañana a las 3", "consultar", "mañana", ("cliente", "ana")),
+    ("reuniones del proyecto Los Pinos", "consultar", "", ("proyecto", "los pinos")),
+    ("recordatorios de numero de cliente 987654321", "consultar", "", ("num_cliente", "987654321")),
+    ("modificar cita con juan", "modificar", "", ("cliente", "juan")),
+    ("modificar la cita del cliente Pedro", "modificar", "", ("cliente", "pedro")),
+])
+def test_resuelve_localmente(router, texto, intencion, fecha, busqueda):
+    resultado = router.clasificar(texto)
+    assert resultado is not None
+    assert resultado["origen"] == "local"
+    assert resultado["intencion"] == intencion
+    assert resultado["fecha"] == fecha
+    assert (resultado["busqueda"]["campo"], resultado["busqueda"]["valor"]) == busqueda
+    assert set(resultado["campos"]) == set(CAMPOS)
+
+
+@pytest.mark.parametrize("texto", [
+    # Crear siempre va a GPT: hay que extraer todos los campos
+    "agenda una cita con Juan mañana",
+    "recuérdame llamar a Ana el viernes",
+    # Modificar con nuevo valor o más criterios tras el valor
+    "cambia la cita con juan a las 5 pm",
+    "modificar la cita con Ana para el lunes",
+    # "con" seguido de otro marcador: el campo no está claro
+    "citas con el cliente Juan",
+    # Sin sustantivo ni verbo reconocible, o texto libre
+    "hola",
+    "cuando veo a Abelardo",
+    "qué tal el clima",
+    "",
+    # Demasiado texto sin reconocer para la confianza mínima
+    "citas que acordamos ayer en la oficina nueva del centro",
+])
+def test_pasa_a_gpt(router, texto):
+    assert router.clasificar(texto) is None
+
+
+def test_estadisticas_y_metrica(router):
+    antes = {r: metricas.ROUTER.valores.get((r,), 0) for r in ("local", "gpt")}
+    router.clasificar("citas de hoy")
+    router.clasificar("hola")
+    assert router.estadisticas() == {"consultas": 2, "aciertos": 1, "tasa_aciertos": 0.5}
+    assert metricas.ROUTER.valores[("local",)] == antes["local"] + 1
+    assert metricas.ROUTER.valores[("gpt",)] == antes["gpt"] + 1
+
+
+@pytest.mark.parametrize("texto", ["sí", "Sí, confirmo", "ok", "dale!", "Perfecto.", "listo, guárdalo"])
+def test_es_afirmacion(texto):
+    assert es_afirmacion(texto)
+
+
+@pytest.mark.parametrize("texto", ["", "no", "sí pero a las 5", "cambia la hora", "ok no", "¿?"])
+def test_no_es_afirmacion(texto):
+    assert not es_afirmacion(texto)
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import notificaciones
+from notificaciones import LIMITE_MENSAJE, SEPARADOR_DIGEST, Despachador, TokenBucket, componer_digest
+
+
+class BotGuionado:
+    # Como BotFalso de benchmarks/fakes.py, pero cada envío puede fallar con
+    # la siguiente excepción del guion de ese chat
+    def __init__(self, guion=None):
+        self.guion = {chat_id: list(errores) for chat_id, errores in (guion or {}).items()}
+        self.intentos = []
+        self.enviados = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.intentos.append(chat_id)
+        errores = self.guion.get(chat_id)
+        if errores:
+            raise errores.pop(0)
+        self.enviados.append((chat_id, text))
+        return len(self.enviados)
+
+
+@pytest.fixture
+def esperas(monkeypatch):
+    # Las esperas de reintento se anotan pero no se duermen de verdad
+    anotadas = []
+    dormir = asyncio.sleep
+
+    async def sleep_rapido(segundos, *args):
+        anotadas.append(segundos)
+        await dormir(0)
+
+    monkeypatch.setattr(notificaciones.asyncio, "sleep", sleep_rapido)
+    return anotadas
+
+
+def despachador(bot):
+    d = Despachador(tasa_global=10000, tasa_chat=10000, tasa_grupo=10000, rafaga_grupo=10000)
+    d.iniciar(bot)
+    return d
+
+
+def test_digest_agrupa_sin_pasar_el_limite():
+    mensajes = [f"Aviso {i}: " + "x" * 900 for i in range(10)]
+    partes = componer_digest(mensajes)
+    assert len(partes) == 3
+    assert all(len(p) <= LIMITE_MENSAJE for p in partes)
+    assert SEPARADOR_DIGEST.join(partes) == SEPARADOR_DIGEST.join(mensajes)
+
+
+def test_digest_corta_un_aviso_mas_largo_que_el_limite():
+    largo = "\n".join("linea %04d " % i + "y" * 40 for i in range(200))
+    partes = componer_digest(["corto", largo])
+    assert all(len(p) <= LIMITE_MENSAJE for p in partes)
+    assert partes[0].startswith("corto" + SEPARADOR_DIGEST)
+    assert "".join(partes).replace("\n", "").count("linea") == 200
+    assert componer_digest([]) == []
+
+
+def test_respeta_retry_after(esperas):
+    async def probar():
+        bot = BotGuionado({1: [RetryAfter(7)]})
+        assert await despachador(bot).enviar(1, "hola") == 1
+        assert bot.intentos == [1, 1]
+        assert 7 in esperas
+    asyncio.run(probar())
+
+
+def test_error_de_red_reintenta_con_espera_creciente(esperas):
+    async def probar():
+        bot = BotGuionado({1: [NetworkError("timeout")] * 4})
+        d = despachador(bot)
+        with pytest.raises(NetworkError):
+            await d.enviar(1, "hola")
+        assert bot.intentos == [1] * 4
+        assert [e for e in esperas if e >= 1] == [1, 2, 4]
+        assert d.fallidos == 1
+    asyncio.run(probar())
+
+
+def test_bad_request_no_se_reintenta(esperas):
+    async def probar():
+        bot = BotGuionado({1: [BadRequest("Can't parse entities")]})
+        d = despachador(bot)
+        with pytest.raises(BadRequest):
+            await d.enviar(1, "*roto")
+        assert bot.intentos == [1]
+        # Un fallo no frena los demás mensajes del chat
+        assert await d.enviar(1, "bien") == 1
+    asyncio.run(probar())
+
+
+def test_orden_por_chat_y_envio_a_grupo():
+    async def probar():
+        bot = BotGuionado()
+        d = despachador(bot)
+        envios = [d.enviar(1, f"m{i}") for i in range(5)] + d.encolar_digest(-100, ["a", "b"])
+        await asyncio.gather(*envios)
+        assert [t for c, t in bot.enviados if c == 1] == [f"m{i}" for i in range(5)]
+        assert (-100, "a" + SEPARADOR_DIGEST + "b") in bot.enviados
+    asyncio.run(probar())
+
+
+def test_canal_inactivo_se_olvida():
+    async def probar():
+        d = despachador(BotGuionado())
+        await d.enviar(1, "hola")
+        canal = d._canales[1]
+        await canal.tarea
+        assert 1 not in d._canales
+    asyncio.run(probar())
+
+
+def test_mensaje_durante_la_recarga_no_se_pierde():
+    async def probar():
+        bot = BotGuionado()
+        d = Despachador(tasa_global=10000, tasa_chat=20)
+        d.iniciar(bot)
+        await d.enviar(1, "primero")
+        tarea = d._canales[1].tarea
+        # El trabajador espera a que el bucket se recargue antes de olvidar el canal
+        await asyncio.sleep(0.01)
+        assert not tarea.done()
+        await d.enviar(1, "segundo")
+        await tarea
+        assert [t for _, t in bot.enviados] == ["primero", "segundo"]
+        assert 1 not in d._canales
+    asyncio.run(probar())
+
+
+def test_token_bucket_limita_la_tasa():
+    reloj = [0.0]
+    bucket = TokenBucket(tasa=2, capacidad=2, reloj=lambda: reloj[0])
+    assert bucket.lleno()
+    bucket.tokens = 0
+    assert bucket.hasta_lleno() == 1.0
+    reloj[0] = 0.5
+    assert not bucket.lleno()
+    assert bucket.hasta_lleno() == 0.5
+    reloj[0] = 10
+    assert bucket.lleno() and bucket.tokens == 2
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+from fechas import LIMA
+from repositorio import PREFIJO_MIN, RepositorioMemoria, campos_derivados, coincide, cursor_de, shard_de, token_busqueda
+
+INICIO = LIMA.localize(datetime(2026, 11, 2, 9, 0))
+
+
+def cita(telegram_id, dt, cliente="Ana Torres", proyecto="Los Pinos"):
+    return {"cliente": cliente, "proyecto": proyecto, "fecha_hora": dt.isoformat(), "telegram_id": telegram_id}
+
+
+def repo_con(citas):
+    docs = {}
+    for i, d in enumerate(citas):
+        docs[f"r{i:03d}"] = dict(d, **campos_derivados(d))
+    return RepositorioMemoria(docs)
+
+
+def recorrer_paginas(consultar, tam):
+    # Sigue los cursores como cargar_pagina: pide tam + 1 para saber si hay más
+    vistas, despues = [], None
+    while True:
+        pagina = asyncio.run(consultar(tam + 1, despues))
+        vistas += [c["doc_id"] for c in pagina[:tam]]
+        if len(pagina) <= tam:
+            return vistas
+        despues = cursor_de(pagina[tam - 1])
+
+
+def test_fecha_hora_se_guarda_en_hora_de_lima():
+    derivados = campos_derivados({"fecha_hora": "2026-11-02T15:00:00+00:00", "telegram_id": 1})
+    assert derivados["fecha_hora"] == "2026-11-02T10:00:00-05:00"
+    assert derivados["fecha_dia"] == "2026-11-02"
+
+
+def test_en_rango_compara_instantes_y_no_texto():
+    # Guardada en UTC: como texto quedaría fuera de la ventana de Lima
+    repo = repo_con([cita(1, datetime.fromisoformat("2026-11-02T15:00:00+00:00"))])
+    citas = asyncio.run(repo.en_rango(INICIO + timedelta(minutes=30), INICIO + timedelta(minutes=90)))
+    assert [c["doc_id"] for c in citas] == ["r000"]
+
+
+def test_en_rango_filtra_por_shard():
+    otro = next(t for t in range(2, 1000) if shard_de(t) != shard_de(1))
+    repo = repo_con([cita(1, INICIO), cita(otro, INICIO)])
+    citas = asyncio.run(repo.en_rango(INICIO, INICIO + timedelta(hours=1), {shard_de(1)}))
+    assert [c["telegram_id"] for c in citas] == [1]
+
+
+def test_paginas_de_pendientes_cubren_todo_sin_repetir():
+    # Varias citas a la misma hora: el doc_id desempata el cursor
+    citas = [cita(1, INICIO + timedelta(hours=i // 3)) for i in range(25)] + [cita(2, INICIO)]
+    repo = repo_con(citas)
+    vistas = recorrer_paginas(lambda limite, despues: repo.pendientes(1, INICIO, limite, despues), 10)
+    assert len(vistas) == 25
+    assert len(set(vistas)) == 25
+    fechas = [repo.docs[doc_id]["fecha_ts"] for doc_id in vistas]
+    assert fechas == sorted(fechas)
+
+
+def test_paginas_por_campo_solo_con_coincidencias():
+    citas = [
+        cita(1, INICIO + timedelta(minutes=i), cliente="Ana Torres" if i % 2 else "Luis Ramos")
+        for i in range(23)
+    ]
+    repo = repo_con(citas)
+    vistas = recorrer_paginas(lambda limite, despues: repo.por_campo(1, "cliente", "ana", limite, despues), 5)
+    assert len(vistas) == 11
+    assert all(repo.docs[doc_id]["cliente"] == "Ana Torres" for doc_id in vistas)
+
+
+def test_por_campo_busca_comienzos_de_palabra():
+    repo = repo_con([cita(1, INICIO, cliente="Abelardo Pérez"), cita(1, INICIO, cliente="Ana Torres")])
+    buscar = lambda valor: [c["cliente"] for c in asyncio.run(repo.por_campo(1, "cliente", valor, 10))]
+    assert buscar("abelardo") == ["Abelardo Pérez"]
+    assert buscar("ABE pe") == ["Abelardo Pérez"]
+    assert buscar("perez abelardo") == ["Abelardo Pérez"]
+    assert buscar("a") == ["Abelardo Pérez", "Ana Torres"]
+    # No es una búsqueda por subcadena
+    assert buscar("elardo") == []
+    assert buscar("rez") == []
+
+
+def test_el_indice_de_prefijos_preselecciona_todo_lo_que_coincide():
+    # Firestore filtra primero por <campo>_tokens array_contains token_busqueda
+    # y luego con coincide: no debe perder nada que coincide en memoria acepte
+    nombres = ["Abelardo Pérez", "María José Quispe", "Constantinopolitano Ruiz", "Iván"]
+    busquedas = ["abe", "ABELARDO pe", "jose maria", "constantinopolitanos", "constantinopolitano", "ivan r", "iv"]
+    for nombre in nombres:
+        d = dict({"cliente": nombre}, **campos_derivados({"cliente": nombre}))
+        for valor in busquedas:
+            token = token_busqueda(valor)
+            if coincide(d, "cliente", valor) and len(token) >= PREFIJO_MIN:
+                assert token in d["cliente_tokens"], (nombre, valor)
+
+
+def test_paginas_por_dia():
+    citas = [cita(1, INICIO + timedelta(hours=i)) for i in range(30)]
+    repo = repo_con(citas)
+    dia = date(2026, 11, 2)
+    vistas = recorrer_paginas(lambda limite, despues: repo.por_dia(1, dia, limite, despues), 4)
+    # De 09:00 a 23:00 del mismo día
+    assert len(vistas) == 15
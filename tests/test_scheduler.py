@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import scheduler
+from fechas import LIMA
+from repositorio import RepositorioMemoria, campos_derivados
+from scheduler import AVISO_PREVIO, REINTENTO, TOLERANCIA_HORA, SchedulerRecordatorios
+
+INICIO = LIMA.localize(datetime(2026, 11, 2, 9, 0))
+
+
+def repo_con(*fechas):
+    docs = {}
+    for i, dt in enumerate(fechas):
+        d = {"cliente": f"cliente {i}", "fecha_hora": dt.isoformat(), "telegram_id": 100 + i}
+        docs[f"r{i}"] = dict(d, **campos_derivados(d))
+    return RepositorioMemoria(docs)
+
+
+class Notificador:
+    def __init__(self, fallar=0):
+        self.enviados = []  # (doc_id, tipo, grupo)
+        self.fallar = fallar
+
+    async def __call__(self, avisos):
+        resultados = []
+        for datos, tipo, grupo in avisos:
+            self.enviados.append((datos["doc_id"], tipo, grupo))
+            if self.fallar:
+                self.fallar -= 1
+                resultados.append(RuntimeError("Telegram caído"))
+            else:
+                resultados.append(None)
+        return resultados
+
+
+async def preparar(repo, now=INICIO):
+    s = SchedulerRecordatorios(repo)
+    await s.cargar_ventana(now - TOLERANCIA_HORA, now + s.ventana)
+    return s
+
+
+def test_dispara_aviso_previo_y_en_la_hora():
+    async def probar():
+        cita = INICIO + timedelta(minutes=30)
+        repo = repo_con(cita)
+        s = await preparar(repo)
+        notificar = Notificador()
+        await s._disparar(cita - AVISO_PREVIO - timedelta(seconds=1), notificar)
+        assert notificar.enviados == []
+        await s._disparar(cita - AVISO_PREVIO, notificar)
+        assert notificar.enviados == [("r0", "10min", True)]
+        await s._disparar(cita, notificar)
+        assert notificar.enviados[-1] == ("r0", "hora", True)
+        assert repo.docs["r0"]["avisado_10min"] and repo.docs["r0"]["avisado_hora"]
+        assert "r0" not in s._recordatorios
+    asyncio.run(probar())
+
+
+def test_heap_en_orden_de_vencimiento():
+    async def probar():
+        repo = repo_con(INICIO + timedelta(minutes=50), INICIO + timedelta(minutes=20), INICIO + timedelta(minutes=35))
+        s = await preparar(repo)
+        notificar = Notificador()
+        for minuto in range(0, 61):
+            await s._disparar(INICIO + timedelta(minutes=minuto), notificar)
+        assert [doc_id for doc_id, tipo, _ in notificar.enviados if tipo == "hora"] == ["r1", "r2", "r0"]
+    asyncio.run(probar())
+
+
+def test_reprogramar_descarta_las_entradas_antiguas():
+    async def probar():
+        cita = INICIO + timedelta(minutes=30)
+        repo = repo_con(cita)
+        s = await preparar(repo)
+        nueva = cita + timedelta(minutes=20)
+        await s.actualizar("r0", {"fecha_hora": nueva.isoformat()})
+        notificar = Notificador()
+        await s._disparar(cita, notificar)
+        assert notificar.enviados == []
+        await s._disparar(nueva - AVISO_PREVIO, notificar)
+        assert notificar.enviados == [("r0", "10min", True)]
+    asyncio.run(probar())
+
+
+def test_fuera_de_ventana_no_se_programa():
+    async def probar():
+        s = await preparar(repo_con(INICIO + timedelta(hours=3)))
+        assert s._heap == []
+    asyncio.run(probar())
+
+
+def test_reintenta_envio_fallido_sin_repetir_el_grupo():
+    async def probar():
+        cita = INICIO + timedelta(minutes=30)
+        repo = repo_con(cita)
+        s = await preparar(repo)
+        notificar = Notificador(fallar=1)
+        await s._disparar(cita - AVISO_PREVIO, notificar)
+        assert not repo.docs["r0"].get("avisado_10min")
+        await s._disparar(cita - AVISO_PREVIO + REINTENTO, notificar)
+        assert notificar.enviados == [("r0", "10min", True), ("r0", "10min", False)]
+        assert repo.docs["r0"]["avisado_10min"]
+    asyncio.run(probar())
+
+
+def test_aviso_vencido_se_marca_sin_enviar():
+    async def probar():
+        cita = INICIO + timedelta(minutes=30)
+        s = await preparar(repo_con(cita))
+        notificar = Notificador()
+        await s._disparar(cita + TOLERANCIA_HORA + timedelta(seconds=1), notificar)
+        assert notificar.enviados == []
+    asyncio.run(probar())
+
+
+def test_run_sobrevive_a_un_fallo_de_carga(monkeypatch):
+    class RepoInestable(RepositorioMemoria):
+        lecturas = 0
+
+        async def en_rango(self, desde, hasta, shards=None):
+            self.lecturas += 1
+            if self.lecturas == 1:
+                raise RuntimeError("Firestore no disponible")
+            return await super().en_rango(desde, hasta, shards)
+
+    async def probar():
+        monkeypatch.setattr(scheduler, "REINTENTO", timedelta(milliseconds=20))
+        base = repo_con(INICIO + timedelta(minutes=5))
+        repo = RepoInestable(base.docs)
+        s = SchedulerRecordatorios(repo)
+        s._ahora = lambda: INICIO
+        notificar = Notificador()
+        tarea = asyncio.create_task(s.run(notificar))
+        await asyncio.sleep(0.2)
+        assert not tarea.done()
+        tarea.cancel()
+        assert repo.lecturas >= 2
+        assert ("r0", "10min", True) in notificar.enviados
+    asyncio.run(probar())
@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import CABECERA_SECRETO, crear_servidor
+
+SECRETO = "secreto"
+
+
+def app_falsa():
+    return SimpleNamespace(bot=None, running=True, update_queue=asyncio.Queue())
+
+
+def publicar(app, cuerpo, secreto=SECRETO):
+    async def probar():
+        async with TestClient(TestServer(crear_servidor(app, SECRETO))) as cliente:
+            respuesta = await cliente.post("/telegram", data=cuerpo, headers={CABECERA_SECRETO: secreto})
+            return respuesta.status
+    return asyncio.run(probar())
+
+
+def test_rechaza_secreto_incorrecto():
+    app = app_falsa()
+    assert publicar(app, '{"update_id": 1}', secreto="otro") == 403
+    assert app.update_queue.empty()
+
+
+def test_rechaza_json_invalido_o_que_no_es_un_objeto():
+    app = app_falsa()
+    for cuerpo in ["{", "[]", '"texto"', "1", "null"]:
+        assert publicar(app, cuerpo) == 400, cuerpo
+    assert app.update_queue.empty()
+
+
+def test_encola_un_update_valido():
+    app = app_falsa()
+    assert publicar(app, '{"update_id": 7}') == 200
+    assert app.update_queue.get_nowait().update_id == 7
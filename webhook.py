@@ -0,0 +1,70 @@
+import asyncio
+import hmac
+from aiohttp import web
+from telegram import Update
+
+CABECERA_SECRETO = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def crear_servidor(app, secreto, ruta="/telegram"):
+    # Servidor HTTP que recibe los updates de Telegram y los pasa a la
+    # update_queue de la Application, donde los procesan los mismos
+    # handlers que en modo polling.
+
+    async def recibir_update(request):
+        recibido = request.headers.get(CABECERA_SECRETO, "")
+        if not secreto or not hmac.compare_digest(recibido, secreto):
+            return web.Response(status=403)
+        try:
+            datos = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="JSON inválido")
+        if not isinstance(datos, dict):
+            # JSON válido pero no un objeto ([], "x", 1): no es un update
+            return web.Response(status=400, text="El update debe ser un objeto JSON")
+        update = Update.de_json(datos, app.bot)
+        if update is None:
+            return web.Response(status=400, text="Update vacío")
+        await app.update_queue.put(update)
+        return web.Response(text="ok")
+
+    async def salud(request):
+        return web.json_response({
+            "ok": app.running,
+            "updates_pendientes": app.update_queue.qsize(),
+        })
+
+    servidor = web.Application()
+    servidor.router.add_post(ruta, recibir_update)
+    servidor.router.add_get("/salud", salud)
+    return servidor
+
+
+async def servir(app, secreto, host="0.0.0.0", puerto=8080, ruta="/telegram", url_publica=None, tareas=()):
+    # Arranca la Application sin polling, registra el webhook (si hay URL
+    # pública) y ejecuta las tareas de fondo en el mismo event loop.
+    # Sin url_publica sirve sólo en local: se prueba con
+    #   curl -X POST localhost:8080/telegram -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRETO" \
+    #        -H "Content-Type: application/json" -d @ejemplos/update_mensaje.json
+    async with app:
+        if url_publica:
+            await app.bot.set_webhook(
+                url=url_publica.rstrip("/") + ruta,
+                secret_token=secreto,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await app.start()
+        fondo = [asyncio.create_task(t) for t in tareas]
+        runner = web.AppRunner(crear_servidor(app, secreto, ruta))
+        await runner.setup()
+        await web.TCPSite(runner, host, puerto).start()
+        print(f"Webhook escuchando en {host}:{puerto}{ruta}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            for tarea in fondo:
+                tarea.cancel()
+            # Se espera a que terminen: liberan shards y vuelcan estados
+            await asyncio.gather(*fondo, return_exceptions=True)
+            await runner.cleanup()
+            await app.stop()